@@ -0,0 +1,92 @@
+import pygame
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from settings import *
+
+# Loads an image file and scales it, on one of the asset manager's threads.
+def load_image_file(filename, size=None):
+    image = pygame.image.load(filename)
+    if size is not None:
+        image = pygame.transform.scale(image, size)
+    return image
+
+class AssetHandle:
+    '''A class to wait for an asset which is being loaded in the background.'''
+    # The finish function is run on the thread that first asks for the asset (e.g. to convert an image for the screen).
+    # A handle without a future just runs the finish function, which makes assets that are worked out on first use.
+    def __init__(self, future=None, finish=None):
+        self.future = future
+        self.finish = finish
+        self.loaded = False
+        self.value = None
+
+    # Checks if the asset can be used without waiting.
+    def ready(self):
+        return self.loaded or self.future is None or self.future.done()
+
+    # Returns the asset, waiting for it to finish loading if it has not yet.
+    def get(self):
+        if not self.loaded:
+            value = self.future.result() if self.future is not None else None
+            if self.finish is not None:
+                value = self.finish(value)
+            self.value = value
+            self.loaded = True
+        return self.value
+
+class SoundHandle:
+    '''A class to manage a sound which is decoded the first time it is played, unless it was preloaded.'''
+    def __init__(self, manager, filename, preload=False):
+        self.manager = manager
+        self.filename = filename
+        self.sound = None
+        self.future = manager.submit(pygame.mixer.Sound, filename) if preload else None
+
+    def get(self):
+        if self.sound is None:
+            if self.future is not None:
+                self.sound = self.future.result()
+            else:
+                self.sound = pygame.mixer.Sound(self.filename)
+        return self.sound
+
+    def play(self, *args, **kwargs):
+        return self.get().play(*args, **kwargs)
+
+class AssetManager:
+    '''A class to load images and sounds on a pool of threads, so the game does not wait for every file before it starts.'''
+    def __init__(self, workers=ASSET_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Every asset is cached by its file (and size), so no file is ever decoded twice.
+        self.cache = {}
+        self.lock = Lock()
+
+    def submit(self, function, *args):
+        return self.executor.submit(function, *args)
+
+    # Starts loading an image in the background and returns a handle to it.
+    # The image is converted for the screen when it is first used, since that has to happen on the main thread.
+    def image(self, filename, size=None):
+        key = ('image', filename, size)
+        with self.lock:
+            if key not in self.cache:
+                future = self.submit(load_image_file, filename, size)
+                self.cache[key] = AssetHandle(future, lambda image: image.convert_alpha())
+            return self.cache[key]
+
+    # Returns a handle to a sound, which starts decoding straight away if preload is True.
+    def sound(self, filename, preload=PRELOAD_SOUNDS):
+        key = ('sound', filename)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = SoundHandle(self, filename, preload)
+            return self.cache[key]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+# Makes a game attribute which returns a background-loaded asset, only waiting for it the first time it is read.
+def asset_property(name):
+    def get(game):
+        return game.asset_handles[name].get()
+    return property(get)
@@ -0,0 +1,81 @@
+import pygame
+from settings import *
+
+class SoundManager:
+    '''A class to play the sound effects on channels set aside for each sound, at most once a frame each.'''
+    # Sounds asked for during a frame are only played when flush() is called at the end of it, so a sound that is
+    # asked for by a hundred collisions in one frame is played once. A sound is also dropped if it was played less than
+    # its SOUND_COOLDOWN ago, and when all of its channels are busy it cuts off the oldest or least important sound.
+    def __init__(self, sounds):
+        self.sounds = sounds
+        # Gives every sound its own channels, and reserves them so pygame never picks them for any other sound.
+        self.pools = {}
+        channels = 0
+        for name in sounds:
+            count = max(1, SOUND_CHANNELS.get(name, 1))
+            self.pools[name] = list(range(channels, channels + count))
+            channels += count
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), channels))
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(index) for index in range(channels)]
+        # When the sound on each channel started, used to pick the oldest sound to cut off.
+        self.started = [0] * channels
+        self.requested = set()
+        self.last_played = {}
+
+    # Asks for a sound to be played at the end of this frame.
+    def play(self, name):
+        self.requested.add(name)
+
+    # Plays the sounds asked for this frame, the most important first. Returns how many were played.
+    def flush(self, now):
+        played = 0
+        for name in sorted(self.requested, key=lambda name: -SOUND_PRIORITY.get(name, 0)):
+            last = self.last_played.get(name)
+            if last is not None and now - last < SOUND_COOLDOWN.get(name, 0):
+                continue
+            index = self.find_channel(name)
+            self.channels[index].play(self.sounds[name].get())
+            self.started[index] = now
+            self.last_played[name] = now
+            played += 1
+        self.requested.clear()
+        return played
+
+    # Picks the channel to play a sound on: a free channel of its own, then a channel of a sound with a lower priority
+    # (free, or else the least important and oldest), then the channel of its own whose sound started longest ago.
+    def find_channel(self, name):
+        for index in self.pools[name]:
+            if not self.channels[index].get_busy():
+                return index
+        priority = SOUND_PRIORITY.get(name, 0)
+        best = None
+        for other, pool in self.pools.items():
+            other_priority = SOUND_PRIORITY.get(other, 0)
+            if other != name and other_priority >= priority:
+                continue
+            for index in pool:
+                # A free channel counts as the least important one there is.
+                if not self.channels[index].get_busy():
+                    key = (-1, 0)
+                else:
+                    key = (other_priority, self.started[index])
+                if best is None or key < best[0]:
+                    best = (key, index)
+        return best[1]
+
+    def stop(self):
+        self.requested.clear()
+        for channel in self.channels:
+            channel.stop()
+
+class NullAudio:
+    '''A sound manager which plays nothing, used in headless games and when sound effects are turned off.'''
+    def play(self, name):
+        pass
+
+    def flush(self, now):
+        return 0
+
+    def stop(self):
+        pass
@@ -0,0 +1,291 @@
+# Benchmarks for the parts of the game that get slower as more sprites are added.
+# Run every scenario with: python benchmark.py
+# Run some of them with: python benchmark.py wizard_swarm stone_spam
+# Every run is compared against the baseline in benchmark_baseline.json, and any scenario whose p95 frame time got
+# more than BASELINE_TOLERANCE slower fails the run. Frame times depend on the machine, so the committed baseline only
+# holds for the machine it was saved on: save one on the machine that runs the comparison before trusting it, with
+# python benchmark.py --save-baseline
+# Recorded games can be run as scenarios too: python benchmark.py --replay session.dglog
+# Run them with the frame governor keeping frames within a budget (in ms): python benchmark.py --budget 16.7
+import sys
+import json
+import time
+import random
+import argparse
+import pygame
+from os import path
+from types import SimpleNamespace
+from settings import *
+from sprites import Wizard, Collectible
+from spatial import SpatialHash
+from tilemap import GeneratedMap, MapObject
+from controls import ScriptedInput
+from dungeon_game import DungeonGame
+from governor import FrameGovernor, QUALITY_STEPS
+from replay import InputLog, state_digest
+
+# Number of wizards used for each step of the wizard scaling check.
+SCALING_COUNTS = [10, 100, 1000, 5000]
+# How many times slower a wizard may get at 5000 wizards than at 10 before the scaling check fails.
+SCALING_LIMIT = 3
+# Runs timed for each number of wizards (the median is used), and the shortest time (in seconds) one run may take.
+SCALING_RUNS = 5
+SCALING_RUN_TIME = .05
+
+# File the benchmark results are compared against.
+BASELINE_FILE = path.join(path.dirname(__file__), 'benchmark_baseline.json')
+# How much slower (as a fraction) a scenario's frame times may get than the baseline before it counts as a regression.
+BASELINE_TOLERANCE = .2
+
+# The stress scenarios. Each one says which map to use, how many sprites to spawn, which keys the knight holds down
+# and for how many frames to run, and optionally which wizard backend to use.
+# A map of None is the Tiled dungeon map, otherwise it is the size of a generated map in tiles.
+SCENARIOS = {
+    'wizard_swarm': {'map': None, 'wizards': 500, 'stones': 0, 'collectibles': 20,
+                     'keys': [pygame.K_UP, pygame.K_LEFT], 'frames': 600},
+    'stone_spam': {'map': None, 'wizards': 150, 'stones': 50, 'collectibles': 0,
+                   'keys': [pygame.K_SPACE, pygame.K_LEFT], 'frames': 600},
+    'huge_map': {'map': (500, 500), 'wizards': 300, 'stones': 0, 'collectibles': 50,
+                 'keys': [pygame.K_UP, pygame.K_LEFT, pygame.K_SPACE], 'frames': 600},
+    'horde': {'map': (500, 500), 'wizards': 10000, 'stones': 0, 'collectibles': 0, 'backend': 'arrays',
+              'keys': [pygame.K_UP, pygame.K_LEFT, pygame.K_SPACE], 'frames': 600},
+    'soak': {'map': None, 'wizards': 100, 'stones': 0, 'collectibles': 10,
+             'keys': [pygame.K_UP, pygame.K_LEFT, pygame.K_SPACE], 'frames': 36000},
+}
+
+# Creates just enough of a game for wizards to be spawned without opening a window.
+# The wizards are spread over a square that grows with the number of wizards, so that there is always about one
+# wizard per AVOID_RADIUS square. The square is surrounded by a border AVOID_RADIUS wide with just as many wizards in it,
+# so the wizards at the edge of the square have as many neighbours as the ones in the middle.
+# Returns the game and the wizards in the square (the ones that are timed).
+def make_wizard_game(count, seed=0):
+    game = SimpleNamespace()
+    game.all_sprites = pygame.sprite.LayeredUpdates()
+    game.wizards = pygame.sprite.Group()
+    game.wizard_image = pygame.Surface((24, 24))
+    game.wizard_grid = SpatialHash(AVOID_RADIUS)
+    game.random = random.Random(seed)
+    rng = random.Random(seed)
+    side = (count * AVOID_RADIUS * AVOID_RADIUS) ** .5
+    timed = [Wizard(game, rng.uniform(0, side), rng.uniform(0, side)) for _ in range(count)]
+    outer = side + 2 * AVOID_RADIUS
+    border = int(round((outer * outer - side * side) / (AVOID_RADIUS * AVOID_RADIUS)))
+    while border:
+        x = rng.uniform(-AVOID_RADIUS, side + AVOID_RADIUS)
+        y = rng.uniform(-AVOID_RADIUS, side + AVOID_RADIUS)
+        if not (0 <= x < side and 0 <= y < side):
+            Wizard(game, x, y)
+            border -= 1
+    game.wizard_grid.rebuild(game.wizards)
+    return game, timed
+
+# Times wizard separation for the wizards of a make_wizard_game() and returns the time per wizard in seconds.
+# Each run goes over the wizards as many times as it takes to last at least SCALING_RUN_TIME, so a handful of
+# wizards is timed as reliably as thousands. The median of the runs is returned.
+def time_avoid_wizards(count, runs=SCALING_RUNS):
+    game, timed = make_wizard_game(count)
+    repeats = max(1, int(SCALING_RUN_TIME / (count * 10e-6)))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for wizard in timed:
+                wizard.acceleration = pygame.math.Vector2(0, 0)
+                wizard.avoid_wizards()
+        times.append((time.perf_counter() - start) / (repeats * count))
+    return percentile(sorted(times), .5)
+
+# Checks that the cost of wizard separation grows about linearly with the number of wizards.
+def wizard_scaling():
+    results = {}
+    for count in SCALING_COUNTS:
+        results[count] = time_avoid_wizards(count)
+        print('{:>6} wizards: {:8.2f} us per wizard, {:8.2f} ms per frame'.format(
+            count, results[count] * 1e6, results[count] * count * 1e3))
+    ratio = results[SCALING_COUNTS[-1]] / results[SCALING_COUNTS[0]]
+    print('Cost per wizard grew {:.2f}x from {} to {} wizards.'.format(ratio, SCALING_COUNTS[0], SCALING_COUNTS[-1]))
+    return ratio <= SCALING_LIMIT
+
+# Makes a map with a wall around the edge and a lattice of single-tile pillars inside it,
+# with the knight spawning in the middle.
+def make_lattice_map(width, height, spacing=4):
+    objects = [MapObject('wall', 0, 0, width * TILESIZE, TILESIZE),
+               MapObject('wall', 0, (height - 1) * TILESIZE, width * TILESIZE, TILESIZE),
+               MapObject('wall', 0, TILESIZE, TILESIZE, (height - 2) * TILESIZE),
+               MapObject('wall', (width - 1) * TILESIZE, TILESIZE, TILESIZE, (height - 2) * TILESIZE)]
+    for x in range(spacing, width - 1, spacing):
+        for y in range(spacing, height - 1, spacing):
+            objects.append(MapObject('wall', x * TILESIZE, y * TILESIZE, TILESIZE, TILESIZE))
+    # Moves the knight's spawn half a gap off the lattice so it does not start inside a pillar.
+    objects.append(MapObject('knight', (width // 2 + spacing / 2) * TILESIZE, (height // 2 + spacing / 2) * TILESIZE, 0, 0))
+    return GeneratedMap(width, height, objects)
+
+# Finds a random spot on the map that is not inside a wall.
+def random_open_position(game, rng):
+    rect = WIZARD_HIT_RECT.copy()
+    while True:
+        x = rng.uniform(TILESIZE, game.map.width - TILESIZE)
+        y = rng.uniform(TILESIZE, game.map.height - TILESIZE)
+        rect.center = (x, y)
+        if not game.wall_grid.collideany(rect):
+            return x, y
+
+# Adds the scenario's extra wizards, stones and health potions to a game that has just been started.
+def spawn_sprites(game, scenario, rng):
+    for _ in range(scenario['wizards']):
+        game.spawn_wizard(*random_open_position(game, rng))
+    for _ in range(scenario['collectibles']):
+        Collectible(game, *random_open_position(game, rng), 'health')
+    for _ in range(scenario['stones']):
+        direction = pygame.math.Vector2(1, 0).rotate(rng.uniform(0, 360))
+        game.stones.spawn(random_open_position(game, rng), direction)
+
+# Returns the value below which the given fraction of the sorted values fall.
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+# Runs one scenario headless through the game's own update() and draw() and returns its frame time statistics.
+# With a budget (in milliseconds), the frame governor turns the quality down whenever frames take longer than that.
+def run_scenario(name, scenario, frames=None, seed=0, budget=None):
+    frames = frames or scenario['frames']
+    game_map = make_lattice_map(*scenario['map']) if scenario['map'] is not None else None
+    controls = ScriptedInput()
+    controls.press(*scenario['keys'])
+    game = DungeonGame(headless=True, input_provider=controls, seed=seed, game_map=game_map,
+                       wizard_backend=scenario.get('backend', 'sprites'))
+    if budget is not None:
+        game.governor = FrameGovernor(budget)
+    game.new()
+    spawn_sprites(game, scenario, random.Random(seed))
+    frame_times = []
+    quality_levels = []
+    for _ in range(frames):
+        quality_levels.append(game.governor.level)
+        start = time.perf_counter()
+        game.step(SIM_DT, draw=True)
+        frame_times.append(time.perf_counter() - start)
+        if budget is not None:
+            game.governor.add_frame(frame_times[-1] * 1000)
+        # Keeps the knight alive so the scenario always runs for its full length.
+        game.knight.health = KNIGHT_HEALTH
+        game.playing = True
+    return frame_statistics(game, frame_times, quality_levels)
+
+# Replays a recorded input log headless, drawing every frame, and returns its frame time statistics.
+# The replay also has to end in the same state as the recording, otherwise 'diverged' is set.
+def run_replay(filename):
+    log = InputLog(filename)
+    game = DungeonGame(headless=True, seed=log.seed, wizard_backend=log.backend, replay=log)
+    game.new()
+    frame_times = []
+    while game.playing:
+        start = time.perf_counter()
+        game.step(draw=True)
+        frame_times.append(time.perf_counter() - start)
+    result = frame_statistics(game, frame_times)
+    result['diverged'] = log.digest is not None and state_digest(game) != log.digest
+    return result
+
+# Works out the frame time statistics of a run, and how many of its frames were at each quality level.
+def frame_statistics(game, frame_times, quality_levels=None):
+    frames = len(frame_times)
+    total = sum(frame_times)
+    # Runs without a frame governor (e.g. replays) are at full quality all the way through.
+    if quality_levels is None:
+        quality_levels = [0] * frames
+    # Compares the first and last tenth of the run, so a soak run shows whether frames slow down over time.
+    tenth = max(1, frames // 10)
+    ordered = sorted(frame_times)
+    return {
+        'frames': frames,
+        'fps': frames / total,
+        'p50': percentile(ordered, .50) * 1000,
+        'p95': percentile(ordered, .95) * 1000,
+        'p99': percentile(ordered, .99) * 1000,
+        'first_tenth_ms': sum(frame_times[:tenth]) / tenth * 1000,
+        'last_tenth_ms': sum(frame_times[-tenth:]) / tenth * 1000,
+        'sprites': len(game.all_sprites) + (len(game.horde) if game.horde is not None else 0),
+        'walls': len(game.walls),
+        # How few rectangles the walls could be merged into (see spatial.py), worked out only for the report.
+        'merged_walls': len(game.wall_mask.merged_rects(game.walls)),
+        # How many wizard sprites were near, far and asleep on the last frame (see lod.py).
+        'ai_tiers': dict(game.ai.counts),
+        # Frames run at each quality level of the frame governor (see governor.py), from full quality down.
+        'quality_levels': [quality_levels.count(level) for level in range(len(QUALITY_STEPS) + 1)],
+    }
+
+# Lists the scenarios whose p95 frame time got slower than the baseline by more than the tolerance.
+# Scenarios run for a different number of frames than the baseline (e.g. with --frames) are not compared.
+def find_regressions(results, baseline, tolerance=BASELINE_TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result['frames'] != baseline[name]['frames']:
+            print('Not comparing {} with the baseline: it ran {} frames, the baseline ran {}'.format(
+                name, result['frames'], baseline[name]['frames']))
+            continue
+        if result['p95'] > baseline[name]['p95'] * (1 + tolerance):
+            regressions.append((name, baseline[name]['p95'], result['p95']))
+    return regressions
+
+def print_result(name, result):
+    print('{:<14} {:8.1f} fps  p50 {:6.2f} ms  p95 {:6.2f} ms  p99 {:6.2f} ms  '
+          '(first tenth {:.2f} ms, last tenth {:.2f} ms, {} walls merged into {})'.format(
+              name, result['fps'], result['p50'], result['p95'], result['p99'],
+              result['first_tenth_ms'], result['last_tenth_ms'], result['walls'], result['merged_walls']))
+    print('{:<14} wizards near {near}, far {far}, asleep {asleep}'.format('', **result['ai_tiers']))
+    levels = result.get('quality_levels', [])
+    if sum(levels[1:]):
+        # Each level is named after the work it turns down, on top of the work every level above it turns down.
+        names = ['full'] + QUALITY_STEPS
+        print('{:<14} frames at each quality level: {}'.format('', ', '.join(
+            '{} {}'.format(names[level], count) for level, count in enumerate(levels))))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game with scripted stress scenarios.')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default: all of them and the wizard scaling check)')
+    parser.add_argument('--frames', type=int, help='frames to run each scenario for, instead of its own length')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--replay', action='append', default=[], metavar='LOG',
+                        help='also run a recorded input log (see replay.py) as a scenario')
+    parser.add_argument('--budget', type=float, metavar='MS',
+                        help='let the frame governor turn the quality down to keep frames within this many ms')
+    args = parser.parse_args()
+
+    names = args.scenarios or ([] if args.replay else ['scaling'] + list(SCENARIOS))
+    failed = False
+    if 'scaling' in names:
+        failed = not wizard_scaling()
+    results = {}
+    for name in names:
+        if name == 'scaling':
+            continue
+        results[name] = run_scenario(name, SCENARIOS[name], args.frames, args.seed, args.budget)
+        print_result(name, results[name])
+    for filename in args.replay:
+        name = 'replay:' + path.basename(filename)
+        results[name] = run_replay(filename)
+        print_result(name, results[name])
+        if results[name]['diverged']:
+            print('DIVERGED {}: the replay did not end in the same state as the recording'.format(name))
+            failed = True
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+        print('Saved baseline to {}'.format(args.baseline))
+    elif path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        for name, before, after in find_regressions(results, baseline):
+            print('REGRESSION {}: p95 {:.2f} ms -> {:.2f} ms'.format(name, before, after))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
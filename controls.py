@@ -0,0 +1,63 @@
+import pygame
+from settings import *
+
+class KeyState:
+    '''A class which looks like pygame.key.get_pressed() for a set of keys that are held down.'''
+    def __init__(self, held):
+        self.held = frozenset(held)
+
+    def __getitem__(self, key):
+        return key in self.held
+
+class KeyboardInput:
+    '''A class to read the knight's controls from the keyboard.'''
+    def get_pressed(self, game):
+        return pygame.key.get_pressed()
+
+class ScriptedInput:
+    '''A class to control the knight from code instead of the keyboard.'''
+    # The script is an optional function which is given the game and returns the keys to hold down that frame.
+    # Without a script, keys are held down with press() and let go with release().
+    def __init__(self, script=None):
+        self.script = script
+        self.held = set()
+
+    def press(self, *keys):
+        self.held.update(keys)
+
+    def release(self, *keys):
+        self.held.difference_update(keys)
+
+    def get_pressed(self, game):
+        if self.script is not None:
+            return KeyState(self.script(game))
+        return KeyState(self.held)
+
+class BotInput:
+    '''A class to let a simple bot play the knight, e.g. for running many games without a player.'''
+    # The bot turns towards the closest wizard, throws stones once it is facing it,
+    # and walks forwards or backwards to keep that wizard between BOT_NEAR and BOT_FAR pixels away.
+    def get_pressed(self, game):
+        knight = game.knight
+        wizards = list(game.wizards)
+        if game.horde is not None:
+            wizards += list(game.horde)
+        if not wizards:
+            return KeyState([])
+        closest = min(wizards, key=lambda wizard: knight.position.distance_squared_to(wizard.position))
+        offset = closest.position - knight.position
+        distance = offset.length()
+        # How far the knight has to turn to face the wizard, between -180 and 180 degrees.
+        turn = (offset.angle_to(pygame.math.Vector2(1, 0)) - knight.rotation + 180) % 360 - 180
+        keys = []
+        if turn > BOT_AIM:
+            keys.append(pygame.K_LEFT)
+        elif turn < -BOT_AIM:
+            keys.append(pygame.K_RIGHT)
+        else:
+            keys.append(pygame.K_SPACE)
+        if distance > BOT_FAR:
+            keys.append(pygame.K_UP)
+        elif distance < BOT_NEAR:
+            keys.append(pygame.K_DOWN)
+        return KeyState(keys)
@@ -1,53 +1,65 @@
 import pygame
+import os
 import sys
+import random
 from os import path
 from settings import *
 from sprites import *
 from tilemap import *
-
-# A function which displays the amount of health the knight has remaining.
-# A rectangle appears in the top left side of the screen and changes color and gets shorter as the knight loses health.
-def draw_knight_health(surface, x, y, health_percentage):
-    # Makes sure the knight doesn't have negative health.
-    if health_percentage < 0:
-        health_percentage = 0
-    BAR_LENGTH = 100
-    BAR_HEIGHT = 20
-    # Sets the length of the health bar as a proportion of the knight's health.
-    fill = health_percentage * BAR_LENGTH
-    # Creates an outline for the health bar.
-    outline_rect = pygame.Rect(x, y, BAR_LENGTH, BAR_HEIGHT)
-    # Fills the entire length of the rectangle with color.
-    fill_rect = pygame.Rect(x, y, fill, BAR_HEIGHT)
-    # Checks the health percentage of the knight and sets the color accordingly.
-    if health_percentage > .90:
-        color = HEALTH_100
-    elif health_percentage > .80:
-        color = HEALTH_90
-    elif health_percentage > .70:
-        color = HEALTH_80
-    elif health_percentage > .60:
-        color = HEALTH_70
-    elif health_percentage > .50:
-        color = HEALTH_60
-    elif health_percentage > .40:
-        color = HEALTH_50
-    elif health_percentage > .30:
-        color = HEALTH_40
-    elif health_percentage > .20:
-        color = HEALTH_30
-    elif health_percentage > .10:
-        color = HEALTH_20
-    elif health_percentage >= 0:
-        color = HEALTH_10
-    # Draws the colored part of the health bar.
-    pygame.draw.rect(surface, color, fill_rect)
-    # Draws the outline of the health bar.
-    pygame.draw.rect(surface, WHITE, outline_rect, 2)
+from spatial import *
+from rotation import *
+from controls import *
+from profiler import *
+from mapcache import load_map
+from assets import *
+from projectiles import *
+from pathfinding import *
+from horde import *
+from replay import InputRecorder, ReplayInput
+from hud import *
+from audio import *
+from lod import *
+from savestate import *
+from streaming import *
+from governor import *
 
 class DungeonGame:
     '''A class to manage the game.'''
-    def __init__(self):
+    # Images are loaded in the background and only waited for the first time they are used (see assets.py).
+    knight_image = asset_property('knight_image')
+    stone_image = asset_property('stone_image')
+    wizard_image = asset_property('wizard_image')
+    wall_image = asset_property('wall_image')
+    cross = asset_property('cross')
+    health = asset_property('health')
+    knight_rotations = asset_property('knight_rotations')
+    wizard_rotations = asset_property('wizard_rotations')
+
+    # A headless game uses SDL's dummy video and audio drivers, so no window is opened and it can be stepped from code.
+    # The input provider replaces the keyboard (see controls.py), and the seed makes the random wizard speeds repeatable.
+    # With profile turned on, every frame is timed, and written to profile_file (CSV or .jsonl) if one is given.
+    # A game_map (e.g. a GeneratedMap) can be passed in to play on instead of the Tiled dungeon map.
+    # With dirty_rects turned on, only the changed parts of the screen are redrawn while the camera is still.
+    # The wizard backend is 'sprites' (one Wizard sprite each) or 'arrays' (every wizard moved at once by a WizardHorde).
+    # In a window, the game is simulated tick_rate times a second and drawn at most render_fps times a second.
+    # With a record_file, the input of every tick is written to an input log, and a replay (an InputLog from replay.py)
+    # plays one back instead of reading the input.
+    def __init__(self, headless=False, input_provider=None, seed=None, profile=False, profile_file=None, game_map=None,
+                 dirty_rects=DIRTY_RECTS, wizard_backend=WIZARD_BACKEND, tick_rate=TICK_RATE, render_fps=FPS,
+                 record_file=None, replay=None):
+        self.headless = headless
+        self.wizard_backend = wizard_backend
+        self.tick_dt = 1 / tick_rate
+        self.render_fps = render_fps
+        # Headless games are stepped one tick at a time and drawn at the tick, so they never need to interpolate.
+        self.interpolate = INTERPOLATE and not headless
+        # How far the frame being drawn is between the last tick and the next one (1 draws everything at the last tick).
+        self.alpha = 1
+        self.dirty_rects = dirty_rects
+        self.game_map = game_map
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
         pygame.init()
         # Sets the screen dimensions.
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
@@ -57,12 +69,41 @@ class DungeonGame:
         # When a key is held down, there is a .5 s delay before a KEYDOWN event is sent.
         # If the key is still held down after the initial delay, KEYDOWN events are sent every .1 s.
         pygame.key.set_repeat(500, 100)
+        self.input = input_provider if input_provider is not None else KeyboardInput()
+        # A recorded game needs a seed, so the replay can spawn the same wizards.
+        if record_file is not None and seed is None:
+            seed = random.randrange(2 ** 32)
+        self.recorder = None
+        self.replay = None
+        if replay is not None:
+            self.replay = ReplayInput(replay)
+            self.input = self.replay
+        elif record_file is not None:
+            self.recorder = InputRecorder(self.input, record_file, seed, self.tick_dt, wizard_backend)
+            self.input = self.recorder
+        self.random = random.Random(seed)
+        # The game clock in milliseconds. It moves forward by the length of a tick every tick, in a window or headless.
+        self.now = 0
+        self.time = SIM_DT
+        if profile or profile_file is not None:
+            self.profiler = FrameProfiler(profile_file)
+        else:
+            self.profiler = NullProfiler()
+        # The world as it was first built, which every restart puts back (see savestate.py), and the sprites it reuses.
+        self.initial_state = None
+        self.sprite_pool = SpritePool()
+        # Turns down the most expensive work while frames take longer than the frame cap allows (see governor.py).
+        # Headless games, recorded games and replays are always played at full quality, so their ticks play out
+        # the same every time (the benchmark gives a headless game a governor of its own when asked to).
+        if FRAME_GOVERNOR and not headless and record_file is None and replay is None:
+            self.governor = FrameGovernor(1000 / render_fps)
+        else:
+            self.governor = NullGovernor()
         self.load_data()
 
-    # A function which displays text onto the screen when the game is paused.
+    # A function which displays text onto the screen (the font and the rendered text are cached by the HUD).
     def draw_text(self, text, font_name, size, color, x, y, align):
-        font = pygame.font.Font(font_name, size)
-        text_surface = font.render(text, True, color)
+        text_surface = self.hud.text.render(text, font_name, size, color)
         text_rect = text_surface.get_rect()
         if align == 'top':
             text_rect.midbottom = (x, y)
@@ -76,43 +117,64 @@ class DungeonGame:
         music_folder = path.join(game_folder, 'music')
         sound_folder = path.join(game_folder, 'sounds')
         self.font = path.join(image_folder, 'DUNGEON.TTF')
-        self.dim_screen = pygame.Surface(self.screen.get_size()).convert_alpha()
-        self.dim_screen.fill((0, 0, 0, 120))
-        self.map = TiledMap(path.join(map_folder, 'Dungeon_Map.tmx'))
-        self.map_image = self.map.make_map()
-        self.map_rect = self.map_image.get_rect()
-        self.knight_image = pygame.image.load(path.join(image_folder, KNIGHT_IMAGE)).convert_alpha()
-        self.knight_image = pygame.transform.scale(self.knight_image, (24, 24))
-        self.stone_image = pygame.image.load(path.join(image_folder, STONE_IMAGE)).convert_alpha()
-        self.wizard_image = pygame.image.load(path.join(image_folder, WIZARD_IMAGE)).convert_alpha()
-        self.wizard_image = pygame.transform.scale(self.wizard_image, (24, 24))
-        self.wall_image = pygame.image.load(path.join(image_folder, WALL_IMAGE)).convert_alpha()
-        self.cross = pygame.image.load(path.join(image_folder, CROSS)).convert_alpha()
-        self.cross = pygame.transform.scale(self.cross, (24, 24))
-        self.health = pygame.image.load(path.join(image_folder, HEALTH)).convert_alpha()
-        self.health = pygame.transform.scale(self.health, (24, 24))
+        # The health bars and the pause screen are drawn from cached surfaces by the HUD.
+        self.hud = Hud(self.font, self.screen.get_size())
+        # Starts loading every image in the background while the map is loaded.
+        self.assets = AssetManager()
+        self.asset_handles = {
+            'knight_image': self.assets.image(path.join(image_folder, KNIGHT_IMAGE), (24, 24)),
+            'stone_image': self.assets.image(path.join(image_folder, STONE_IMAGE)),
+            'wizard_image': self.assets.image(path.join(image_folder, WIZARD_IMAGE), (24, 24)),
+            'wall_image': self.assets.image(path.join(image_folder, WALL_IMAGE)),
+            'cross': self.assets.image(path.join(image_folder, CROSS), (24, 24)),
+            'health': self.assets.image(path.join(image_folder, HEALTH), (24, 24)),
+            # Rotates the knight and wizard images once, the first time they are needed, instead of every frame.
+            'knight_rotations': AssetHandle(finish=lambda _: RotationCache(self.knight_image, ROTATION_STEPS)),
+            'wizard_rotations': AssetHandle(finish=lambda _: RotationCache(self.wizard_image, ROTATION_STEPS)),
+        }
+        if self.game_map is not None:
+            self.map = self.game_map
+        else:
+            # Loads the compiled copy of the map when it is up to date, which is much faster than parsing the .tmx.
+            self.map = load_map(path.join(map_folder, 'Dungeon_Map.tmx'))
+        # The map is drawn from chunks which are rendered the first time the camera sees them.
+        self.map_view = ChunkedMap(self.map)
+        # The first frame only needs the map and the knight, so the knight is the only image waited for here.
+        self.asset_handles['knight_rotations'].get()
         pygame.mixer.music.load(path.join(music_folder, MUSIC))
-        self.health_sound = {}
-        for type in HEALTH_SOUND:
-            self.health_sound[type] = pygame.mixer.Sound(path.join(sound_folder, HEALTH_SOUND[type]))
-        self.stone_sound = {}
-        for type in STONE_SOUND:
-            self.stone_sound[type] = pygame.mixer.Sound(path.join(sound_folder, STONE_SOUND[type]))
-        self.wizard_hit_sound = {}
-        for type in WIZARD_HIT_SOUND:
-            self.wizard_hit_sound[type] = pygame.mixer.Sound(path.join(sound_folder, WIZARD_HIT_SOUND[type]))
-        self.knight_hit_sound = {}
-        for type in KNIGHT_HIT_SOUND:
-            self.knight_hit_sound[type] = pygame.mixer.Sound(path.join(sound_folder, KNIGHT_HIT_SOUND[type]))
+        # Sounds are decoded in the background and cached by file, and played by the sound manager (see audio.py).
+        # Headless games never play a sound, so they do not load any either.
+        if SOUND_EFFECTS and not self.headless and pygame.mixer.get_init():
+            sounds = {}
+            for sound_files in [HEALTH_SOUND, STONE_SOUND, WIZARD_HIT_SOUND, KNIGHT_HIT_SOUND]:
+                for type in sound_files:
+                    sounds[type] = self.assets.sound(path.join(sound_folder, sound_files[type]))
+            self.audio = SoundManager(sounds)
+        else:
+            self.audio = NullAudio()
 
     def new(self):
+        # After the first game, the world is put back from the snapshot taken when it was first built, which is much
+        # faster than spawning every sprite from the map and building the wall grids and the flow field again.
+        if self.initial_state is not None:
+            restore_state(self, self.initial_state, restart=True)
+            return
+        # Clears the crosses left on the map by the last game.
+        self.map_view.clear_decals()
         # Was needed to ensure that the knight goes over the health potion when they collide.
         self.all_sprites = pygame.sprite.LayeredUpdates()
         self.walls = pygame.sprite.Group()
+        self.knights = pygame.sprite.Group()
         self.wizards = pygame.sprite.Group()
-        self.stones = pygame.sprite.Group()
+        # Stones are kept in arrays by the stone pool instead of being sprites.
+        self.stones = StonePool(self)
         self.collectibles = pygame.sprite.Group()
-        for tile_object in self.map.tmxdata.objects:
+        # With the array backend, wizards live in the horde's arrays instead of in the wizards group.
+        self.horde = WizardHorde(self) if self.wizard_backend == 'arrays' else None
+        # A streamed map only has the regions around the knight loaded, with their walls, wizards and potions.
+        # Its only map object is the knight.
+        self.streamer = RegionStreamer(self, self.map) if getattr(self.map, 'streamed', False) else None
+        for tile_object in self.map.objects:
             # Checks to see if name of the tile object is knight.
             # If so, the knight spawns at the location of the tile object.
             if tile_object.name == 'knight':
@@ -124,92 +186,299 @@ class DungeonGame:
             # Checks to see if the name of the tile object is wizard.
             # If so, a wizard spawns at the location of the tile object.
             if tile_object.name == 'wizard':
-                Wizard(self, tile_object.x, tile_object.y)
+                self.spawn_wizard(tile_object.x, tile_object.y)
             # Checks to see if the name of the tile object is health.
             # If so, a health potion spawns at the location of the tile object.
             if tile_object.name in ['health']:
                 Collectible(self, tile_object.x, tile_object.y, tile_object.name)
+        if self.streamer is not None:
+            # Loads the regions around the knight, which makes their walls, wall mask, wall grid and flow field.
+            self.streamer.start(self.knight.position)
+        else:
+            # Marks the tiles the walls are on.
+            self.wall_mask = WallMask(self.walls, self.map.width, self.map.height)
+            # Builds the wall lookup grid once, since the walls never move.
+            self.wall_grid = WallGrid(self.walls, mask=self.wall_mask)
+            # One shared field which tells every wizard which way to walk around the walls to the knight.
+            self.flow_field = FlowField(self.wall_mask)
+        # Grid used by the wizards to find the other wizards close to them.
+        self.wizard_grid = SpatialHash(AVOID_RADIUS)
+        # Decides which wizards are close enough to the knight to update every tick.
+        self.ai = AIScheduler()
         # Total area that the camera can occupy.
         self.camera = Camera(self.map.width, self.map.height)
         self.paused = False
+        self.playing = True
+        # Totals for this game, used e.g. by the balancing sweep (see sweep.py).
+        self.stats = {'wizards_killed': 0, 'damage_taken': 0, 'health_packs': 0}
+        # The screen areas drawn last frame and where the camera was, used by dirty-rect drawing.
+        self.drawn_rects = []
+        self.last_camera = None
+        self.initial_state = capture_state(self)
+
+    # Adds a wizard to whichever wizard backend the game is using.
+    def spawn_wizard(self, x, y):
+        if self.horde is not None:
+            return self.horde.spawn(x, y)
+        return Wizard(self, x, y)
 
     def run(self):
         self.playing = True
         # Loops the background music after the song ends.
         pygame.mixer.music.play(loops=-1)
+        # Real time that has passed but has not been simulated yet, in seconds.
+        accumulator = 0
         while self.playing:
-            self.time = self.clock.tick(FPS) / 1000
+            # Waits so that no more than render_fps frames are drawn each second.
+            accumulator += self.clock.tick(self.render_fps) / 1000
+            # After a very slow frame only MAX_CATCHUP_TICKS ticks are run, so slow ticks cannot make the next frame
+            # even slower (the game just runs slower than real time for a moment).
+            accumulator = min(accumulator, MAX_CATCHUP_TICKS * self.tick_dt)
+            self.profiler.begin_frame()
+            self.governor.begin_frame()
+            self.profiler.start('events')
             self.events()
-            if not self.paused:
-                self.update()
+            self.profiler.stop('events')
+            # Runs as many fixed-length ticks as fit into the time that has passed (none, one or several).
+            while accumulator >= self.tick_dt and self.playing:
+                self.tick(self.tick_dt)
+                accumulator -= self.tick_dt
+            # The time left over is drawn as a fraction of the way to the next tick.
+            self.alpha = accumulator / self.tick_dt if self.interpolate else 1
+            # Plays the sounds asked for by this frame's ticks, each at most once.
+            self.profiler.count('sounds', self.audio.flush(self.now))
+            self.draw()
+            # The quality level the frame governor had the game at during this frame (0 is full quality).
+            self.profiler.count('quality_level', self.governor.level)
+            self.governor.end_frame()
+            self.profiler.end_frame()
+
+    # Moves the game forward by one tick of dt seconds.
+    def tick(self, dt):
+        # A replay decides each tick's length and whether the game was paused, and ends the game when it runs out.
+        if self.replay is not None:
+            replayed = self.replay.next_tick()
+            if replayed is None:
+                self.playing = False
+                return
+            dt, self.paused = replayed
+        paused = self.paused
+        self.time = dt
+        self.now += dt * 1000
+        self.profiler.count('ticks')
+        if not paused:
+            self.update()
+        elif self.interpolate:
+            # Nothing moves while paused, so nothing should be drawn moving either.
+            self.remember_positions()
+        if self.recorder is not None:
+            self.recorder.end_tick(dt, paused)
+
+    # Finishes the input log with the state the game ended in, and goes back to reading the input without logging it.
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close(self)
+            self.input = self.recorder.provider
+            self.recorder = None
+
+    # Advances a headless game by one tick, without waiting for the clock.
+    # With draw turned on, the tick is drawn too, as part of the same profiled frame.
+    def step(self, dt=SIM_DT, draw=False):
+        self.profiler.begin_frame()
+        self.tick(dt)
+        self.profiler.count('sounds', self.audio.flush(self.now))
+        if draw:
             self.draw()
+        self.profiler.count('quality_level', self.governor.level)
+        self.profiler.end_frame()
+
+    # Steps a headless game as fast as possible for a number of game seconds, or until the knight dies.
+    # Returns the number of frames that were stepped.
+    def simulate(self, seconds, dt=SIM_DT):
+        frames = 0
+        while self.playing and frames * dt < seconds:
+            self.step(dt)
+            frames += 1
+        return frames
 
     # Exits the game window if the player hits the 'X' in the top right of the screen.
     def quit(self):
+        self.stop_recording()
+        self.profiler.close()
+        self.audio.stop()
+        self.assets.shutdown()
         pygame.quit()
         sys.exit()
 
+    # Remembers where everything is before a tick moves it, so frames can be drawn between two ticks.
+    def remember_positions(self):
+        for sprite in self.all_sprites:
+            sprite.previous_center = sprite.rect.center
+        self.stones.remember_positions()
+        if self.horde is not None:
+            self.horde.remember_positions()
+        self.camera.previous = self.camera.camera
+
+    # Returns a sprite's rectangle moved a fraction (alpha) of the way from where it was on the tick before.
+    def interpolated_rect(self, sprite):
+        previous = getattr(sprite, 'previous_center', None)
+        if self.alpha >= 1 or previous is None:
+            return sprite.rect
+        rect = sprite.rect.copy()
+        rect.center = (round(previous[0] + (sprite.rect.centerx - previous[0]) * self.alpha),
+                       round(previous[1] + (sprite.rect.centery - previous[1]) * self.alpha))
+        return rect
+
     def update(self):
+        self.profiler.start('sprites')
+        if self.interpolate:
+            self.remember_positions()
+        # Places every wizard in the wizard grid before any of them move this frame.
+        self.wizard_grid.rebuild(self.wizards)
+        # Sorts the wizards into near, far and sleeping wizards, which decides which of them update this tick.
+        ai_tiers = self.ai.update(self.wizards, [knight.position for knight in self.knights], self.camera.view_rect(),
+                                  self.governor.far_interval)
+        for tier in AI_TIERS:
+            self.profiler.count('ai_' + tier, ai_tiers[tier])
+        # Works out the wizards' paths again only if the knight has moved onto a new tile.
+        if WIZARD_PATHFINDING:
+            self.flow_field.update(self.knight.position)
+        # Moves every stone at once and removes the ones that hit a wall or ran out of time.
+        self.stones.update(self.time, self.now)
+        # Moves every wizard at once when the array backend is used.
+        if self.horde is not None:
+            self.horde.update(self.time)
         # Update the game loop.
         self.all_sprites.update()
+        self.profiler.stop('sprites')
         # Updates the camera while tracking the knight.
         self.camera.update(self.knight)
+        # Loads the regions of a streamed map that the knight has walked towards, and unloads those it has left.
+        if self.streamer is not None:
+            self.streamer.update(self.knight.position)
+
+        self.profiler.start('collisions')
+        # Finds the collisions of every knight (there is only one, unless the game is an arena on the server).
+        # The wizards' rectangles are the same for every knight, so they are listed once and checked in C by pygame.
+        wizards = self.wizards.sprites()
+        wizard_rects = [wizard.rect for wizard in wizards]
+        for knight in self.knights:
+            self.collide_knight(knight, wizards, wizard_rects)
+
+        # Finds collisions between the wizards and the stones.
+        hits = self.stones.collide_wizards(self.wizards)
+        if self.horde is not None:
+            hits += self.horde.collide_stones(self.stones)
+        for hit in hits:
+            # Plays a sound for a stone hitting a wizard.
+            self.audio.play('wizard')
+            # Subtracts 10 health points from a wizard's total health each time it is hit by a stone.
+            hit.health -= STONE_DAMAGE
+            # The wizard is removed on its next update, but it counts as killed from the stone that finished it.
+            if hit.health <= 0 < hit.health + STONE_DAMAGE:
+                self.stats['wizards_killed'] += 1
+            # Pauses the movement of a wizard if it is hit by a stone.
+            hit.velocity = vec(0, 0)
+        self.profiler.stop('collisions')
 
+
+    # Finds the collisions between a knight and the collectibles and wizards (given as a list and their rectangles).
+    def collide_knight(self, knight, wizards, wizard_rects):
         # Finds collisions between the knight and collectibles.
-        hits = pygame.sprite.spritecollide(self.knight, self.collectibles, False)
+        hits = pygame.sprite.spritecollide(knight, self.collectibles, False)
         for hit in hits:
-            if hit.type == 'health' and self.knight.health < KNIGHT_HEALTH:
+            if hit.type == 'health' and knight.health < KNIGHT_HEALTH:
                 # Deletes the health pack from the screen.
                 hit.kill()
                 # Plays a sound for the knight collecting a health pack.
-                self.health_sound['health'].play()
+                self.audio.play('health')
                 # Adds a set amount of health to the knight's health.
-                self.knight.add_health(HEALTH_PACK)
+                knight.add_health(HEALTH_PACK)
+                self.stats['health_packs'] += 1
 
         # Finds collisions between the knight and wizards.
-        hits = pygame.sprite.spritecollide(self.knight, self.wizards, False, collide_hit_rect)
+        # Finds the same wizards, in the same order, as pygame.sprite.spritecollide with collide_hit_rect.
+        hits = [wizards[index] for index in knight.hit_rect.collidelistall(wizard_rects)]
+        if self.horde is not None:
+            hits += self.horde.collide_rect(knight.hit_rect)
         for hit in hits:
             # Plays a sound for a wizard hitting the knight.
-            self.knight_hit_sound['knight'].play()
+            self.audio.play('knight')
             # Subtracts 10 health points from the knight's total health each time it is hit by a wizard.
-            self.knight.health -= WIZARD_DAMAGE
+            knight.health -= WIZARD_DAMAGE
+            self.stats['damage_taken'] += WIZARD_DAMAGE
             # Pauses the movement of a wizard if it hits the knight.
             hit.velocity = vec(0, 0)
-            # Checks to see if the knight's health is equal to zero.
-            if self.knight.health <= 0:
-                # Ends the game if the knight's health is equal to zero.
-                self.playing = False
         if hits:
             # Pushes the knight back if it is hit by a wizard.
-            self.knight.position += vec(WIZARD_MOVEBACK, 0).rotate(-hits[0].rotation)
+            knight.position += vec(WIZARD_MOVEBACK, 0).rotate(-hits[0].rotation)
+        # Checks to see if the knight's health is equal to zero.
+        if knight.health <= 0:
+            self.knight_died(knight)
 
-        # Finds collisions between the wizards and the stones.
-        hits = pygame.sprite.groupcollide(self.wizards, self.stones, False, True)
-        for hit in hits:
-            # Plays a sound for a stone hitting a wizard.
-            self.wizard_hit_sound['wizard'].play()
-            # Subtracts 10 health points from a wizard's total health each time it is hit by a stone.
-            hit.health -= STONE_DAMAGE
-            # Pauses the movement of a wizard if it is hit by a stone.
-            hit.velocity = vec(0, 0)
+    # Ends the game when the knight's health reaches zero.
+    def knight_died(self, knight):
+        self.playing = False
+
+    # Returns the sprites that can be seen on the screen, in the order they are drawn.
+    def visible_sprites(self, camera=None):
+        view = (camera or self.camera).view_rect()
+        return [sprite for sprite in self.all_sprites if view.colliderect(sprite.rect)]
 
+    # Draws the wizards of the array backend and the stones, which are not sprites, and returns where they were drawn.
+    def draw_horde_and_stones(self, camera):
+        drawn_rects = []
+        if self.horde is not None:
+            drawn_rects.extend(self.horde.draw(self.screen, camera, self.alpha))
+        drawn_rects.extend(self.stones.draw(self.screen, camera, self.alpha))
+        return drawn_rects
 
     def draw(self):
-        # Draws the map onto the game surface and sets a shifting rectangle for the map.
-        self.screen.blit(self.map_image, self.camera.apply_rect(self.map_rect))
-        for sprite in self.all_sprites:
-            if isinstance(sprite, Wizard):
-                sprite.draw_health()
-            self.screen.blit(sprite.image, self.camera.apply(sprite))
-        # Calls the function which draws the knight health onto the screen.
-        draw_knight_health(self.screen, 10, 10, self.knight.health / KNIGHT_HEALTH)
-        # Checks to see if the game is paused.
-        if self.paused:
-            # Places a grey tint on the screen so that it looks dim.
-            self.screen.blit(self.dim_screen, (0, 0))
-            # Writes 'PAUSED' in Dungeon font on the screen.
-            self.draw_text('PAUSED', self.font, 105, WHITE, WIDTH / 2, HEIGHT /2, align = 'top')
-        pygame.display.flip()
+        self.profiler.start('draw')
+        # Between two ticks, the camera is drawn part of the way between where it was on each of them.
+        camera = self.camera.interpolated(self.alpha) if self.alpha < 1 else self.camera
+        # In dirty-rect mode, only the parts of the screen that changed are redrawn while the camera stands still.
+        # Pausing, the profiler overlay or a moving camera change the whole screen, so those frames are redrawn in full.
+        full_redraw = (not self.dirty_rects or self.paused or self.profiler.show_overlay
+                       or camera.camera.topleft != self.last_camera)
+        if full_redraw:
+            # Draws the map chunks that the camera can see onto the game surface.
+            self.map_view.draw(self.screen, camera)
+        else:
+            # Covers up where the sprites and the health bar were last frame with the map behind them.
+            for rect in self.drawn_rects:
+                self.map_view.draw_area(self.screen, rect, camera)
+        drawn_rects = []
+        # Only the sprites on the screen are drawn.
+        sprites = self.visible_sprites(camera)
+        stones_drawn = False
+        for sprite in sprites:
+            # The wizard horde and the stones are drawn above the wizard sprites and health potions but below the knight.
+            if not stones_drawn and self.all_sprites.get_layer_of_sprite(sprite) >= KNIGHT_LAYER:
+                drawn_rects.extend(self.draw_horde_and_stones(camera))
+                stones_drawn = True
+            screen_rect = camera.apply_rect(self.interpolated_rect(sprite))
+            self.screen.blit(sprite.image, screen_rect)
+            # The frame governor hides the wizards' health bars when frames are too slow.
+            if isinstance(sprite, Wizard) and self.governor.health_bars:
+                sprite.draw_health(self.screen, screen_rect)
+            drawn_rects.append(screen_rect)
+        if not stones_drawn:
+            drawn_rects.extend(self.draw_horde_and_stones(camera))
+        self.profiler.count('blits', len(drawn_rects))
+        # Draws the knight's health bar, and the dimmed 'PAUSED' screen if the game is paused.
+        drawn_rects.extend(self.hud.draw(self.screen, self.knight.health, self.paused))
+        self.profiler.draw_overlay(self.screen)
+        self.profiler.stop('draw')
+        self.profiler.start('flip')
+        if full_redraw:
+            pygame.display.flip()
+        else:
+            # Sends only the areas that were erased or drawn this frame to the display.
+            pygame.display.update(self.drawn_rects + drawn_rects)
+        self.profiler.stop('flip')
+        self.drawn_rects = drawn_rects
+        self.last_camera = camera.camera.topleft
 
     def events(self):
         for event in pygame.event.get():
@@ -220,8 +489,17 @@ class DungeonGame:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.quit()
-            # Pauses the game if the mouse is clicked.
-            if event.type == pygame.MOUSEBUTTONDOWN:
+                # Shows or hides the profiler overlay.
+                if event.key == PROFILE_OVERLAY_KEY and self.profiler.enabled:
+                    self.profiler.show_overlay = not self.profiler.show_overlay
+                # Saves the game in progress, or loads the last saved game.
+                # A replay can do neither, and a recorded game cannot load, since the input log could not play it back.
+                if event.key == SAVE_KEY and self.replay is None:
+                    save_game(self, SAVE_FILE)
+                if event.key == LOAD_KEY and self.replay is None and self.recorder is None and path.exists(SAVE_FILE):
+                    load_game(self, SAVE_FILE)
+            # Pauses the game if the mouse is clicked (a replay pauses the game where the recording was paused instead).
+            if event.type == pygame.MOUSEBUTTONDOWN and self.replay is None:
                 self.paused = not self.paused
 
     # Creates a black screen with white text when the knight dies.
@@ -252,10 +530,35 @@ class DungeonGame:
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     waiting = False
 
-dungeon_game = DungeonGame()
+if __name__ == '__main__':
+    # Profiling can be turned on from the command line: python dungeon_game.py --profile [frames.csv]
+    profile_file = None
+    if '--profile' in sys.argv:
+        index = sys.argv.index('--profile')
+        has_file = index + 1 < len(sys.argv) and not sys.argv[index + 1].startswith('--')
+        profile_file = sys.argv[index + 1] if has_file else 'profile.csv'
+    # The tick rate and the frame cap can be changed too, e.g. python dungeon_game.py --tick-rate 120 --fps 30
+    tick_rate = TICK_RATE
+    if '--tick-rate' in sys.argv:
+        tick_rate = int(sys.argv[sys.argv.index('--tick-rate') + 1])
+    render_fps = FPS
+    if '--fps' in sys.argv:
+        render_fps = int(sys.argv[sys.argv.index('--fps') + 1])
+    # The first game can be recorded to an input log: python dungeon_game.py --record session.dglog
+    record_file = None
+    if '--record' in sys.argv:
+        record_file = sys.argv[sys.argv.index('--record') + 1]
+    # Another map can be played: a Tiled map, or a dungeon made by mapgen.py, e.g. python dungeon_game.py --map huge.dgdn
+    game_map = None
+    if '--map' in sys.argv:
+        map_file = sys.argv[sys.argv.index('--map') + 1]
+        game_map = StreamedMap(map_file) if map_file.endswith(DUNGEON_EXTENSION) else load_map(map_file)
+    dungeon_game = DungeonGame(profile_file=profile_file, tick_rate=tick_rate, render_fps=render_fps,
+                               record_file=record_file, game_map=game_map)
 
-# A loop to run the game.
-while True:
-    dungeon_game.new()
-    dungeon_game.run()
-    dungeon_game.game_over_screen()
\ No newline at end of file
+    # A loop to run the game.
+    while True:
+        dungeon_game.new()
+        dungeon_game.run()
+        dungeon_game.stop_recording()
+        dungeon_game.game_over_screen()
\ No newline at end of file
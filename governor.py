@@ -0,0 +1,78 @@
+from time import perf_counter
+from settings import *
+
+# The work the governor turns down, one more piece at every quality level below full quality (level 0),
+# from what is hardest to notice to what is easiest to notice.
+QUALITY_STEPS = ['far_ai', 'rotation', 'separation', 'health_bars']
+
+class FrameGovernor:
+    '''A class to turn down the most expensive work, a step at a time, while frames take longer than the frame budget.'''
+    # Frame times are kept as a running average over about GOVERNOR_WINDOW frames, so one slow frame changes nothing.
+    # While the average is over the budget, the quality goes down a level. Once it is under GOVERNOR_HEADROOM of the
+    # budget, the quality goes back up a level. After every change the governor waits to see what the change did.
+    enabled = True
+
+    def __init__(self, budget):
+        # The budget is in milliseconds.
+        self.budget = budget
+        self.average = None
+        self.frame_start = None
+        self.set_level(0)
+
+    # Sets the quality level, and how each piece of work that can be turned down is done at that level.
+    def set_level(self, level):
+        self.level = level
+        steps = QUALITY_STEPS[:level]
+        # Ticks between two updates of a far away wizard sprite (see lod.py).
+        self.far_interval = GOVERNOR_FAR_INTERVAL if 'far_ai' in steps else AI_FAR_INTERVAL
+        # Degrees a wizard has to turn before it changes its image (0 changes it however little the wizard turns).
+        self.rotation_step = GOVERNOR_ROTATION_STEP if 'rotation' in steps else 0
+        # Ticks between two times a wizard is pushed away from the wizards around it.
+        self.separation_interval = 2 if 'separation' in steps else 1
+        # Whether the wizards' health bars are drawn. Wizards off the screen never have their health bars drawn.
+        self.health_bars = 'health_bars' not in steps
+        # Frames since the quality level last changed.
+        self.frames = 0
+
+    def begin_frame(self):
+        self.frame_start = perf_counter()
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        self.add_frame((perf_counter() - self.frame_start) * 1000)
+        self.frame_start = None
+
+    # Adds the time (in milliseconds) of a frame to the average, and lowers or raises the quality if it is time to.
+    # Raising the quality waits longer than lowering it, so it does not keep going back up and straight down again.
+    def add_frame(self, milliseconds):
+        if self.average is None:
+            self.average = milliseconds
+        else:
+            self.average += (milliseconds - self.average) / GOVERNOR_WINDOW
+        self.frames += 1
+        if self.average > self.budget:
+            if self.level < len(QUALITY_STEPS) and self.frames >= GOVERNOR_LOWER_AFTER:
+                self.set_level(self.level + 1)
+        elif self.average < self.budget * GOVERNOR_HEADROOM:
+            if self.level > 0 and self.frames >= GOVERNOR_RAISE_AFTER:
+                self.set_level(self.level - 1)
+
+class NullGovernor:
+    '''A governor which always keeps full quality, used when the governor is turned off.'''
+    enabled = False
+
+    # The settings are read when the governor is made, not when this file is loaded, so the balancing sweep
+    # (see sweep.py) can change AI_FAR_INTERVAL.
+    def __init__(self):
+        self.level = 0
+        self.far_interval = AI_FAR_INTERVAL
+        self.rotation_step = 0
+        self.separation_interval = 1
+        self.health_bars = True
+
+    def begin_frame(self):
+        pass
+
+    def end_frame(self):
+        pass
@@ -0,0 +1,305 @@
+import numpy
+import pygame
+from settings import *
+from projectiles import round_like_rect
+vec = pygame.math.Vector2
+
+class HordeWizard:
+    '''A class which looks like a Wizard sprite, but reads and writes one row of the wizard horde's arrays.'''
+    # The game's collision code changes a wizard's health and velocity, so those write straight back to the arrays.
+    def __init__(self, horde, index):
+        self.horde = horde
+        self.index = index
+
+    def alive(self):
+        return self.index is not None
+
+    @property
+    def position(self):
+        return vec(*self.horde.position[self.index])
+
+    @property
+    def velocity(self):
+        return vec(*self.horde.velocity[self.index])
+
+    @velocity.setter
+    def velocity(self, value):
+        self.horde.velocity[self.index] = (value[0], value[1])
+
+    @property
+    def health(self):
+        return self.horde.health[self.index]
+
+    @health.setter
+    def health(self, value):
+        self.horde.health[self.index] = value
+
+    @property
+    def rotation(self):
+        return self.horde.rotation[self.index]
+
+    @property
+    def speed(self):
+        return self.horde.speed[self.index]
+
+    @property
+    def rect(self):
+        image, rect = self.horde.game.wizard_rotations.get(self.rotation)
+        rect.center = (int(self.horde.hit_x[self.index]), int(self.horde.hit_y[self.index]))
+        return rect
+
+    @property
+    def hit_rect(self):
+        rect = WIZARD_HIT_RECT.copy()
+        rect.center = (int(self.horde.hit_x[self.index]), int(self.horde.hit_y[self.index]))
+        return rect
+
+class WizardHorde:
+    '''A class to move every wizard at once with NumPy arrays, instead of one Wizard sprite update per wizard.'''
+    # Each wizard is one row of the arrays. When a wizard dies, the last row is moved into its place.
+    def __init__(self, game, capacity=HORDE_CAPACITY):
+        self.game = game
+        self.count = 0
+        self.position = numpy.zeros((capacity, 2))
+        self.velocity = numpy.zeros((capacity, 2))
+        self.acceleration = numpy.zeros((capacity, 2))
+        self.speed = numpy.zeros(capacity)
+        self.rotation = numpy.zeros(capacity)
+        self.health = numpy.zeros(capacity)
+        # The centre of each wizard's hit rectangle, which (like a sprite's hit_rect) is in whole pixels.
+        self.hit_x = numpy.zeros(capacity, dtype=int)
+        self.hit_y = numpy.zeros(capacity, dtype=int)
+        # Where each hit rectangle's centre was on the tick before, for drawing wizards between ticks.
+        self.previous_x = numpy.zeros(capacity, dtype=int)
+        self.previous_y = numpy.zeros(capacity, dtype=int)
+        self.views = []
+        rotations = game.wizard_rotations
+        # The size of every pre-rotated wizard image, so that every wizard's rectangle can be worked out at once.
+        self.frame_sizes = numpy.array(rotations.sizes)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def arrays(self):
+        return ['position', 'velocity', 'acceleration', 'speed', 'rotation', 'health', 'hit_x', 'hit_y', 'previous_x', 'previous_y']
+
+    # Doubles the length of every array once every row is in use.
+    def grow(self):
+        for name in self.arrays():
+            array = getattr(self, name)
+            setattr(self, name, numpy.concatenate([array, numpy.zeros_like(array)]))
+
+    # Adds a wizard at a position and returns the view of it.
+    def spawn(self, x, y):
+        if self.count == len(self.speed):
+            self.grow()
+        index = self.count
+        self.position[index] = (x, y)
+        self.velocity[index] = (1, 1)
+        self.acceleration[index] = (0, 0)
+        self.rotation[index] = 0
+        self.health[index] = WIZARD_HEALTH
+        # Sets different speeds for different wizards.
+        self.speed[index] = self.game.random.choice(WIZARD_SPEED)
+        self.hit_x[index] = round(x)
+        self.hit_y[index] = round(y)
+        self.previous_x[index] = self.hit_x[index]
+        self.previous_y[index] = self.hit_y[index]
+        view = HordeWizard(self, index)
+        self.views.append(view)
+        self.count += 1
+        return view
+
+    # Removes a wizard by moving the last wizard into its row.
+    def remove(self, index):
+        last = self.count - 1
+        removed = self.views[index]
+        if index != last:
+            for name in self.arrays():
+                array = getattr(self, name)
+                array[index] = array[last]
+            self.views[index] = self.views[last]
+            self.views[index].index = index
+        self.views.pop()
+        removed.index = None
+        self.count -= 1
+
+    # Remembers where every wizard is before the next tick moves them.
+    def remember_positions(self):
+        self.previous_x[:self.count] = self.hit_x[:self.count]
+        self.previous_y[:self.count] = self.hit_y[:self.count]
+
+    # Returns the rectangle (left, top, width, height) of every wizard's rotated image, centred on its hit rectangle.
+    def rects(self):
+        count = self.count
+        frames = numpy.round(self.rotation[:count] / self.game.wizard_rotations.step_angle).astype(int)
+        sizes = self.frame_sizes[frames % len(self.frame_sizes)]
+        lefts = self.hit_x[:count] - sizes[:, 0] // 2
+        tops = self.hit_y[:count] - sizes[:, 1] // 2
+        return numpy.column_stack([lefts, tops, sizes[:, 0], sizes[:, 1]])
+
+    # Works out the separation force for every wizard at once.
+    # Wizards are sorted by grid cell, and the ranges of wizards in the nine cells around each wizard are turned into
+    # one long list of pairs, so every pair closer than AVOID_RADIUS is found without a Python loop.
+    def separation(self, positions):
+        count = len(positions)
+        force = numpy.zeros((count, 2))
+        if count < 2:
+            return force
+        cells = numpy.floor_divide(positions, AVOID_RADIUS).astype(numpy.int64)
+        cells -= cells.min(axis=0) - 1
+        width = cells[:, 1].max() + 2
+        keys = cells[:, 0] * width + cells[:, 1]
+        order = numpy.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        for offset_x in (-1, 0, 1):
+            for offset_y in (-1, 0, 1):
+                neighbour_keys = keys + offset_x * width + offset_y
+                starts = numpy.searchsorted(sorted_keys, neighbour_keys, 'left')
+                ends = numpy.searchsorted(sorted_keys, neighbour_keys, 'right')
+                counts = ends - starts
+                total = counts.sum()
+                if not total:
+                    continue
+                firsts = numpy.repeat(numpy.arange(count), counts)
+                run_starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+                seconds = order[numpy.repeat(starts, counts) + numpy.arange(total) - run_starts]
+                distance = positions[firsts] - positions[seconds]
+                length = numpy.hypot(distance[:, 0], distance[:, 1])
+                close = (length > 0) & (length < AVOID_RADIUS)
+                pushes = distance[close] / length[close, None]
+                force[:, 0] += numpy.bincount(firsts[close], pushes[:, 0], minlength=count)
+                force[:, 1] += numpy.bincount(firsts[close], pushes[:, 1], minlength=count)
+        return force
+
+    # Pushes the wizards near a wall back out of it along one axis, the same way collide_with_walls does for a sprite.
+    def collide_with_walls(self, direction):
+        count = self.count
+        half_width = WIZARD_HIT_RECT.width // 2
+        half_height = WIZARD_HIT_RECT.height // 2
+        lefts = self.hit_x[:count] - half_width
+        tops = self.hit_y[:count] - half_height
+        wall_grid = self.game.wall_grid
+        # Only the wizards whose hit rectangle is on a tile with a wall are checked against the walls themselves.
+        near_wall = self.game.wall_mask.boxes_solid(lefts, tops, lefts + WIZARD_HIT_RECT.width,
+                                                    tops + WIZARD_HIT_RECT.height)
+        self.game.profiler.count('wall_checks', int(near_wall.sum()))
+        hit_rect = WIZARD_HIT_RECT.copy()
+        for index in numpy.flatnonzero(near_wall):
+            hit_rect.center = (int(self.hit_x[index]), int(self.hit_y[index]))
+            hit = wall_grid.first(hit_rect)
+            if not hit:
+                continue
+            wall = hit.rect
+            if direction == 'x':
+                if wall.centerx > hit_rect.centerx:
+                    self.position[index, 0] = wall.left - hit_rect.width / 2
+                if wall.centerx < hit_rect.centerx:
+                    self.position[index, 0] = wall.right + hit_rect.width / 2
+                self.velocity[index, 0] = 0
+                self.hit_x[index] = round_like_rect(self.position[index:index + 1, 0])[0]
+            else:
+                if wall.centery > hit_rect.centery:
+                    self.position[index, 1] = wall.top - hit_rect.height / 2
+                if wall.centery < hit_rect.centery:
+                    self.position[index, 1] = wall.bottom + hit_rect.height / 2
+                self.velocity[index, 1] = 0
+                self.hit_y[index] = round_like_rect(self.position[index:index + 1, 1])[0]
+
+    # Moves every wizard one step, in the same order of steps as Wizard.update.
+    def update(self, dt):
+        count = self.count
+        if not count:
+            return
+        position = self.position[:count]
+        velocity = self.velocity[:count]
+        knight_position = self.game.knight.position
+        # Points every wizard towards the knight, along the flow field if pathfinding is turned on.
+        if WIZARD_PATHFINDING:
+            target_x, target_y = self.game.flow_field.targets_for(position[:, 0], position[:, 1], knight_position)
+        else:
+            target_x = numpy.full(count, float(knight_position[0]))
+            target_y = numpy.full(count, float(knight_position[1]))
+        heading = numpy.arctan2(target_y - position[:, 1], target_x - position[:, 0])
+        # While the frame governor has turned rotation down (see governor.py), a wizard keeps its image
+        # until it has turned by a whole rotation step.
+        governor = self.game.governor
+        rotation = -numpy.degrees(heading)
+        if governor.rotation_step:
+            turned = numpy.abs((rotation - self.rotation[:count] + 180) % 360 - 180) >= governor.rotation_step
+            self.rotation[:count][turned] = rotation[turned]
+            self.game.profiler.count('rotations', int(turned.sum()))
+        else:
+            self.rotation[:count] = rotation
+            self.game.profiler.count('rotations', count)
+        acceleration = numpy.column_stack([numpy.cos(heading), numpy.sin(heading)])
+        # While separation is turned down, the wizards only push each other away every few ticks.
+        if self.game.ai.ticks % governor.separation_interval == 0:
+            acceleration += self.separation(position)
+        # Scales the acceleration to each wizard's speed without changing its direction.
+        length = numpy.hypot(acceleration[:, 0], acceleration[:, 1])
+        length[length == 0] = 1
+        acceleration *= (self.speed[:count] / length)[:, None]
+        acceleration -= velocity
+        velocity += acceleration * dt
+        position += velocity * dt + .5 * acceleration * dt ** 2
+        self.acceleration[:count] = acceleration
+        self.hit_x[:count] = round_like_rect(position[:, 0])
+        self.collide_with_walls('x')
+        self.hit_y[:count] = round_like_rect(position[:, 1])
+        self.collide_with_walls('y')
+        # Removes the wizards with no health left, leaving a cross where each one died.
+        # Going from the last row backwards means moving a row into a removed wizard's place never skips a wizard.
+        for index in numpy.flatnonzero(self.health[:count] <= 0)[::-1]:
+            self.game.map_view.add_decal(self.game.cross, (self.position[index, 0] - 12, self.position[index, 1] - 12))
+            self.remove(index)
+
+    # Finds the wizards whose rectangles overlap a rectangle (e.g. the knight's hit_rect), in row order.
+    def collide_rect(self, rect):
+        if not self.count:
+            return []
+        rects = self.rects()
+        overlaps = ((rects[:, 0] < rect.right) & (rect.left < rects[:, 0] + rects[:, 2])
+                    & (rects[:, 1] < rect.bottom) & (rect.top < rects[:, 1] + rects[:, 3]))
+        return [self.views[index] for index in numpy.flatnonzero(overlaps)]
+
+    # Finds the wizards hit by stones (removing those stones) and returns their views.
+    def collide_stones(self, stones):
+        if not self.count or not len(stones):
+            return []
+        rows = stones.collide_rects(self.rects())
+        return [self.views[row] for row in rows]
+
+    # Draws the wizards that are on the screen, with their health bars, and returns the screen rectangles they cover.
+    # An alpha below 1 draws each wizard that fraction of the way from its position on the tick before.
+    def draw(self, surface, camera, alpha=1):
+        if not self.count:
+            return []
+        rects = self.rects()
+        if alpha < 1:
+            count = self.count
+            rects[:, 0] -= round_like_rect((self.hit_x[:count] - self.previous_x[:count]) * (1 - alpha))
+            rects[:, 1] -= round_like_rect((self.hit_y[:count] - self.previous_y[:count]) * (1 - alpha))
+        view = camera.view_rect()
+        visible = numpy.flatnonzero((rects[:, 0] < view.right) & (view.left < rects[:, 0] + rects[:, 2])
+                                    & (rects[:, 1] < view.bottom) & (view.top < rects[:, 1] + rects[:, 3]))
+        rotations = self.game.wizard_rotations
+        hud = self.game.hud
+        health_bars = self.game.governor.health_bars
+        offset_x, offset_y = camera.camera.topleft
+        drawn_rects = []
+        for index in visible:
+            image, screen_rect = rotations.get(self.rotation[index])
+            screen_rect.topleft = (int(rects[index, 0]) + offset_x, int(rects[index, 1]) + offset_y)
+            surface.blit(image, screen_rect)
+            # Wizards in the horde get their health bars from the HUD's cache, the same as wizard sprites.
+            # The frame governor hides them when frames are too slow.
+            if health_bars:
+                bar = hud.wizard_health_bar(screen_rect.width, self.health[index])
+                if bar is not None:
+                    surface.blit(bar, screen_rect.topleft)
+            drawn_rects.append(screen_rect)
+        return drawn_rects
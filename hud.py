@@ -0,0 +1,106 @@
+import pygame
+from settings import *
+
+# The health bar colors, and the fraction of health a bar has to be above to use each one (HEALTH_10 is used below .1).
+HEALTH_LADDER = [(.90, HEALTH_100), (.80, HEALTH_90), (.70, HEALTH_80), (.60, HEALTH_70), (.50, HEALTH_60),
+                 (.40, HEALTH_50), (.30, HEALTH_40), (.20, HEALTH_30), (.10, HEALTH_20)]
+
+# Picks the color of a health bar from the fraction of health that is left.
+def health_color(fraction):
+    for threshold, color in HEALTH_LADDER:
+        if fraction > threshold:
+            return color
+    return HEALTH_10
+
+class HealthColors:
+    '''A class to look up the color of a health bar in a table worked out once for every whole amount of health.'''
+    def __init__(self, max_health):
+        self.max_health = max_health
+        self.table = [health_color(health / max_health) for health in range(int(max_health) + 1)]
+
+    def get(self, health):
+        if health == int(health) and 0 <= health < len(self.table):
+            return self.table[int(health)]
+        # Health that is not a whole number (or is out of range) falls back to the ladder.
+        return health_color(max(0, health) / self.max_health)
+
+class TextCache:
+    '''A class to keep every font and every piece of rendered text, so nothing is loaded or rendered twice.'''
+    def __init__(self):
+        # Fonts are kept by (file, size), and rendered text by (text, file, size, color).
+        self.fonts = {}
+        self.surfaces = {}
+
+    def font(self, filename, size):
+        key = (filename, size)
+        if key not in self.fonts:
+            self.fonts[key] = pygame.font.Font(filename, size)
+        return self.fonts[key]
+
+    def render(self, text, filename, size, color):
+        key = (text, filename, size, color)
+        if key not in self.surfaces:
+            self.surfaces[key] = self.font(filename, size).render(text, True, color)
+        return self.surfaces[key]
+
+class Hud:
+    '''A class to draw the knight's health bar, the wizards' health bars and the pause screen from cached surfaces.'''
+    # Every part of the HUD is drawn once onto its own surface and only drawn again when what it shows changes,
+    # so each frame the HUD is just a blit or two.
+    def __init__(self, font_file, screen_size):
+        self.font_file = font_file
+        self.screen_size = screen_size
+        self.text = TextCache()
+        self.knight_colors = HealthColors(KNIGHT_HEALTH)
+        self.wizard_colors = HealthColors(WIZARD_HEALTH)
+        self.knight_bar = None
+        self.knight_bar_health = None
+        # Wizard health bars are kept by (width, health), since every wizard with the same health shares a bar.
+        self.wizard_bars = {}
+        self.pause_overlay = None
+
+    # Returns the knight's health bar, drawing it again only if the knight's health has changed.
+    def knight_health_bar(self, health):
+        if self.knight_bar is None or health != self.knight_bar_health:
+            # Makes sure the knight doesn't have negative health.
+            fraction = max(0, health / KNIGHT_HEALTH)
+            width, height = KNIGHT_HEALTH_RECT.size
+            self.knight_bar = pygame.Surface((width, height), pygame.SRCALPHA)
+            # Draws the colored part of the health bar, as long as the proportion of health left.
+            color = self.knight_colors.get(max(0, health))
+            pygame.draw.rect(self.knight_bar, color, pygame.Rect(0, 0, fraction * width, height))
+            # Draws the outline of the health bar.
+            pygame.draw.rect(self.knight_bar, WHITE, pygame.Rect(0, 0, width, height), 2)
+            self.knight_bar_health = health
+        return self.knight_bar
+
+    # Returns the health bar for a wizard of the given width, or None for a wizard at full health (which has no bar).
+    def wizard_health_bar(self, width, health):
+        if health >= WIZARD_HEALTH:
+            return None
+        key = (width, health)
+        if key not in self.wizard_bars:
+            bar_width = max(0, int(width * health / WIZARD_HEALTH))
+            bar = pygame.Surface((bar_width, 4))
+            bar.fill(self.wizard_colors.get(max(0, health)))
+            self.wizard_bars[key] = bar
+        return self.wizard_bars[key]
+
+    # Returns the grey tint and the 'PAUSED' text of the pause screen, which are made the first time the game is paused.
+    def pause_screen(self):
+        if self.pause_overlay is None:
+            # A grey tint so that the game looks dim.
+            dim_screen = pygame.Surface(self.screen_size, pygame.SRCALPHA)
+            dim_screen.fill((0, 0, 0, 120))
+            text_surface = self.text.render('PAUSED', self.font_file, 105, WHITE)
+            text_rect = text_surface.get_rect(midbottom=(self.screen_size[0] / 2, self.screen_size[1] / 2))
+            self.pause_overlay = [(dim_screen, (0, 0)), (text_surface, text_rect)]
+        return self.pause_overlay
+
+    # Draws the HUD onto the screen and returns the areas it covers.
+    def draw(self, surface, knight_health, paused):
+        surface.blit(self.knight_health_bar(knight_health), KNIGHT_HEALTH_RECT)
+        if paused:
+            surface.blits(self.pause_screen(), doreturn=False)
+            return [surface.get_rect()]
+        return [KNIGHT_HEALTH_RECT]
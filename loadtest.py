@@ -0,0 +1,152 @@
+# Connects many players to the arena server at once, each holding down random keys, and reports how the server copes:
+# how long its ticks take and how many bytes it sends every player.
+# Start a server and test it with 200 players for 20 seconds: python loadtest.py --players 200 --seconds 20
+# Test a server that is already running (its tick times are printed by the server itself):
+#   python loadtest.py --connect --players 200
+import sys
+import time
+import queue
+import socket
+import random
+import argparse
+import selectors
+import multiprocessing
+from time import perf_counter
+import pygame
+from settings import *
+from controls import KeyState
+from replay import keys_to_bits
+from netcode import *
+
+# Seconds between two changes of the keys each bot player holds down.
+BOT_INPUT_INTERVAL = .5
+
+class BotPlayer:
+    '''A class to play as one connected player, holding down random keys, and count what the server sends it.'''
+    def __init__(self, host, port, rng):
+        self.connection = socket.create_connection((host, port))
+        self.connection.setblocking(False)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rng = rng
+        self.reader = MessageReader()
+        self.decoder = SnapshotDecoder()
+        self.knight_id = None
+        self.bytes_received = 0
+        self.snapshots = 0
+        # Every bot changes its keys at a different moment, so they do not all send at once.
+        self.next_input = perf_counter() + rng.uniform(0, BOT_INPUT_INTERVAL)
+
+    # Picks new keys to hold down: mostly walking forwards, turning some of the time and throwing stones half the time.
+    def send_input(self):
+        keys = [self.rng.choice([pygame.K_UP, pygame.K_UP, pygame.K_DOWN])]
+        turn = self.rng.choice([None, pygame.K_LEFT, pygame.K_RIGHT])
+        if turn is not None:
+            keys.append(turn)
+        if self.rng.random() < .5:
+            keys.append(pygame.K_SPACE)
+        self.connection.send(pack_message(INPUT_MESSAGE.pack(INPUT, keys_to_bits(KeyState(keys)))))
+        self.next_input += BOT_INPUT_INTERVAL
+
+    # Returns False once the server has closed the connection.
+    def read(self):
+        try:
+            data = self.connection.recv(1 << 20)
+        except BlockingIOError:
+            return True
+        if not data:
+            return False
+        self.bytes_received += len(data)
+        for message in self.reader.feed(data):
+            if message[0] == SNAPSHOT:
+                self.decoder.apply(message)
+                self.snapshots += 1
+            elif message[0] == WELCOME:
+                self.knight_id = WELCOME_MESSAGE.unpack(message)[1]
+        return True
+
+# Runs a server in its own process for a load test, and hands back its statistics when it stops.
+def serve(host, port, map_size, wizards, seconds, results):
+    from server import ArenaServer, make_arena
+    server = ArenaServer(make_arena(map_size, wizards, seed=0), host, port)
+    results.put('ready')
+    elapsed = server.run(seconds)
+    results.put(server.statistics(elapsed, server.tick_times))
+    server.close()
+
+# Connects the bot players, retrying for a while in case the server has only just started.
+def connect_players(host, port, count, rng, timeout=10):
+    players = []
+    deadline = perf_counter() + timeout
+    while len(players) < count:
+        try:
+            players.append(BotPlayer(host, port, rng))
+        except ConnectionError:
+            if perf_counter() > deadline:
+                raise
+            time.sleep(.1)
+    return players
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the arena server with many bot players.')
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=20, help='how long the players stay connected')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--connect', action='store_true', help='test a server that is already running')
+    parser.add_argument('--map', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        help='map size in tiles for the server that is started (default: the Tiled dungeon map)')
+    parser.add_argument('--wizards', type=int, default=200, help='extra wizards for the server that is started')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = None
+    if not args.connect:
+        results = multiprocessing.Queue()
+        # The server runs a little longer than the test, so it is still ticking when the last player leaves.
+        server = multiprocessing.Process(target=serve, args=(args.host, args.port, args.map, args.wizards,
+                                                             args.seconds + 2, results))
+        server.start()
+        while True:
+            try:
+                results.get(timeout=.5)
+                break
+            except queue.Empty:
+                if not server.is_alive():
+                    sys.exit('The server stopped before it was ready.')
+    rng = random.Random(args.seed)
+    players = connect_players(args.host, args.port, args.players, rng)
+    selector = selectors.DefaultSelector()
+    for player in players:
+        selector.register(player.connection, selectors.EVENT_READ, player)
+    print('Connected {} players.'.format(len(players)), flush=True)
+
+    start = perf_counter()
+    while perf_counter() - start < args.seconds:
+        for key, events in selector.select(.005):
+            if not key.data.read():
+                selector.unregister(key.fileobj)
+        now = perf_counter()
+        for player in players:
+            if now >= player.next_input:
+                player.send_input()
+    elapsed = perf_counter() - start
+    for player in players:
+        player.connection.close()
+
+    received = sum(player.bytes_received for player in players)
+    snapshots = sum(player.snapshots for player in players)
+    visible = sum(len(player.decoder) for player in players)
+    print('{} players for {:.1f} s: {:.1f} snapshots per player per second, {:.0f} bytes per snapshot, '
+          '{:.1f} sprites seen per player'.format(len(players), elapsed, snapshots / len(players) / elapsed,
+                                                 received / max(1, snapshots), visible / len(players)))
+    print('Received {:.2f} KB/s per player, {:.2f} Mbit/s in total.'.format(
+        received / len(players) / elapsed / 1024, received * 8 / elapsed / 1e6))
+    if server is not None:
+        stats = results.get()
+        server.join()
+        print('Server: {ticks} ticks, p50 {tick_p50:.2f} ms, p95 {tick_p95:.2f} ms, p99 {tick_p99:.2f} ms, '
+              'max {tick_max:.2f} ms (budget {tick_budget:.2f} ms, {late_ticks} late), '
+              '{snapshots_sent} snapshots sent, {snapshots_skipped} skipped.'.format(**stats))
+
+if __name__ == '__main__':
+    main()
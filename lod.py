@@ -0,0 +1,45 @@
+import numpy
+from settings import *
+
+# The tiers a wizard can be in, from the most to the least often updated.
+AI_TIERS = ['near', 'far', 'asleep']
+
+class AIScheduler:
+    '''A class to sort the wizards into tiers by how far they are from the knights, so far away wizards think less often.'''
+    # Every tick, update() marks each wizard as due or not. A wizard that is not due skips its update,
+    # and the time it skipped is added on to its next one, so it still ends up where it would have been.
+    # Sleeping wizards do not keep the time they sleep through, so they wake up standing where they fell asleep.
+    # Wizards are only ever far or asleep off the screen, so nobody sees them move in jumps or stand still.
+    def __init__(self):
+        self.ticks = 0
+        self.counts = dict.fromkeys(AI_TIERS, 0)
+
+    # A wizard's tier is decided by the closest knight (there is more than one in an arena on the server).
+    # Far wizards are updated every far_interval ticks (the frame governor makes it longer when frames are too slow).
+    def update(self, wizards, knight_positions, view, far_interval=AI_FAR_INTERVAL):
+        self.ticks += 1
+        counts = dict.fromkeys(AI_TIERS, 0)
+        near = AI_NEAR_DISTANCE ** 2
+        far = AI_FAR_DISTANCE ** 2
+        if AI_LOD and len(wizards):
+            # The squared distance from every wizard to its closest knight, worked out for all of them at once.
+            positions = numpy.array([wizard.position for wizard in wizards]).reshape(-1, 1, 2)
+            offsets = positions - numpy.array(knight_positions).reshape(1, -1, 2)
+            distances = (offsets[:, :, 0] * offsets[:, :, 0] + offsets[:, :, 1] * offsets[:, :, 1]).min(axis=1).tolist()
+        for index, wizard in enumerate(wizards):
+            if not AI_LOD:
+                tier = 'near'
+            else:
+                distance = distances[index]
+                if distance < near or view.colliderect(wizard.rect):
+                    tier = 'near'
+                elif distance < far:
+                    tier = 'far'
+                else:
+                    tier = 'asleep'
+            wizard.ai_tier = tier
+            # Far wizards take turns, so about the same number of them are updated every tick.
+            wizard.ai_due = tier == 'near' or (tier == 'far' and (self.ticks + wizard.ai_phase) % far_interval == 0)
+            counts[tier] += 1
+        self.counts = counts
+        return counts
@@ -0,0 +1,188 @@
+# Compiles Tiled maps into a compact binary file which loads much faster than the .tmx.
+# Compile a map ahead of time with: python mapcache.py maps/Dungeon_Map.tmx
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import numpy
+import pygame
+from settings import *
+from tilemap import TiledMap, MapObject
+
+MAP_CACHE_MAGIC = b'DGMC'
+MAP_CACHE_VERSION = 1
+# magic, version, source mtime, source sha1, width and height in tiles, tile width and height, layers, tiles, objects
+HEADER = struct.Struct('<4sHd20sIIHHHII')
+# Where the source mtime is in the header, after the magic and the version.
+MTIME_OFFSET = struct.calcsize('<4sH')
+TILE_HEADER = struct.Struct('<IHH')
+OBJECT_HEADER = struct.Struct('<ddddH')
+
+# Returns the name of the compiled file for a map file.
+def cache_path(filename):
+    return os.path.splitext(filename)[0] + MAP_CACHE_EXTENSION
+
+def hash_file(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha1(file.read()).digest()
+
+# Pads the file with zeros so that the next array starts on a 4 byte boundary.
+def align(file):
+    file.write(b'\0' * (-file.tell() % 4))
+
+# Writes the visible tile layers, the images of the tiles they use and the map objects of a TiledMap to a compiled file.
+def compile_map(tiled_map, filename, destination=None):
+    destination = destination or cache_path(filename)
+    tmxdata = tiled_map.tmxdata
+    layers = [layer for layer in tmxdata.visible_layers if hasattr(layer, 'data')]
+    gids = set()
+    for layer in layers:
+        for row in layer.data:
+            gids.update(row)
+    tiles = {}
+    for gid in sorted(gids):
+        image = tmxdata.get_tile_image_by_gid(gid) if gid else None
+        if image:
+            tiles[gid] = image
+    objects = list(tiled_map.objects)
+    # Writes to a temporary file first, so a half written file is never mistaken for a finished one.
+    temporary = destination + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAP_CACHE_MAGIC, MAP_CACHE_VERSION, os.stat(filename).st_mtime, hash_file(filename),
+                               tmxdata.width, tmxdata.height, tmxdata.tilewidth, tmxdata.tileheight,
+                               len(layers), len(tiles), len(objects)))
+        align(file)
+        for layer in layers:
+            file.write(numpy.array(layer.data, dtype='<u4').tobytes())
+        for gid, image in tiles.items():
+            width, height = image.get_size()
+            # Tiles without per-pixel alpha are copied onto a transparent surface first, so their alpha bytes are filled in.
+            if not image.get_flags() & pygame.SRCALPHA:
+                rgba_image = pygame.Surface((width, height), pygame.SRCALPHA)
+                rgba_image.blit(image, (0, 0))
+                image = rgba_image
+            file.write(TILE_HEADER.pack(gid, width, height))
+            file.write(pygame.image.tostring(image, 'RGBA'))
+        for tile_object in objects:
+            name = (tile_object.name or '').encode('utf-8')
+            file.write(OBJECT_HEADER.pack(tile_object.x, tile_object.y, tile_object.width, tile_object.height, len(name)))
+            file.write(name)
+    os.replace(temporary, destination)
+    return destination
+
+# Reads just the header of a compiled file, or returns None if it is missing or from another version.
+def read_header(destination):
+    try:
+        with open(destination, 'rb') as file:
+            data = file.read(HEADER.size)
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    header = HEADER.unpack(data)
+    if header[0] != MAP_CACHE_MAGIC or header[1] != MAP_CACHE_VERSION:
+        return None
+    return header
+
+# Checks if a compiled file still matches its map file.
+# A matching modification time is trusted straight away, otherwise the contents are compared by their hash.
+# When only the modification time changed (e.g. the map was checked out again), the new time is written into the
+# compiled file, so the map does not have to be hashed again every time it is loaded.
+def is_fresh(filename, destination=None):
+    destination = destination or cache_path(filename)
+    header = read_header(destination)
+    if header is None:
+        return False
+    mtime = os.stat(filename).st_mtime
+    if header[2] == mtime:
+        return True
+    if header[3] != hash_file(filename):
+        return False
+    try:
+        with open(destination, 'r+b') as file:
+            file.seek(MTIME_OFFSET)
+            file.write(struct.pack('<d', mtime))
+    except OSError:
+        # A compiled file that cannot be written to is still up to date, it just gets hashed again next time.
+        pass
+    return True
+
+class CompiledMap:
+    '''A class to manage a map loaded from a compiled map file instead of from Tiled.'''
+    def __init__(self, destination):
+        # The file is memory-mapped, so the tile layers are read straight from it instead of being parsed.
+        with open(destination, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.buffer, 0)
+        (_, _, _, _, self.tiles_wide, self.tiles_high, self.tilewidth, self.tileheight,
+         layer_count, tile_count, object_count) = header
+        self.width = self.tiles_wide * self.tilewidth
+        self.height = self.tiles_high * self.tileheight
+        offset = HEADER.size + (-HEADER.size % 4)
+        self.layers = []
+        layer_size = self.tiles_wide * self.tiles_high
+        for _ in range(layer_count):
+            layer = numpy.frombuffer(self.buffer, dtype='<u4', count=layer_size, offset=offset)
+            self.layers.append(layer.reshape(self.tiles_high, self.tiles_wide))
+            offset += layer_size * 4
+        self.tile_images = {}
+        converted = pygame.display.get_surface() is not None
+        for _ in range(tile_count):
+            gid, width, height = TILE_HEADER.unpack_from(self.buffer, offset)
+            offset += TILE_HEADER.size
+            size = width * height * 4
+            image = pygame.image.frombytes(self.buffer[offset:offset + size], (width, height), 'RGBA')
+            self.tile_images[gid] = image.convert_alpha() if converted else image
+            offset += size
+        self.objects = []
+        for _ in range(object_count):
+            x, y, width, height, name_length = OBJECT_HEADER.unpack_from(self.buffer, offset)
+            offset += OBJECT_HEADER.size
+            name = bytes(self.buffer[offset:offset + name_length]).decode('utf-8') or None
+            offset += name_length
+            self.objects.append(MapObject(name, x, y, width, height))
+
+    # Draws only the tiles inside a rectangle of the map (in pixels) onto a surface the size of that rectangle.
+    def render_area(self, surface, area):
+        tile_images = self.tile_images
+        first_x = max(0, area.left // self.tilewidth)
+        last_x = min(self.tiles_wide, -(-area.right // self.tilewidth))
+        first_y = max(0, area.top // self.tileheight)
+        last_y = min(self.tiles_high, -(-area.bottom // self.tileheight))
+        for layer in self.layers:
+            block = layer[first_y:last_y, first_x:last_x].tolist()
+            for row_index, row in enumerate(block):
+                y = (first_y + row_index) * self.tileheight - area.top
+                for column_index, gid in enumerate(row):
+                    tile = tile_images.get(gid)
+                    if tile:
+                        surface.blit(tile, ((first_x + column_index) * self.tilewidth - area.left, y))
+
+    def render(self, surface):
+        self.render_area(surface, surface.get_rect())
+
+    def make_map(self):
+        temporary_surface = pygame.Surface((self.width, self.height))
+        self.render(temporary_surface)
+        return temporary_surface
+
+# Loads a map from its compiled file if that is still up to date, otherwise loads the .tmx and compiles it for next time.
+def load_map(filename):
+    destination = cache_path(filename)
+    if is_fresh(filename, destination):
+        return CompiledMap(destination)
+    tiled_map = TiledMap(filename)
+    try:
+        compile_map(tiled_map, filename, destination)
+    except OSError:
+        # The game can still be played from the .tmx if the compiled file cannot be written.
+        pass
+    return tiled_map
+
+if __name__ == '__main__':
+    pygame.init()
+    # Tiled's images are converted for the screen when they are loaded, so a (hidden) window is needed.
+    pygame.display.set_mode((1, 1), pygame.HIDDEN)
+    for filename in sys.argv[1:]:
+        print('Compiled {} to {}'.format(filename, compile_map(TiledMap(filename), filename)))
@@ -0,0 +1,235 @@
+# Generates dungeon maps from a seed: rooms laid out on a grid and joined by corridors, with the knight, the wizards
+# and the health potions placed in the rooms. Maps can be as large as 2000 x 2000 tiles.
+# A generated map can be written as a Tiled map (.tmx), or as a compact binary map (.dgdn) which the game streams
+# a few regions at a time (see streaming.py), so a huge map is never loaded whole.
+# Generate a 2000 x 2000 tile map and play it: python mapgen.py 2000 2000 --seed 1 --out maps/huge.dgdn
+#                                                python dungeon_game.py --map maps/huge.dgdn
+# Write a smaller one for Tiled: python mapgen.py 150 100 --out maps/generated.tmx
+import os
+import struct
+import argparse
+from time import perf_counter
+import numpy
+from settings import *
+from spatial import merge_tiles
+from tilemap import GeneratedMap, MapObject
+
+DUNGEON_MAGIC = b'DGDN'
+DUNGEON_VERSION = 1
+# magic, version, seed, width and height in tiles, tile size, region size in tiles, knight x and y, walls, spawns
+HEADER = struct.Struct('<4sHQIIHHddII')
+# The kinds of spawn point, named like the game's map objects.
+SPAWN_KINDS = ['wizard', 'health']
+SPAWN = numpy.dtype([('kind', 'u1'), ('x', '<f4'), ('y', '<f4')])
+# Walls are rectangles of whole tiles, and none of them crosses the edge of a region.
+WALL = numpy.dtype([('x', '<u2'), ('y', '<u2'), ('width', '<u2'), ('height', '<u2')])
+
+# Pads the file with zeros so that the next array starts on a 4 byte boundary.
+def align(file):
+    file.write(b'\0' * (-file.tell() % 4))
+
+class DungeonLayout:
+    '''A class to hold a generated dungeon: which tiles are walls, where the knight starts and where everything spawns.'''
+    # solid is an array of columns by rows, True where there is a wall. Positions are in pixels.
+    def __init__(self, solid, knight, spawns, seed, region_size=STREAM_REGION_SIZE):
+        self.solid = solid
+        self.columns, self.rows = solid.shape
+        self.knight = knight
+        self.spawns = spawns
+        self.seed = seed
+        self.region_size = region_size
+        self.regions_wide = -(-self.columns // region_size)
+        self.regions_high = -(-self.rows // region_size)
+
+    # Splits the walls into as few rectangles as it can within each region, region by region (row after row).
+    # Returns the rectangles (in tiles) and the index of the first rectangle of every region, plus one past the last.
+    def region_walls(self):
+        size = self.region_size
+        walls = []
+        starts = [0]
+        for region_y in range(self.regions_high):
+            for region_x in range(self.regions_wide):
+                left = region_x * size
+                top = region_y * size
+                block = self.solid[left:left + size, top:top + size]
+                walls.extend((left + x, top + y, width, height) for x, y, width, height in merge_tiles(block))
+                starts.append(len(walls))
+        return numpy.array(walls, dtype=WALL), numpy.array(starts, dtype='<u4')
+
+    # Sorts the spawns by region, and returns them with the index of the first spawn of every region.
+    def region_spawns(self):
+        size = self.region_size * TILESIZE
+        regions = ((self.spawns['y'] // size).astype(int) * self.regions_wide
+                   + (self.spawns['x'] // size).astype(int))
+        order = numpy.argsort(regions, kind='stable')
+        starts = numpy.searchsorted(regions[order], numpy.arange(self.regions_wide * self.regions_high + 1))
+        return self.spawns[order], starts.astype('<u4')
+
+    # Lists the map objects of the dungeon, the way a Tiled map would have them: the walls, the knight and the spawns.
+    def objects(self):
+        walls, _ = self.region_walls()
+        objects = [MapObject('wall', x * TILESIZE, y * TILESIZE, width * TILESIZE, height * TILESIZE)
+                   for x, y, width, height in walls.tolist()]
+        objects.append(MapObject('knight', self.knight[0], self.knight[1], 0, 0))
+        for kind, x, y in self.spawns.tolist():
+            objects.append(MapObject(SPAWN_KINDS[kind], x, y, 0, 0))
+        return objects
+
+    # Returns the dungeon as a map the game can play whole (only sensible for small dungeons).
+    def to_map(self):
+        return GeneratedMap(self.columns, self.rows, self.objects())
+
+# Generates a dungeon of columns by rows tiles. The map is split into a grid of cells and every cell gets one room.
+# The rooms are joined into a maze by corridors between neighbouring cells (a random spanning tree),
+# and some extra corridors make loops so there is more than one way around.
+def generate_dungeon(columns, rows, seed=0, cell_size=MAPGEN_CELL_SIZE):
+    if columns < cell_size + 2 or rows < cell_size + 2:
+        raise ValueError('a dungeon has to be at least {} tiles wide and high'.format(cell_size + 2))
+    rng = numpy.random.default_rng(seed)
+    solid = numpy.ones((columns, rows), dtype=bool)
+    # The cells start one tile in from the edge of the map, and a room keeps one tile of wall to each side of its cell.
+    cells_wide = (columns - 2) // cell_size
+    cells_high = (rows - 2) // cell_size
+    shape = (cells_wide, cells_high)
+    widths = rng.integers(MAPGEN_ROOM_MIN, cell_size - 2, size=shape, endpoint=True)
+    heights = rng.integers(MAPGEN_ROOM_MIN, cell_size - 2, size=shape, endpoint=True)
+    cell_x, cell_y = numpy.indices(shape)
+    lefts = 1 + cell_x * cell_size + 1 + rng.integers(0, cell_size - 1 - widths)
+    tops = 1 + cell_y * cell_size + 1 + rng.integers(0, cell_size - 1 - heights)
+    for left, top, width, height in zip(lefts.ravel().tolist(), tops.ravel().tolist(),
+                                        widths.ravel().tolist(), heights.ravel().tolist()):
+        solid[left:left + width, top:top + height] = False
+    centres_x = lefts + widths // 2
+    centres_y = tops + heights // 2
+
+    # Picks the corridors: every edge between neighbouring cells, in a random order, joins two cells that are not
+    # joined yet (Kruskal's algorithm with a union-find), and a few of the other edges are used too.
+    edges = [((x, y), (x + 1, y)) for x in range(cells_wide - 1) for y in range(cells_high)]
+    edges += [((x, y), (x, y + 1)) for x in range(cells_wide) for y in range(cells_high - 1)]
+    order = rng.permutation(len(edges)).tolist()
+    loops = (rng.random(len(edges)) < MAPGEN_LOOP_CHANCE).tolist()
+    horizontal_first = (rng.random(len(edges)) < .5).tolist()
+    parent = list(range(cells_wide * cells_high))
+
+    def find(cell):
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    half = MAPGEN_CORRIDOR_WIDTH // 2
+    for index in order:
+        (x1, y1), (x2, y2) = edges[index]
+        root1 = find(x1 * cells_high + y1)
+        root2 = find(x2 * cells_high + y2)
+        if root1 == root2 and not loops[index]:
+            continue
+        parent[root1] = root2
+        # Digs an L-shaped corridor from one room's centre to the other's.
+        start_x, start_y = int(centres_x[x1, y1]), int(centres_y[x1, y1])
+        end_x, end_y = int(centres_x[x2, y2]), int(centres_y[x2, y2])
+        corner = (end_x, start_y) if horizontal_first[index] else (start_x, end_y)
+        for (ax, ay), (bx, by) in [((start_x, start_y), corner), (corner, (end_x, end_y))]:
+            left = max(1, min(ax, bx) - half)
+            top = max(1, min(ay, by) - half)
+            right = min(columns - 1, max(ax, bx) - half + MAPGEN_CORRIDOR_WIDTH)
+            bottom = min(rows - 1, max(ay, by) - half + MAPGEN_CORRIDOR_WIDTH)
+            solid[left:right, top:bottom] = False
+
+    # The knight starts in the middle of the room closest to the middle of the map.
+    distances = (centres_x - columns / 2) ** 2 + (centres_y - rows / 2) ** 2
+    knight_cell = numpy.unravel_index(distances.argmin(), shape)
+    knight = (float(centres_x[knight_cell] + .5) * TILESIZE, float(centres_y[knight_cell] + .5) * TILESIZE)
+    # Every other room gets a few wizards and maybe a health potion, anywhere at least a tile in from its walls.
+    wizards = rng.poisson(MAPGEN_WIZARDS_PER_ROOM, size=shape)
+    wizards[knight_cell] = 0
+    potions = (rng.random(shape) < MAPGEN_HEALTH_CHANCE).astype(int)
+    potions[knight_cell] = 0
+    spawns = []
+    for kind, counts in enumerate([wizards, potions]):
+        rooms = numpy.repeat(numpy.arange(counts.size), counts.ravel())
+        spawn = numpy.zeros(len(rooms), dtype=SPAWN)
+        spawn['kind'] = kind
+        spawn['x'] = (lefts.ravel()[rooms] + 1 + rng.random(len(rooms)) * (widths.ravel()[rooms] - 2)) * TILESIZE
+        spawn['y'] = (tops.ravel()[rooms] + 1 + rng.random(len(rooms)) * (heights.ravel()[rooms] - 2)) * TILESIZE
+        spawns.append(spawn)
+    return DungeonLayout(solid, knight, numpy.concatenate(spawns), seed)
+
+# Writes a dungeon as a compact binary map: the header, one bit per tile (row after row), where each region's walls and
+# spawns start, then the walls and the spawns themselves.
+def save_dungeon(layout, filename):
+    walls, wall_starts = layout.region_walls()
+    spawns, spawn_starts = layout.region_spawns()
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(DUNGEON_MAGIC, DUNGEON_VERSION, layout.seed, layout.columns, layout.rows, TILESIZE,
+                               layout.region_size, layout.knight[0], layout.knight[1], len(walls), len(spawns)))
+        align(file)
+        file.write(numpy.packbits(layout.solid.T, axis=1).tobytes())
+        align(file)
+        file.write(wall_starts.tobytes())
+        file.write(spawn_starts.tobytes())
+        file.write(walls.tobytes())
+        file.write(spawns.tobytes())
+    os.replace(temporary, filename)
+    return filename
+
+# Writes a dungeon as a Tiled map, with the walls as a tile layer (using the wall image) and as wall objects,
+# and the knight, wizards and health potions as point objects.
+def save_tmx(layout, filename):
+    image = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image', WALL_IMAGE)
+    image = os.path.relpath(image, os.path.dirname(os.path.abspath(filename))).replace(os.sep, '/')
+    objects = layout.objects()
+    with open(filename, 'w') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write('<map version="1.9" orientation="orthogonal" renderorder="right-down" width="{}" height="{}" '
+                   'tilewidth="{}" tileheight="{}" infinite="0" nextlayerid="3" nextobjectid="{}">\n'.format(
+                       layout.columns, layout.rows, TILESIZE, TILESIZE, len(objects) + 1))
+        file.write(' <tileset firstgid="1" name="Generated" tilewidth="{0}" tileheight="{0}" tilecount="1" '
+                   'columns="0">\n'.format(TILESIZE))
+        file.write('  <grid orientation="orthogonal" width="1" height="1"/>\n')
+        file.write('  <tile id="0">\n   <image width="{0}" height="{0}" source="{1}"/>\n  </tile>\n'.format(
+            TILESIZE, image))
+        file.write(' </tileset>\n')
+        file.write(' <layer id="1" name="Walls" width="{}" height="{}">\n  <data encoding="csv">\n'.format(
+            layout.columns, layout.rows))
+        lines = [','.join(row) for row in numpy.where(layout.solid.T, '1', '0').tolist()]
+        file.write(',\n'.join(lines))
+        file.write('\n</data>\n </layer>\n')
+        file.write(' <objectgroup id="2" name="Objects">\n')
+        for object_id, tile_object in enumerate(objects, 1):
+            if tile_object.name == 'wall':
+                file.write('  <object id="{}" name="wall" x="{}" y="{}" width="{}" height="{}"/>\n'.format(
+                    object_id, tile_object.x, tile_object.y, tile_object.width, tile_object.height))
+            else:
+                file.write('  <object id="{}" name="{}" x="{:.2f}" y="{:.2f}">\n   <point/>\n  </object>\n'.format(
+                    object_id, tile_object.name, tile_object.x, tile_object.y))
+        file.write(' </objectgroup>\n</map>\n')
+    return filename
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a dungeon map.')
+    parser.add_argument('width', type=int, help='width in tiles')
+    parser.add_argument('height', type=int, help='height in tiles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join('maps', 'generated' + DUNGEON_EXTENSION),
+                        help='file to write (.tmx for Tiled, otherwise a binary map for streaming)')
+    args = parser.parse_args()
+    start = perf_counter()
+    try:
+        layout = generate_dungeon(args.width, args.height, args.seed)
+    except ValueError as error:
+        parser.error(str(error))
+    generated = perf_counter() - start
+    if args.out.endswith('.tmx'):
+        save_tmx(layout, args.out)
+    else:
+        save_dungeon(layout, args.out)
+    kinds = numpy.bincount(layout.spawns['kind'], minlength=len(SPAWN_KINDS))
+    print('Generated {} x {} tiles in {:.2f} s: {:.0%} open, {} wizards, {} health potions.'.format(
+        args.width, args.height, generated, 1 - layout.solid.mean(), kinds[0], kinds[1]))
+    print('Wrote {} ({:.1f} KB) in {:.2f} s.'.format(args.out, os.path.getsize(args.out) / 1024,
+                                                     perf_counter() - start - generated))
+
+if __name__ == '__main__':
+    main()
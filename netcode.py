@@ -0,0 +1,161 @@
+# The messages sent between the arena server and its players (see server.py and loadtest.py).
+# Every message is a 4 byte length followed by that many bytes, the first of which is the message's type.
+# Players send the keys they hold down, and the server sends each player snapshots of the sprites around its knight.
+# A snapshot only holds what changed since the last snapshot sent to that player: the sprites that appeared,
+# the values of the sprites that moved or changed, and the sprites that are gone.
+import struct
+import numpy
+from settings import *
+
+LENGTH = struct.Struct('<I')
+WELCOME = 1
+INPUT = 2
+SNAPSHOT = 3
+# type, the player's knight id, tick length
+WELCOME_MESSAGE = struct.Struct('<BHd')
+# type, keys held down (packed like an input log, see replay.py)
+INPUT_MESSAGE = struct.Struct('<BB')
+# type, tick, number of groups
+SNAPSHOT_HEADER = struct.Struct('<BIB')
+# The records of a snapshot come in groups of sprites which send the same values: the values that are sent, or
+# REMOVED for the sprites that are gone, and the number of records in the group.
+GROUP_HEADER = struct.Struct('<BH')
+REMOVED = 0x80
+
+# The kinds of sprite in a snapshot. A sprite is known by its kind and an id which is unique for its kind.
+KINDS = ['knight', 'wizard', 'stone', 'collectible']
+# The values of a sprite: x and y in 1 / SNAPSHOT_POSITION_SCALE pixels, rotation in 256ths of a turn, and health.
+# Positions take 4 bytes each, since 2 bytes would only reach 16384 pixels, and generated maps (see mapgen.py) are
+# far bigger than that. A group sends the values whose bits are set, after each sprite's kind and id.
+FIELDS = [(0x1, 'x', '<u4'), (0x2, 'y', '<u4'), (0x4, 'rotation', 'u1'), (0x8, 'health', 'u1')]
+ALL_FIELDS = 0xf
+FIELD_BITS = numpy.array([bit for bit, name, code in FIELDS])
+RECORDS = [numpy.dtype([('kind', 'u1'), ('id', '<u2')] + [(name, code) for bit, name, code in FIELDS if bits & bit])
+           for bits in range(16)]
+
+# Adds the length in front of a message, ready to be sent.
+def pack_message(payload):
+    return LENGTH.pack(len(payload)) + payload
+
+# Rounds positions (in pixels) to the whole numbers they are sent as.
+def quantize_positions(values):
+    return numpy.clip(numpy.rint(numpy.asarray(values, dtype=float) * SNAPSHOT_POSITION_SCALE), 0,
+                      0xffffffff).astype(numpy.int64)
+
+def quantize_rotations(values):
+    return numpy.rint(numpy.asarray(values, dtype=float) % 360 * 256 / 360).astype(int) % 256
+
+def quantize_health(values):
+    return numpy.clip(numpy.rint(numpy.asarray(values, dtype=float)), 0, 0xff).astype(int)
+
+# Turns kinds and ids into one number per sprite, which sorts the sprites by kind and then id.
+def sprite_codes(kinds, ids):
+    return numpy.asarray(kinds, dtype=numpy.int64) << 16 | numpy.asarray(ids, dtype=numpy.int64)
+
+# Returns where each code is in a sorted array of codes, and which of them are in it at all.
+def find_codes(sorted_codes, codes):
+    places = numpy.searchsorted(sorted_codes, codes)
+    found = places < len(sorted_codes)
+    found[found] = sorted_codes[places[found]] == codes[found]
+    return places, found
+
+# Packs the records of one group: the kind, id and the values whose bits are set of every sprite in it.
+def pack_group(bits, codes, values):
+    records = numpy.empty(len(codes), dtype=RECORDS[bits & ALL_FIELDS])
+    records['kind'] = codes >> 16
+    records['id'] = codes & 0xffff
+    for index, (bit, name, code) in enumerate(FIELDS):
+        if bits & bit:
+            records[name] = values[:, index]
+    return GROUP_HEADER.pack(bits, len(codes)) + records.tobytes()
+
+class MessageReader:
+    '''A class to collect the bytes read from a socket and split them into whole messages.'''
+    def __init__(self):
+        self.buffer = bytearray()
+
+    # Adds the bytes that were read, and returns every message that is now complete.
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        start = 0
+        while len(self.buffer) - start >= LENGTH.size:
+            length = LENGTH.unpack_from(self.buffer, start)[0]
+            if len(self.buffer) - start - LENGTH.size < length:
+                break
+            start += LENGTH.size
+            messages.append(bytes(self.buffer[start:start + length]))
+            start += length
+        del self.buffer[:start]
+        return messages
+
+class SnapshotEncoder:
+    '''A class to write a player's snapshots, each one holding only what changed since the one before.'''
+    # The server only encodes a snapshot when it is going to send it, and the players' sockets are TCP,
+    # so every snapshot arrives and the last one sent is always the one the player has.
+    def __init__(self):
+        # The codes (sorted) and values of the sprites in the last snapshot.
+        self.codes = numpy.zeros(0, dtype=numpy.int64)
+        self.values = numpy.zeros((0, len(FIELDS)), dtype=int)
+
+    # Makes the snapshot message for a tick from the sorted codes and the values of the sprites the player can see.
+    def encode(self, tick, codes, values):
+        places, found = find_codes(self.codes, codes)
+        # Works out which values changed for the sprites that were in the last snapshot. New sprites send every value.
+        changed = numpy.full(len(codes), ALL_FIELDS)
+        changed[found] = (values[found] != self.values[places[found]]) @ FIELD_BITS
+        groups = []
+        for bits in numpy.unique(changed[changed != 0]).tolist():
+            chosen = changed == bits
+            groups.append(pack_group(bits, codes[chosen], values[chosen]))
+        gone = ~find_codes(codes, self.codes)[1]
+        if gone.any():
+            groups.append(pack_group(REMOVED, self.codes[gone], None))
+        self.codes = codes
+        self.values = values
+        return pack_message(SNAPSHOT_HEADER.pack(SNAPSHOT, tick, len(groups)) + b''.join(groups))
+
+class SnapshotDecoder:
+    '''A class to rebuild the sprites a player can see from the snapshots it is sent.'''
+    def __init__(self):
+        # The codes (sorted) and values of every sprite the player can see, in the units they are sent in.
+        self.codes = numpy.zeros(0, dtype=numpy.int64)
+        self.values = numpy.zeros((0, len(FIELDS)), dtype=int)
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.codes)
+
+    def apply(self, message):
+        _, self.tick, groups = SNAPSHOT_HEADER.unpack_from(message)
+        offset = SNAPSHOT_HEADER.size
+        for _ in range(groups):
+            bits, count = GROUP_HEADER.unpack_from(message, offset)
+            offset += GROUP_HEADER.size
+            dtype = RECORDS[bits & ALL_FIELDS]
+            records = numpy.frombuffer(message, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count
+            codes = sprite_codes(records['kind'], records['id'])
+            if bits & REMOVED:
+                keep = ~find_codes(codes[numpy.argsort(codes)], self.codes)[1]
+                self.codes = self.codes[keep]
+                self.values = self.values[keep]
+                continue
+            places, found = find_codes(self.codes, codes)
+            # Sprites that are new to the player are added with zeros, then every sprite's sent values are filled in.
+            if not found.all():
+                added = numpy.zeros((len(codes) - found.sum(), len(FIELDS)), dtype=int)
+                self.codes = numpy.concatenate([self.codes, codes[~found]])
+                self.values = numpy.concatenate([self.values, added])
+                order = numpy.argsort(self.codes, kind='stable')
+                self.codes = self.codes[order]
+                self.values = self.values[order]
+                places = numpy.searchsorted(self.codes, codes)
+            for index, (bit, name, code) in enumerate(FIELDS):
+                if bits & bit:
+                    self.values[places, index] = records[name]
+
+    # Returns the values of every sprite the player can see, by (kind, id).
+    def entities(self):
+        return {(code >> 16, code & 0xffff): tuple(values)
+                for code, values in zip(self.codes.tolist(), self.values.tolist())}
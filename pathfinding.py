@@ -0,0 +1,118 @@
+import numpy
+import pygame
+from settings import *
+vec = pygame.math.Vector2
+
+# The eight directions a wizard can step in, as (x, y) tile offsets.
+STEPS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+class FlowField:
+    '''A class to work out, once for every wizard, which way to walk around the walls to reach the knight.'''
+    # The field is a breadth-first search outwards from the knight's tile over the tiles that are not walls.
+    # It only covers FLOW_FIELD_RADIUS tiles around the knight, so its cost does not grow with the size of the map,
+    # and it is only worked out again when the knight walks onto a different tile.
+    # The tiles that the walls are on come from the game's wall mask, which may only cover part of the map.
+    def __init__(self, wall_mask, radius=FLOW_FIELD_RADIUS):
+        self.mask_origin = wall_mask.origin
+        self.columns = wall_mask.columns
+        self.rows = wall_mask.rows
+        self.radius = radius
+        self.solid = wall_mask.solid
+        self.knight_tile = None
+        # The tile that the field's arrays start at, and the step each tile takes towards the knight.
+        self.origin = (0, 0)
+        self.distance = numpy.zeros((0, 0), dtype=int)
+        self.step_x = numpy.zeros((0, 0), dtype=int)
+        self.step_y = numpy.zeros((0, 0), dtype=int)
+
+    def tile_for(self, position):
+        return (int(position[0] // TILESIZE), int(position[1] // TILESIZE))
+
+    # Works out the field again if the knight has walked onto a different tile since it was last worked out.
+    def update(self, knight_position):
+        tile = self.tile_for(knight_position)
+        if tile != self.knight_tile:
+            self.knight_tile = tile
+            self.compute(tile)
+
+    def compute(self, tile):
+        mask_x, mask_y = self.mask_origin
+        left = max(mask_x, tile[0] - self.radius)
+        top = max(mask_y, tile[1] - self.radius)
+        right = min(mask_x + self.columns, tile[0] + self.radius + 1)
+        bottom = min(mask_y + self.rows, tile[1] + self.radius + 1)
+        self.origin = (left, top)
+        if left >= right or top >= bottom or not (left <= tile[0] < right and top <= tile[1] < bottom):
+            # The knight is off the map, so every wizard just walks straight at it.
+            self.distance = numpy.zeros((0, 0), dtype=int)
+            return
+        open_tiles = ~self.solid[left - mask_x:right - mask_x, top - mask_y:bottom - mask_y]
+        start = (tile[0] - left, tile[1] - top)
+        open_tiles[start] = True
+        # Spreads out from the knight one ring of tiles at a time, over every open tile at once.
+        distance = numpy.full(open_tiles.shape, -1, dtype=int)
+        frontier = numpy.zeros(open_tiles.shape, dtype=bool)
+        frontier[start] = True
+        steps = 0
+        while frontier.any():
+            distance[frontier] = steps
+            grown = numpy.zeros_like(frontier)
+            grown[1:, :] |= frontier[:-1, :]
+            grown[:-1, :] |= frontier[1:, :]
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & open_tiles & (distance < 0)
+            steps += 1
+        # For every tile, picks the neighbouring tile which is closest to the knight.
+        # Diagonal steps are only allowed when both tiles beside the diagonal are open, so wizards do not cut wall corners.
+        unreachable = numpy.iinfo(int).max
+        padded = numpy.pad(numpy.where(distance >= 0, distance, unreachable), 1, constant_values=unreachable)
+        padded_open = numpy.pad(open_tiles, 1, constant_values=False)
+        columns, rows = distance.shape
+        choices = []
+        for step_x, step_y in STEPS:
+            neighbour = padded[1 + step_x:1 + step_x + columns, 1 + step_y:1 + step_y + rows].copy()
+            if step_x and step_y:
+                beside_x = padded_open[1 + step_x:1 + step_x + columns, 1:1 + rows]
+                beside_y = padded_open[1:1 + columns, 1 + step_y:1 + step_y + rows]
+                neighbour[~(beside_x & beside_y)] = unreachable
+            choices.append(neighbour)
+        choices = numpy.stack(choices)
+        best = choices.argmin(axis=0)
+        offsets = numpy.array(STEPS)
+        self.step_x = offsets[best, 0]
+        self.step_y = offsets[best, 1]
+        # Tiles which cannot get any closer to the knight (the knight's own tile, or unreachable ones) have no step.
+        no_step = (distance <= 0) | (choices.min(axis=0) >= distance)
+        self.step_x[no_step] = 0
+        self.step_y[no_step] = 0
+        self.distance = distance
+
+    # Returns the point a wizard at a position should head for: the centre of the next tile on its path to the knight,
+    # or the knight itself if the wizard is on the knight's tile, outside of the field, or cannot reach the knight.
+    def target_for(self, position, knight_position):
+        x = int(position[0] // TILESIZE) - self.origin[0]
+        y = int(position[1] // TILESIZE) - self.origin[1]
+        if 0 <= x < self.distance.shape[0] and 0 <= y < self.distance.shape[1]:
+            step_x = self.step_x[x, y]
+            step_y = self.step_y[x, y]
+            if step_x or step_y:
+                return vec((x + self.origin[0] + step_x + .5) * TILESIZE, (y + self.origin[1] + step_y + .5) * TILESIZE)
+        return knight_position
+
+    # Does the same as target_for for arrays of x and y positions, and returns arrays of target x and y positions.
+    def targets_for(self, xs, ys, knight_position):
+        columns = numpy.floor_divide(xs, TILESIZE).astype(int) - self.origin[0]
+        rows = numpy.floor_divide(ys, TILESIZE).astype(int) - self.origin[1]
+        inside = ((columns >= 0) & (columns < self.distance.shape[0])
+                  & (rows >= 0) & (rows < self.distance.shape[1]))
+        step_x = numpy.zeros(len(xs), dtype=int)
+        step_y = numpy.zeros(len(xs), dtype=int)
+        step_x[inside] = self.step_x[columns[inside], rows[inside]]
+        step_y[inside] = self.step_y[columns[inside], rows[inside]]
+        moving = (step_x != 0) | (step_y != 0)
+        target_x = numpy.full(len(xs), float(knight_position[0]))
+        target_y = numpy.full(len(xs), float(knight_position[1]))
+        target_x[moving] = (columns[moving] + self.origin[0] + step_x[moving] + .5) * TILESIZE
+        target_y[moving] = (rows[moving] + self.origin[1] + step_y[moving] + .5) * TILESIZE
+        return target_x, target_y
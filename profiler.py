@@ -0,0 +1,135 @@
+import csv
+import json
+import pygame
+from collections import deque
+from time import perf_counter
+from settings import *
+
+# The phases of a frame that are timed, in the order they happen.
+PROFILE_PHASES = ['events', 'sprites', 'collisions', 'draw', 'flip']
+# The calls that are counted every frame.
+PROFILE_COUNTERS = ['ticks', 'wall_checks', 'rotations', 'blits', 'sounds', 'ai_near', 'ai_far', 'ai_asleep',
+                    'regions_loaded', 'quality_level']
+
+class FrameProfiler:
+    '''A class to time each phase of a frame and count the expensive calls made during it.'''
+    enabled = True
+
+    # If a filename is given, every frame is written to it as it ends (CSV, or JSON lines if the name ends in .jsonl).
+    def __init__(self, filename=None, history=PROFILE_HISTORY):
+        self.frame = 0
+        self.times = {}
+        self.counts = {}
+        self.started = {}
+        self.frame_start = None
+        # Keeps only the most recent frames in memory, so long runs do not keep growing.
+        self.history = deque(maxlen=history)
+        self.show_overlay = PROFILE_OVERLAY
+        self.font = None
+        self.file = None
+        self.writer = None
+        if filename is not None:
+            self.open(filename)
+
+    def open(self, filename):
+        self.file = open(filename, 'w', newline='')
+        if filename.endswith('.jsonl'):
+            self.writer = None
+        else:
+            columns = ['frame', 'total'] + PROFILE_PHASES + PROFILE_COUNTERS
+            self.writer = csv.DictWriter(self.file, columns, extrasaction='ignore', restval=0)
+            self.writer.writeheader()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def begin_frame(self):
+        self.times = {}
+        self.counts = {}
+        self.frame_start = perf_counter()
+
+    # Starts and stops the timer for a phase. A phase timed more than once in a frame is added up.
+    def start(self, phase):
+        self.started[phase] = perf_counter()
+
+    def stop(self, phase):
+        elapsed = perf_counter() - self.started.pop(phase)
+        self.times[phase] = self.times.get(phase, 0) + elapsed
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        record = {'frame': self.frame, 'total': (perf_counter() - self.frame_start) * 1000}
+        # Times are stored in milliseconds.
+        for phase, elapsed in self.times.items():
+            record[phase] = elapsed * 1000
+        record.update(self.counts)
+        self.history.append(record)
+        if self.file is not None:
+            if self.writer is not None:
+                self.writer.writerow(record)
+            else:
+                self.file.write(json.dumps(record) + '\n')
+        self.frame += 1
+        self.frame_start = None
+
+    # Writes the frames still kept in memory to a file (CSV, or JSON lines if the name ends in .jsonl).
+    def export(self, filename):
+        with open(filename, 'w', newline='') as file:
+            if filename.endswith('.jsonl'):
+                for record in self.history:
+                    file.write(json.dumps(record) + '\n')
+            else:
+                columns = ['frame', 'total'] + PROFILE_PHASES + PROFILE_COUNTERS
+                writer = csv.DictWriter(file, columns, extrasaction='ignore', restval=0)
+                writer.writeheader()
+                writer.writerows(self.history)
+
+    # Draws the timings of the last finished frame in the top right corner of the screen.
+    def draw_overlay(self, surface):
+        if not self.show_overlay or not self.history:
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        record = self.history[-1]
+        lines = ['frame {:.2f} ms'.format(record['total'])]
+        for phase in PROFILE_PHASES:
+            lines.append('{} {:.2f} ms'.format(phase, record.get(phase, 0)))
+        for name in PROFILE_COUNTERS:
+            lines.append('{} {}'.format(name, record.get(name, 0)))
+        y = 10
+        for line in lines:
+            text_surface = self.font.render(line, True, WHITE, BLACK)
+            surface.blit(text_surface, (surface.get_width() - text_surface.get_width() - 10, y))
+            y += text_surface.get_height()
+
+class NullProfiler:
+    '''A profiler which does nothing, used when profiling is turned off.'''
+    enabled = False
+    show_overlay = False
+
+    def begin_frame(self):
+        pass
+
+    def start(self, phase):
+        pass
+
+    def stop(self, phase):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw_overlay(self, surface):
+        pass
+
+    def close(self):
+        pass
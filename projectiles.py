@@ -0,0 +1,139 @@
+import numpy
+import pygame
+from settings import *
+
+# Rounds like pygame.Rect does when it is given a float (halves are rounded away from zero).
+def round_like_rect(values):
+    return numpy.where(values >= 0, numpy.floor(values + .5), numpy.ceil(values - .5)).astype(int)
+
+class StonePool:
+    '''A class to manage every stone the knight throws in preallocated arrays, instead of one sprite per stone.'''
+    # Stones that are thrown reuse the slots of stones that are gone, and the arrays only grow when every slot is in use.
+    def __init__(self, game, capacity=STONE_POOL_SIZE):
+        self.game = game
+        self.image = game.stone_image
+        self.width, self.height = self.image.get_size()
+        self.position = numpy.zeros((capacity, 2))
+        # Where each stone was on the tick before, for drawing stones between ticks.
+        self.previous_position = numpy.zeros((capacity, 2))
+        self.velocity = numpy.zeros((capacity, 2))
+        self.spawn_time = numpy.zeros(capacity)
+        self.active = numpy.zeros(capacity, dtype=bool)
+        # The free list is a stack of the unused slots.
+        self.free = list(range(capacity - 1, -1, -1))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Doubles the size of the arrays once every slot is in use.
+    def grow(self):
+        capacity = len(self.active)
+        self.position = numpy.concatenate([self.position, numpy.zeros((capacity, 2))])
+        self.previous_position = numpy.concatenate([self.previous_position, numpy.zeros((capacity, 2))])
+        self.velocity = numpy.concatenate([self.velocity, numpy.zeros((capacity, 2))])
+        self.spawn_time = numpy.concatenate([self.spawn_time, numpy.zeros(capacity)])
+        self.active = numpy.concatenate([self.active, numpy.zeros(capacity, dtype=bool)])
+        self.free.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+    # Throws a stone from a position in the direction which the knight is facing.
+    def spawn(self, position, direction):
+        if not self.free:
+            self.grow()
+        index = self.free.pop()
+        self.position[index] = (position[0], position[1])
+        self.previous_position[index] = self.position[index]
+        self.velocity[index] = (direction[0] * STONE_SPEED, direction[1] * STONE_SPEED)
+        self.spawn_time[index] = self.game.now
+        self.active[index] = True
+        self.count += 1
+        return index
+
+    # Puts the stones in the given slots back on the free list.
+    def remove(self, indices):
+        indices = indices[self.active[indices]]
+        self.active[indices] = False
+        self.free.extend(indices.tolist())
+        self.count -= len(indices)
+
+    def clear(self):
+        self.remove(numpy.flatnonzero(self.active))
+
+    # Remembers where every stone is before the next tick moves them.
+    def remember_positions(self):
+        self.previous_position[:] = self.position
+
+    # Returns the slots in use and the left, top, right and bottom of each of those stones' rectangles.
+    # Other positions (e.g. ones between two ticks) can be passed in instead of the stones' own.
+    def rects(self, position=None):
+        if position is None:
+            position = self.position
+        indices = numpy.flatnonzero(self.active)
+        lefts = round_like_rect(position[indices, 0]) - self.width // 2
+        tops = round_like_rect(position[indices, 1]) - self.height // 2
+        return indices, lefts, tops, lefts + self.width, tops + self.height
+
+    # Moves every stone at once, then removes the ones which hit a wall or have existed for longer than STONE_TIME.
+    def update(self, dt, now):
+        if not self.count:
+            return
+        indices = numpy.flatnonzero(self.active)
+        self.position[indices] += self.velocity[indices] * dt
+        indices, lefts, tops, rights, bottoms = self.rects()
+        # Only the stones on a tile with a wall are checked against the walls themselves.
+        wall_grid = self.game.wall_grid
+        near_wall = self.game.wall_mask.boxes_solid(lefts, tops, rights, bottoms)
+        hit_wall = numpy.zeros(len(indices), dtype=bool)
+        for position in numpy.flatnonzero(near_wall):
+            rect = pygame.Rect(int(lefts[position]), int(tops[position]), self.width, self.height)
+            hit_wall[position] = wall_grid.collideany(rect) is not None
+        self.game.profiler.count('wall_checks', int(near_wall.sum()))
+        expired = now - self.spawn_time[indices] > STONE_TIME
+        self.remove(indices[hit_wall | expired])
+
+    # Finds which wizards are hit by stones and removes those stones.
+    # Like pygame.sprite.groupcollide, the wizards are checked in order and a stone can only hit the first wizard it touches.
+    def collide_wizards(self, wizards):
+        if not self.count or not wizards:
+            return []
+        wizards = wizards.sprites()
+        wizard_rects = numpy.array([wizard.rect[:] for wizard in wizards]).reshape(-1, 4)
+        return [wizards[row] for row in self.collide_rects(wizard_rects)]
+
+    # Does the same as collide_wizards for an array of wizard rectangles (left, top, width, height),
+    # and returns the rows of the rectangles that were hit.
+    def collide_rects(self, wizard_rects):
+        if not self.count or not len(wizard_rects):
+            return []
+        indices, lefts, tops, rights, bottoms = self.rects()
+        wizard_lefts = wizard_rects[:, 0:1]
+        wizard_tops = wizard_rects[:, 1:2]
+        wizard_rights = wizard_lefts + wizard_rects[:, 2:3]
+        wizard_bottoms = wizard_tops + wizard_rects[:, 3:4]
+        # A table of which wizard (row) overlaps which stone (column), worked out for every pair at once.
+        overlaps = ((wizard_lefts < rights) & (lefts < wizard_rights)
+                    & (wizard_tops < bottoms) & (tops < wizard_bottoms))
+        hits = []
+        remaining = numpy.ones(len(indices), dtype=bool)
+        for row in numpy.flatnonzero(overlaps.any(axis=1)):
+            hit = overlaps[row] & remaining
+            if hit.any():
+                hits.append(int(row))
+                remaining &= ~hit
+        self.remove(indices[~remaining])
+        return hits
+
+    # Draws the stones that are on the screen and returns the screen rectangles they were drawn in.
+    # An alpha below 1 draws each stone that fraction of the way from its position on the tick before.
+    def draw(self, surface, camera, alpha=1):
+        if not self.count:
+            return []
+        position = None
+        if alpha < 1:
+            position = self.previous_position + (self.position - self.previous_position) * alpha
+        indices, lefts, tops, rights, bottoms = self.rects(position)
+        view = camera.view_rect()
+        visible = (lefts < view.right) & (view.left < rights) & (tops < view.bottom) & (view.top < bottoms)
+        offset_x, offset_y = camera.camera.topleft
+        return surface.blits([(self.image, (int(left) + offset_x, int(top) + offset_y))
+                              for left, top in zip(lefts[visible], tops[visible])])
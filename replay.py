@@ -0,0 +1,180 @@
+# Records the input of every tick of a game to a small binary log, and plays a log back through the same code.
+# Record a game with: python dungeon_game.py --record session.dglog
+# Replay it in a window with: python replay.py session.dglog
+# Replay it as fast as possible with: python replay.py session.dglog --fast
+import sys
+import struct
+import hashlib
+import argparse
+from time import perf_counter
+import numpy
+import pygame
+from settings import *
+from controls import KeyState
+
+INPUT_LOG_MAGIC = b'DGIN'
+INPUT_LOG_VERSION = 1
+# magic, version, seed, tick length, wizard backend
+HEADER = struct.Struct('<4sHQdB')
+# Ticks in a row with the same keys, pause state and length are stored as one record: keys and pause, tick length, ticks.
+RECORD = struct.Struct('<BdH')
+# Written when the recording is finished: marker, number of ticks, digest of the game's state after the last tick.
+TRAILER = struct.Struct('<4sI20s')
+TRAILER_MAGIC = b'DEND'
+# The keys the knight reads, one bit each. The highest bit is set on ticks where the game was paused.
+LOGGED_KEYS = [pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE]
+PAUSED_BIT = 0x80
+BACKENDS = ['sprites', 'arrays']
+
+# Packs the logged keys that are held down into one byte.
+def keys_to_bits(keys):
+    bits = 0
+    for bit, key in enumerate(LOGGED_KEYS):
+        if keys[key]:
+            bits |= 1 << bit
+    return bits
+
+def bits_to_keys(bits):
+    return KeyState([key for bit, key in enumerate(LOGGED_KEYS) if bits & (1 << bit)])
+
+# Returns a hash of everything that should come out the same when a game is replayed.
+def state_digest(game):
+    digest = hashlib.sha1()
+    knight = game.knight
+    digest.update(struct.pack('<dddd', knight.position.x, knight.position.y, knight.rotation, knight.health))
+    wizards = [(wizard.position[0], wizard.position[1], wizard.health) for wizard in game.wizards]
+    if game.horde is not None:
+        wizards += [(wizard.position[0], wizard.position[1], wizard.health) for wizard in game.horde]
+    digest.update(numpy.array(sorted(wizards), dtype='<f8').tobytes())
+    indices = numpy.flatnonzero(game.stones.active)
+    digest.update(numpy.ascontiguousarray(game.stones.position[indices], dtype='<f8').tobytes())
+    digest.update(struct.pack('<d', game.now))
+    for name in sorted(game.stats):
+        digest.update(struct.pack('<q', game.stats[name]))
+    return digest.digest()
+
+class InputRecorder:
+    '''A class to pass on the input of another input provider while writing every tick of it to a log.'''
+    # The game calls end_tick() after every tick, which adds the keys the knight read during that tick to the log.
+    def __init__(self, provider, filename, seed, tick_dt, backend=WIZARD_BACKEND):
+        self.provider = provider
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(INPUT_LOG_MAGIC, INPUT_LOG_VERSION, seed, tick_dt, BACKENDS.index(backend)))
+        self.bits = 0
+        self.ticks = 0
+        # The record being built up: its keys and pause bits, its tick length and how many ticks it covers.
+        self.record = None
+
+    def get_pressed(self, game):
+        keys = self.provider.get_pressed(game)
+        self.bits = keys_to_bits(keys)
+        return keys
+
+    def end_tick(self, dt, paused):
+        bits = self.bits | (PAUSED_BIT if paused else 0)
+        self.bits = 0
+        self.ticks += 1
+        if self.record is not None and self.record[0] == bits and self.record[1] == dt and self.record[2] < 0xffff:
+            self.record[2] += 1
+        else:
+            self.write_record()
+            self.record = [bits, dt, 1]
+
+    def write_record(self):
+        if self.record is not None:
+            self.file.write(RECORD.pack(*self.record))
+            self.record = None
+
+    # Finishes the log with the number of ticks and a digest of the game's state, then closes it.
+    def close(self, game):
+        if self.file is None:
+            return
+        self.write_record()
+        self.file.write(TRAILER.pack(TRAILER_MAGIC, self.ticks, state_digest(game)))
+        self.file.close()
+        self.file = None
+
+class InputLog:
+    '''A class to read an input log back, one tick at a time.'''
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            data = file.read()
+        magic, version, self.seed, self.tick_dt, backend = HEADER.unpack_from(data)
+        if magic != INPUT_LOG_MAGIC or version != INPUT_LOG_VERSION:
+            raise ValueError('{} is not a version {} input log'.format(filename, INPUT_LOG_VERSION))
+        self.backend = BACKENDS[backend]
+        end = len(data)
+        # A log from a game that was not closed properly has no trailer, so it can be replayed but not checked.
+        self.ticks = None
+        self.digest = None
+        if end - HEADER.size >= TRAILER.size and data[end - TRAILER.size:end - TRAILER.size + 4] == TRAILER_MAGIC:
+            _, self.ticks, self.digest = TRAILER.unpack_from(data, end - TRAILER.size)
+            end -= TRAILER.size
+        records = (end - HEADER.size) // RECORD.size
+        self.records = [RECORD.unpack_from(data, HEADER.size + index * RECORD.size) for index in range(records)]
+        if self.ticks is None:
+            self.ticks = sum(record[2] for record in self.records)
+
+    def __iter__(self):
+        for bits, dt, count in self.records:
+            for _ in range(count):
+                yield bits, dt
+
+class ReplayInput:
+    '''A class to control the knight, and pause the game, from an input log instead of the keyboard.'''
+    # The game calls next_tick() before every tick, which returns that tick's length and whether the game was paused.
+    def __init__(self, log):
+        self.log = log
+        self.ticks = iter(log)
+        self.keys = KeyState([])
+        self.played = 0
+
+    # Returns None once the log has run out.
+    def next_tick(self):
+        try:
+            bits, dt = next(self.ticks)
+        except StopIteration:
+            return None
+        self.played += 1
+        self.keys = bits_to_keys(bits)
+        return dt, bool(bits & PAUSED_BIT)
+
+    def get_pressed(self, game):
+        return self.keys
+
+# Replays a log from start to end and returns the game, the number of ticks and the seconds it took.
+# A fast replay steps the game headless as quickly as it can; otherwise it runs in a window at the recorded speed.
+def replay(filename, fast=True, draw=False):
+    from dungeon_game import DungeonGame
+    log = InputLog(filename)
+    game = DungeonGame(headless=fast, seed=log.seed, wizard_backend=log.backend, tick_rate=1 / log.tick_dt,
+                       replay=log)
+    game.new()
+    start = perf_counter()
+    if fast:
+        # The game stops playing when the log runs out (or the knight dies, as it did in the recording).
+        while game.playing:
+            game.step(draw=draw)
+    else:
+        game.run()
+    return game, game.replay.played, perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded input log and check that it ends the same way.')
+    parser.add_argument('log')
+    parser.add_argument('--fast', action='store_true', help='replay headless as fast as possible')
+    parser.add_argument('--draw', action='store_true', help='also draw every frame of a fast replay')
+    args = parser.parse_args()
+    game, ticks, seconds = replay(args.log, args.fast, args.draw)
+    log = game.replay.log
+    print('Replayed {} ticks in {:.2f} s ({:.2f} ms per tick).'.format(ticks, seconds, seconds / max(1, ticks) * 1000))
+    if log.digest is None:
+        print('The log has no final state to compare against.')
+    elif state_digest(game) == log.digest:
+        print('The replay ended in the same state as the recording.')
+    else:
+        print('DIVERGED: the replay ended in a different state from the recording.')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import pygame
+from settings import *
+
+class RotationCache:
+    '''A class to keep pre-rotated copies of an image, so sprites do not have to rotate their image every frame.'''
+    def __init__(self, image, steps=ROTATION_STEPS):
+        self.steps = steps
+        self.step_angle = 360 / steps
+        self.frames = []
+        self.sizes = []
+        # Renders the image once for every angle step (e.g. every degree when there are 360 steps).
+        for step in range(steps):
+            frame = pygame.transform.rotate(image, step * self.step_angle)
+            self.frames.append(frame)
+            self.sizes.append(frame.get_size())
+
+    # Finds the angle step closest to an angle (the angle can be negative or above 360).
+    def index_for(self, angle):
+        return int(round(angle / self.step_angle)) % self.steps
+
+    # Returns the cached frame closest to an angle and a new rectangle the size of that frame.
+    # The frames are shared by every sprite, so nothing should ever be drawn onto them.
+    def get(self, angle):
+        index = self.index_for(angle)
+        return self.frames[index], pygame.Rect((0, 0), self.sizes[index])
@@ -0,0 +1,316 @@
+# Snapshots of everything in a game that changes while it is played: the knight, the wizards, the health potions,
+# the stones, the crosses on the map and the game's totals.
+# A snapshot is restored in bulk into the sprites and arrays the game already has, so the walls, the wall grids and the
+# flow field (which never change) are not built again. The game takes a snapshot of its world when it is first built,
+# and every restart restores it instead of spawning everything from the map again.
+# Saving and loading a game in progress (SAVE_KEY and LOAD_KEY) write and read the same snapshots to a file.
+# On a streamed map (see streaming.py) a snapshot also holds what was left in every region that has been unloaded.
+import struct
+import numpy
+import pygame
+from settings import *
+from sprites import Wizard, Collectible
+from horde import HordeWizard
+from tilemap import Camera
+vec = pygame.math.Vector2
+
+SAVE_MAGIC = b'DGSV'
+SAVE_VERSION = 2
+# magic, version, game clock, AI scheduler ticks, totals, wizards, health potions, sprites in drawing order,
+# stone slots, free stone slots, horde wizards, crosses, unloaded regions, their sprites,
+# whether the random number generator's state follows
+HEADER = struct.Struct('<4sHdIHIIIIIIIII?')
+# position, velocity, rotation, health, last shot, centre of the hit rectangle
+KNIGHT = struct.Struct('<7d2i')
+# name and value of one of the game's totals
+STAT = struct.Struct('<16sq')
+# version, the 625 numbers of the Mersenne Twister's state, whether it has a gaussian kept back, and that gaussian
+RANDOM = struct.Struct('<i625I?d')
+COLLECTIBLE_TYPES = ['health']
+# The kinds of sprite kept in an unloaded region of a streamed map.
+PARKED_KINDS = ['wizard'] + COLLECTIBLE_TYPES
+# What each sprite of all_sprites other than the knight is, in drawing order.
+WIZARD_SPRITE = 0
+COLLECTIBLE_SPRITE = 1
+
+# A sprite's rect and hit_rect are always centred on the same point, so only the hit rectangle's centre is kept.
+WIZARD_STATE = numpy.dtype([('position', '<f8', 2), ('velocity', '<f8', 2), ('acceleration', '<f8', 2),
+                            ('hit', '<i4', 2), ('rotation', '<f8'), ('health', '<f8'), ('speed', '<f8'),
+                            ('skipped_time', '<f8'), ('ai_phase', '<i4')])
+COLLECTIBLE_STATE = numpy.dtype([('position', '<f8', 2), ('type', 'u1')])
+# One row for every slot of the stone pool, and one for every wizard of the horde, named after their arrays.
+STONE_STATE = numpy.dtype([('position', '<f8', 2), ('previous_position', '<f8', 2), ('velocity', '<f8', 2),
+                           ('spawn_time', '<f8'), ('active', '?')])
+HORDE_STATE = numpy.dtype([('position', '<f8', 2), ('velocity', '<f8', 2), ('acceleration', '<f8', 2),
+                           ('speed', '<f8'), ('rotation', '<f8'), ('health', '<f8'), ('hit_x', '<i8'),
+                           ('hit_y', '<i8'), ('previous_x', '<i8'), ('previous_y', '<i8')])
+# One row for every sprite left in an unloaded region: the region (an index into the snapshot's parked regions),
+# what it is, where it is, and its health (NaN for a health potion).
+PARKED_STATE = numpy.dtype([('region', '<u4'), ('kind', 'u1'), ('position', '<f8', 2), ('health', '<f8')])
+
+class KnightState:
+    '''A class to hold the knight's part of a snapshot.'''
+    __slots__ = ('position', 'velocity', 'rotation', 'health', 'last_shot', 'hit_center')
+
+    def __init__(self, position, velocity, rotation, health, last_shot, hit_center):
+        self.position = position
+        self.velocity = velocity
+        self.rotation = rotation
+        self.health = health
+        self.last_shot = last_shot
+        self.hit_center = hit_center
+
+    def pack(self):
+        return KNIGHT.pack(*self.position, *self.velocity, self.rotation, self.health, self.last_shot, *self.hit_center)
+
+    @classmethod
+    def unpack(cls, data, offset):
+        x, y, velocity_x, velocity_y, rotation, health, last_shot, hit_x, hit_y = KNIGHT.unpack_from(data, offset)
+        return cls((x, y), (velocity_x, velocity_y), rotation, health, last_shot, (hit_x, hit_y))
+
+class WorldState:
+    '''A class to hold a snapshot of a game, kept in arrays so it is quick to take, restore and save.'''
+    __slots__ = ('now', 'ai_ticks', 'stats', 'knight', 'wizards', 'collectibles', 'sprite_order', 'stones',
+                 'free_stones', 'horde', 'crosses', 'parked_regions', 'parked', 'random_state')
+
+class SpritePool:
+    '''A class to keep every wizard and health potion sprite a game has made, so restoring a snapshot reuses them.'''
+    # Sprites that were killed are still kept, and a snapshot with more sprites than the pool has makes the rest.
+    def __init__(self):
+        self.wizards = []
+        self.collectibles = []
+        self.kept = set()
+
+    # Adds the sprites that are not in the pool yet.
+    def keep(self, sprites):
+        for sprite in sprites:
+            if sprite not in self.kept:
+                self.kept.add(sprite)
+                if isinstance(sprite, Wizard):
+                    self.wizards.append(sprite)
+                else:
+                    self.collectibles.append(sprite)
+
+    # Returns count sprites from a pool, making new ones with make() when it runs out.
+    def take(self, pool, count, make):
+        while len(pool) < count:
+            sprite = make()
+            self.kept.add(sprite)
+            pool.append(sprite)
+        return pool[:count]
+
+# Copies the state of a game into a snapshot. The random number generator is only included when it is asked for
+# (when saving), since a restart picks new wizard speeds anyway.
+def capture_state(game, include_random=False):
+    state = WorldState()
+    state.now = game.now
+    state.ai_ticks = game.ai.ticks
+    state.stats = dict(game.stats)
+    knight = game.knight
+    state.knight = KnightState(tuple(knight.position), tuple(knight.velocity), knight.rotation, knight.health,
+                               knight.last_shot, knight.hit_rect.center)
+    wizards = game.wizards.sprites()
+    state.wizards = numpy.zeros(len(wizards), dtype=WIZARD_STATE)
+    if wizards:
+        for name in ['position', 'velocity', 'acceleration']:
+            state.wizards[name] = [tuple(getattr(wizard, name)) for wizard in wizards]
+        state.wizards['hit'] = [wizard.hit_rect.center for wizard in wizards]
+        for name in ['rotation', 'health', 'speed', 'skipped_time', 'ai_phase']:
+            state.wizards[name] = [getattr(wizard, name) for wizard in wizards]
+    collectibles = game.collectibles.sprites()
+    state.collectibles = numpy.zeros(len(collectibles), dtype=COLLECTIBLE_STATE)
+    if collectibles:
+        state.collectibles['position'] = [tuple(collectible.position) for collectible in collectibles]
+        state.collectibles['type'] = [COLLECTIBLE_TYPES.index(collectible.type) for collectible in collectibles]
+    state.sprite_order = numpy.array([WIZARD_SPRITE if isinstance(sprite, Wizard) else COLLECTIBLE_SPRITE
+                                      for sprite in game.all_sprites
+                                      if isinstance(sprite, (Wizard, Collectible))], dtype='u1')
+    game.sprite_pool.keep(wizards + collectibles)
+    stones = game.stones
+    state.stones = numpy.zeros(len(stones.active), dtype=STONE_STATE)
+    for name in STONE_STATE.names:
+        state.stones[name] = getattr(stones, name)
+    state.free_stones = numpy.array(stones.free, dtype='<u4')
+    horde = game.horde
+    state.horde = numpy.zeros(horde.count if horde is not None else 0, dtype=HORDE_STATE)
+    if horde is not None:
+        for name in HORDE_STATE.names:
+            state.horde[name] = getattr(horde, name)[:horde.count]
+    state.crosses = numpy.array(game.map_view.decal_positions, dtype='<i4').reshape(-1, 2)
+    # Regions of a streamed map which were unloaded with nothing left in them are kept too, so they stay empty.
+    parked = game.streamer.parked if game.streamer is not None else {}
+    state.parked_regions = numpy.array(list(parked), dtype='<i4').reshape(-1, 2)
+    rows = [(index, PARKED_KINDS.index(kind), (x, y), numpy.nan if health is None else health)
+            for index, sprites in enumerate(parked.values()) for kind, x, y, health in sprites]
+    state.parked = numpy.array(rows, dtype=PARKED_STATE)
+    state.random_state = game.random.getstate() if include_random else None
+    return state
+
+# Puts a game back into the state of a snapshot.
+# A restart keeps the game clock running and picks new wizard speeds in the order the wizards were spawned,
+# which uses the random number generator exactly as spawning them from the map again would.
+def restore_state(game, state, restart=False):
+    if not restart:
+        game.now = state.now
+    game.ai.ticks = state.ai_ticks
+    game.stats = dict(state.stats)
+    pool = game.sprite_pool
+    wizards = pool.take(pool.wizards, len(state.wizards), lambda: Wizard(game, 0, 0))
+    collectibles = pool.take(pool.collectibles, len(state.collectibles),
+                             lambda: Collectible(game, 0, 0, COLLECTIBLE_TYPES[0]))
+    # The random number generator is only put back once the pool has made any sprites it was short of,
+    # since every new wizard picks its speed from it.
+    if state.random_state is not None:
+        game.random.setstate(state.random_state)
+    # Empties the groups and adds the sprites back in the order they were in, so they are drawn in the same order.
+    for group in [game.all_sprites, game.knights, game.wizards, game.collectibles]:
+        group.empty()
+    sprites = {WIZARD_SPRITE: iter(wizards), COLLECTIBLE_SPRITE: iter(collectibles)}
+    for kind in state.sprite_order.tolist():
+        game.all_sprites.add(next(sprites[kind]))
+    game.wizards.add(*wizards)
+    game.collectibles.add(*collectibles)
+
+    knight = game.knight
+    knight_state = state.knight
+    knight.position = vec(knight_state.position)
+    knight.velocity = vec(knight_state.velocity)
+    knight.rotation = knight_state.rotation
+    knight.health = knight_state.health
+    knight.last_shot = knight_state.last_shot
+    knight.image, knight.rect = game.knight_rotations.get(knight.rotation)
+    knight.hit_rect.center = knight_state.hit_center
+    knight.rect.center = knight_state.hit_center
+    game.all_sprites.add(knight)
+    game.knights.add(knight)
+
+    rotations = game.wizard_rotations
+    columns = [state.wizards[name].tolist() for name in WIZARD_STATE.names]
+    for wizard, *row in zip(wizards, *columns):
+        position, velocity, acceleration, hit, rotation, health, speed, skipped_time, ai_phase = row
+        wizard.position = vec(position)
+        wizard.velocity = vec(velocity)
+        wizard.acceleration = vec(acceleration)
+        wizard.rotation = rotation
+        wizard.health = health
+        wizard.speed = game.random.choice(WIZARD_SPEED) if restart else speed
+        wizard.skipped_time = skipped_time
+        wizard.ai_phase = ai_phase
+        wizard.ai_tier = 'near'
+        wizard.ai_due = True
+        wizard.image, wizard.rect = rotations.get(rotation)
+        wizard.hit_rect.center = hit
+        wizard.rect.center = hit
+    for collectible, position, type in zip(collectibles, state.collectibles['position'].tolist(),
+                                           state.collectibles['type'].tolist()):
+        collectible.position = vec(position)
+        collectible.type = COLLECTIBLE_TYPES[type]
+        collectible.image = game.health
+        collectible.rect = collectible.image.get_rect()
+        collectible.rect.center = position
+
+    stones = game.stones
+    for name in STONE_STATE.names:
+        setattr(stones, name, state.stones[name].copy())
+    stones.free = state.free_stones.tolist()
+    stones.count = int(state.stones['active'].sum())
+    horde = game.horde
+    if horde is not None:
+        while len(horde.speed) < len(state.horde):
+            horde.grow()
+        horde.count = len(state.horde)
+        for name in HORDE_STATE.names:
+            getattr(horde, name)[:horde.count] = state.horde[name]
+        if restart:
+            for index in range(horde.count):
+                horde.speed[index] = game.random.choice(WIZARD_SPEED)
+        for view in horde.views:
+            view.index = None
+        horde.views = [HordeWizard(horde, index) for index in range(horde.count)]
+
+    # The regions of a streamed map around the knight now hold the snapshot's sprites,
+    # and the unloaded regions hold what was left in them.
+    if game.streamer is not None:
+        regions = [tuple(region) for region in state.parked_regions.tolist()]
+        parked = {region: [] for region in regions}
+        columns = [state.parked[name].tolist() for name in PARKED_STATE.names]
+        for index, kind, (x, y), health in zip(*columns):
+            parked[regions[index]].append((PARKED_KINDS[kind], x, y, None if numpy.isnan(health) else health))
+        game.streamer.restored(knight.position, parked)
+    # Puts the crosses back on a clean map.
+    game.map_view.clear_decals()
+    for position in state.crosses.tolist():
+        game.map_view.add_decal(game.cross, position)
+    # A restart starts with the camera where a new game's camera is, a loaded game with it on the knight as it was saved.
+    if restart:
+        game.camera = Camera(game.map.width, game.map.height)
+    else:
+        game.camera.update(knight)
+    game.paused = False
+    game.playing = True
+    game.drawn_rects = []
+    game.last_camera = None
+    if game.interpolate:
+        game.remember_positions()
+
+# Writes a snapshot to bytes: the header, the knight, the totals, the random number generator (if it was captured)
+# and then the arrays one after the other.
+def state_to_bytes(state):
+    has_random = state.random_state is not None
+    parts = [HEADER.pack(SAVE_MAGIC, SAVE_VERSION, state.now, state.ai_ticks, len(state.stats), len(state.wizards),
+                         len(state.collectibles), len(state.sprite_order), len(state.stones), len(state.free_stones),
+                         len(state.horde), len(state.crosses), len(state.parked_regions), len(state.parked),
+                         has_random),
+             state.knight.pack()]
+    for name, value in state.stats.items():
+        parts.append(STAT.pack(name.encode(), value))
+    if has_random:
+        version, words, gaussian = state.random_state
+        parts.append(RANDOM.pack(version, *words, gaussian is not None, gaussian or 0))
+    for array in [state.wizards, state.collectibles, state.sprite_order, state.stones, state.free_stones,
+                  state.horde, state.crosses, state.parked_regions, state.parked]:
+        parts.append(array.tobytes())
+    return b''.join(parts)
+
+def state_from_bytes(data):
+    (magic, version, now, ai_ticks, stats, wizards, collectibles, sprites, stones, free_stones, horde, crosses,
+     parked_regions, parked, has_random) = HEADER.unpack_from(data)
+    if magic != SAVE_MAGIC or version != SAVE_VERSION:
+        raise ValueError('not a saved game (or saved by another version of the game)')
+    state = WorldState()
+    state.now = now
+    state.ai_ticks = ai_ticks
+    offset = HEADER.size
+    state.knight = KnightState.unpack(data, offset)
+    offset += KNIGHT.size
+    state.stats = {}
+    for _ in range(stats):
+        name, value = STAT.unpack_from(data, offset)
+        state.stats[name.rstrip(b'\0').decode()] = value
+        offset += STAT.size
+    state.random_state = None
+    if has_random:
+        values = RANDOM.unpack_from(data, offset)
+        state.random_state = (values[0], tuple(values[1:626]), values[627] if values[626] else None)
+        offset += RANDOM.size
+    arrays = []
+    for dtype, count in [(WIZARD_STATE, wizards), (COLLECTIBLE_STATE, collectibles), (numpy.dtype('u1'), sprites),
+                         (STONE_STATE, stones), (numpy.dtype('<u4'), free_stones), (HORDE_STATE, horde),
+                         (numpy.dtype('<i4'), crosses * 2), (numpy.dtype('<i4'), parked_regions * 2),
+                         (PARKED_STATE, parked)]:
+        arrays.append(numpy.frombuffer(data, dtype=dtype, count=count, offset=offset).copy())
+        offset += dtype.itemsize * count
+    (state.wizards, state.collectibles, state.sprite_order, state.stones, state.free_stones, state.horde,
+     crosses, parked_regions, state.parked) = arrays
+    state.crosses = crosses.reshape(-1, 2)
+    state.parked_regions = parked_regions.reshape(-1, 2)
+    return state
+
+# Saves a game in progress to a file, including its random number generator, so a loaded game plays on the same way.
+def save_game(game, filename):
+    with open(filename, 'wb') as file:
+        file.write(state_to_bytes(capture_state(game, include_random=True)))
+
+def load_game(game, filename):
+    with open(filename, 'rb') as file:
+        restore_state(game, state_from_bytes(file.read()))
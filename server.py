@@ -0,0 +1,316 @@
+# Runs the game as an arena that many players share over TCP, without a window.
+# Start it with: python server.py
+# On a generated map with more wizards: python server.py --map 200 200 --wizards 500
+# Every player that connects gets a knight, sends the keys it holds down (see netcode.py),
+# and is sent snapshots of the sprites around its knight SNAPSHOT_INTERVAL ticks apart.
+# Test it with many players at once with loadtest.py.
+import socket
+import random
+import argparse
+import selectors
+from time import perf_counter
+import numpy
+import pygame
+from settings import *
+from controls import KeyState, ScriptedInput
+from sprites import Knight
+from replay import bits_to_keys
+from netcode import *
+from dungeon_game import DungeonGame
+from benchmark import make_lattice_map, spawn_sprites, percentile
+vec = pygame.math.Vector2
+
+class RemoteInput:
+    '''A class to control a knight with the keys its player last sent to the server.'''
+    def __init__(self):
+        self.keys = KeyState([])
+
+    def get_pressed(self, game):
+        return self.keys
+
+class ArenaGame(DungeonGame):
+    '''A class to run one game with a knight for every player connected to the server.'''
+    # The wizards chase the game's main knight, since the flow field leads to one knight. When the main knight's player
+    # leaves, another player's knight becomes the main knight. A knight that dies starts again where it first spawned,
+    # with full health, instead of ending the game.
+    def __init__(self, game_map=None, seed=None):
+        # Knights without a player read their keys from the game's input, which holds nothing down.
+        DungeonGame.__init__(self, headless=True, input_provider=ScriptedInput(), seed=seed, game_map=game_map)
+
+    def new(self):
+        DungeonGame.new(self)
+        self.spawn_point = vec(self.knight.position)
+        self.stats['knights_died'] = 0
+        # Ids for the sprites in snapshots (see netcode.py). Knights and wizards each count up from 0.
+        self.next_ids = dict.fromkeys(KINDS, 0)
+
+    # Gives a sprite an id for snapshots the first time it is sent.
+    def net_id(self, sprite, kind):
+        if not hasattr(sprite, 'net_id'):
+            sprite.net_id = self.next_ids[kind] % 0x10000
+            self.next_ids[kind] += 1
+        return sprite.net_id
+
+    # Gives a new player a knight: the map's knight if nobody has it yet, otherwise a new knight at the same spot.
+    def add_player(self, input_provider):
+        if self.knight.input is None:
+            knight = self.knight
+            knight.input = input_provider
+        else:
+            knight = Knight(self, self.spawn_point.x, self.spawn_point.y, input_provider)
+        self.net_id(knight, 'knight')
+        return knight
+
+    def remove_player(self, knight):
+        if knight is not self.knight:
+            knight.kill()
+            return
+        others = [other for other in self.knights if other is not knight]
+        if others:
+            self.knight = others[0]
+            knight.kill()
+        else:
+            # The last knight stays in the game, standing still until the next player takes it.
+            knight.input = None
+
+    def knight_died(self, knight):
+        knight.health = KNIGHT_HEALTH
+        knight.position = vec(self.spawn_point)
+        self.stats['knights_died'] += 1
+
+    # Returns the code (see netcode.py) and position of every sprite that is sent in snapshots, and the values each one
+    # is sent with, sorted by code.
+    def snapshot_arrays(self):
+        kinds = []
+        ids = []
+        positions = []
+        rotations = []
+        healths = []
+        for kind, sprites in (('knight', self.knights), ('wizard', self.wizards), ('collectible', self.collectibles)):
+            for sprite in sprites:
+                kinds.append(KINDS.index(kind))
+                ids.append(self.net_id(sprite, kind))
+                positions.append(sprite.position)
+                rotations.append(getattr(sprite, 'rotation', 0))
+                healths.append(getattr(sprite, 'health', 0))
+        # Stones are kept in the stone pool's arrays, so a stone's id is its slot in the pool.
+        stones = numpy.flatnonzero(self.stones.active)
+        positions = numpy.concatenate([numpy.array(positions, dtype=float).reshape(-1, 2), self.stones.position[stones]])
+        count = len(stones)
+        kinds = numpy.concatenate([numpy.array(kinds, dtype=int), numpy.full(count, KINDS.index('stone'))])
+        ids = numpy.concatenate([numpy.array(ids, dtype=int), stones])
+        values = numpy.stack([quantize_positions(positions[:, 0]), quantize_positions(positions[:, 1]),
+                              numpy.concatenate([quantize_rotations(rotations), numpy.zeros(count, dtype=int)]),
+                              numpy.concatenate([quantize_health(healths), numpy.zeros(count, dtype=int)])], axis=1)
+        codes = sprite_codes(kinds, ids)
+        order = numpy.argsort(codes)
+        return codes[order], positions[order], values[order]
+
+    # Returns the part of the map a knight's player can see, plus SNAPSHOT_MARGIN, the way the camera follows a knight.
+    def view_for(self, knight):
+        left = min(self.map.width - WIDTH, max(0, knight.rect.centerx - int(WIDTH / 2)))
+        top = min(self.map.height - HEIGHT, max(0, knight.rect.centery - int(HEIGHT / 2)))
+        return (left - SNAPSHOT_MARGIN, top - SNAPSHOT_MARGIN,
+                left + WIDTH + SNAPSHOT_MARGIN, top + HEIGHT + SNAPSHOT_MARGIN)
+
+class Player:
+    '''A class to keep track of a connected player: its socket, its knight, and the snapshots sent to it.'''
+    # Players take turns to be sent their snapshots (turn is the tick, out of every SNAPSHOT_INTERVAL, of this player's),
+    # so each tick only makes the snapshots of some of the players.
+    def __init__(self, connection, knight, input_provider, turn):
+        self.connection = connection
+        self.knight = knight
+        self.input = input_provider
+        self.reader = MessageReader()
+        # Bytes that could not be sent yet, because the socket's buffer was full.
+        self.outgoing = bytearray()
+        self.encoder = SnapshotEncoder()
+        self.turn = turn
+
+class ArenaServer:
+    '''A class to run an arena game at a fixed tick rate and keep every connected player up to date with it.'''
+    def __init__(self, game, host=SERVER_HOST, port=SERVER_PORT):
+        self.game = game
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(1024)
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.players = {}
+        self.players_joined = 0
+        self.ticks = 0
+        # How long every tick took (including making and sending the snapshots), and what was sent.
+        self.tick_times = []
+        self.bytes_sent = 0
+        self.snapshots_sent = 0
+        self.snapshots_skipped = 0
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            connection.setblocking(False)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            input_provider = RemoteInput()
+            knight = self.game.add_player(input_provider)
+            player = Player(connection, knight, input_provider, self.players_joined % SNAPSHOT_INTERVAL)
+            self.players_joined += 1
+            self.players[connection] = player
+            self.selector.register(connection, selectors.EVENT_READ, player)
+            self.send(player, pack_message(WELCOME_MESSAGE.pack(WELCOME, knight.net_id, self.game.tick_dt)))
+
+    def disconnect(self, player):
+        self.selector.unregister(player.connection)
+        player.connection.close()
+        del self.players[player.connection]
+        self.game.remove_player(player.knight)
+
+    # Reads the keys a player sent. Only the last keys sent matter, so older messages are just read past.
+    def read(self, player):
+        try:
+            data = player.connection.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.disconnect(player)
+            return
+        for message in player.reader.feed(data):
+            if message[0] == INPUT:
+                player.input.keys = bits_to_keys(INPUT_MESSAGE.unpack(message)[1])
+
+    def send(self, player, data):
+        player.outgoing += data
+        self.flush(player)
+
+    # Sends as much of what is waiting for a player as its socket will take without waiting.
+    def flush(self, player):
+        if not player.outgoing:
+            return
+        try:
+            sent = player.connection.send(player.outgoing)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.disconnect(player)
+            return
+        del player.outgoing[:sent]
+        self.bytes_sent += sent
+
+    # Sends the players whose turn it is a snapshot of the sprites they can see.
+    # A player that is still more than SERVER_SEND_BACKLOG bytes behind skips this snapshot, and the next one it gets
+    # holds everything that changed since the last one it was sent.
+    def send_snapshots(self):
+        codes, positions, values = self.game.snapshot_arrays()
+        xs = positions[:, 0]
+        ys = positions[:, 1]
+        turn = self.ticks % SNAPSHOT_INTERVAL
+        for player in [player for player in self.players.values() if player.turn == turn]:
+            self.flush(player)
+            if player.connection not in self.players:
+                continue
+            if len(player.outgoing) > SERVER_SEND_BACKLOG:
+                self.snapshots_skipped += 1
+                continue
+            left, top, right, bottom = self.game.view_for(player.knight)
+            seen = (xs >= left) & (xs < right) & (ys >= top) & (ys < bottom)
+            self.send(player, player.encoder.encode(self.ticks, codes[seen], values[seen]))
+            self.snapshots_sent += 1
+
+    def poll(self, timeout):
+        for key, events in self.selector.select(timeout):
+            if key.data is None:
+                self.accept()
+            elif key.data.connection in self.players:
+                self.read(key.data)
+
+    def tick(self):
+        start = perf_counter()
+        self.game.step(self.game.tick_dt)
+        self.ticks += 1
+        self.send_snapshots()
+        self.tick_times.append(perf_counter() - start)
+
+    # Runs the server for a number of seconds, or until it is stopped. If report is given, a line of statistics
+    # is printed that many seconds apart.
+    def run(self, seconds=None, report=None):
+        tick_dt = self.game.tick_dt
+        start = next_tick = next_report = perf_counter()
+        while seconds is None or perf_counter() - start < seconds:
+            self.poll(max(0, next_tick - perf_counter()))
+            now = perf_counter()
+            if now >= next_tick:
+                self.tick()
+                next_tick += tick_dt
+                # After a very slow tick only MAX_CATCHUP_TICKS ticks are run to catch up, like in the game's own loop.
+                next_tick = max(next_tick, now - MAX_CATCHUP_TICKS * tick_dt)
+            if report is not None and now >= next_report + report:
+                print(format_statistics(self.statistics(now - next_report, self.tick_times)), flush=True)
+                self.tick_times = []
+                self.bytes_sent = 0
+                next_report = now
+        return perf_counter() - start
+
+    # Returns the server's tick times and bandwidth over the given seconds and ticks.
+    def statistics(self, seconds, tick_times):
+        ordered = sorted(tick_times) or [0]
+        return {
+            'players': len(self.players),
+            'ticks': len(tick_times),
+            'tick_p50': percentile(ordered, .50) * 1000,
+            'tick_p95': percentile(ordered, .95) * 1000,
+            'tick_p99': percentile(ordered, .99) * 1000,
+            'tick_max': ordered[-1] * 1000,
+            'tick_budget': self.game.tick_dt * 1000,
+            'late_ticks': sum(1 for time in tick_times if time > self.game.tick_dt),
+            'sent_kbps': self.bytes_sent / max(seconds, 1e-9) / 1024,
+            'snapshots_sent': self.snapshots_sent,
+            'snapshots_skipped': self.snapshots_skipped,
+        }
+
+    def close(self):
+        for player in list(self.players.values()):
+            self.disconnect(player)
+        self.selector.close()
+        self.listener.close()
+
+def format_statistics(stats):
+    return ('{players} players, tick p50 {tick_p50:.2f} ms, p95 {tick_p95:.2f} ms, p99 {tick_p99:.2f} ms, '
+            'max {tick_max:.2f} ms (budget {tick_budget:.2f} ms, {late_ticks} late), sent {sent_kbps:.1f} KB/s, '
+            'snapshots sent {snapshots_sent}, skipped {snapshots_skipped}'.format(**stats))
+
+# Makes an arena game, with extra wizards and health potions spread over the map.
+def make_arena(map_size=None, wizards=0, collectibles=0, seed=None):
+    game = ArenaGame(make_lattice_map(*map_size) if map_size else None, seed)
+    game.new()
+    spawn_sprites(game, {'wizards': wizards, 'collectibles': collectibles, 'stones': 0}, random.Random(seed))
+    return game
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the game as an arena for many players.')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--map', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        help='play on a generated map of this many tiles instead of the Tiled dungeon map')
+    parser.add_argument('--wizards', type=int, default=0, help='extra wizards spawned at random open spots')
+    parser.add_argument('--collectibles', type=int, default=0, help='extra health potions spawned at random open spots')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--seconds', type=float, help='stop after this many seconds (default: run until stopped)')
+    parser.add_argument('--report', type=float, default=5, help='seconds between the lines of statistics printed')
+    args = parser.parse_args()
+    server = ArenaServer(make_arena(args.map, args.wizards, args.collectibles, args.seed), args.host, args.port)
+    print('Listening on {}:{}'.format(args.host, args.port), flush=True)
+    try:
+        server.run(args.seconds, args.report)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
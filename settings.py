@@ -18,17 +18,76 @@ BLACK = (0, 0, 0)
 # Screen settings
 WIDTH = 960
 HEIGHT = 640
+# Most frames drawn per second. The game is simulated at TICK_RATE however often it is drawn.
 FPS = 60
 TITLE = "Dungeon Game"
+# Redraws only the parts of the screen that changed while the camera is not moving.
+DIRTY_RECTS = False
+# Simulation ticks per second. Every tick moves the game forward by exactly SIM_DT seconds, in a window or headless.
+TICK_RATE = 60
+SIM_DT = 1 / TICK_RATE
+# Most ticks run in one frame to catch up after a slow frame. Any time left over is dropped, so the game slows down
+# for a moment instead of every frame getting slower while it tries to catch up.
+MAX_CATCHUP_TICKS = 10
+# Draws the sprites between where they were on the last two ticks, so they move smoothly when frames and ticks do not line up.
+INTERPOLATE = True
 BGCOLOR = BROWN
 
+# Profiling settings
+# Number of recent frames the profiler keeps in memory.
+PROFILE_HISTORY = 600
+# Shows the profiler's timings on screen when profiling is turned on (toggle with PROFILE_OVERLAY_KEY).
+PROFILE_OVERLAY = True
+PROFILE_OVERLAY_KEY = pygame.K_F3
+
 # Grid settings
 TILESIZE = 16
 GRIDWIDTH = WIDTH / TILESIZE
 GRIDHEIGHT = HEIGHT / TILESIZE
 
+# Asset settings
+# Number of threads that load images and sounds in the background.
+ASSET_WORKERS = 4
+# Decodes every sound in the background at startup instead of the first time it is played.
+PRELOAD_SOUNDS = True
+
+# Map cache settings
+# Extension of the compiled map file written next to each .tmx map.
+MAP_CACHE_EXTENSION = '.dgmap'
+
+# Map generator settings
+# Generated dungeons (see mapgen.py) have one room in every cell of a grid of cells this many tiles wide.
+MAPGEN_CELL_SIZE = 20
+MAPGEN_ROOM_MIN = 5
+# Corridors are wide enough for a knight and a wizard to pass each other.
+MAPGEN_CORRIDOR_WIDTH = 3
+# Chance of an extra corridor between two rooms which are already joined another way, which makes loops.
+MAPGEN_LOOP_CHANCE = .15
+# Average number of wizards in a room, and the chance of a room having a health potion.
+MAPGEN_WIZARDS_PER_ROOM = 1.5
+MAPGEN_HEALTH_CHANCE = .2
+
+# Map streaming settings
+# Extension of the binary maps made by mapgen.py, which the game streams a region at a time (see streaming.py).
+DUNGEON_EXTENSION = '.dgdn'
+# Tiles along each side of a region (the size is saved in every map, so older maps keep the size they were made with).
+STREAM_REGION_SIZE = 64
+# Regions kept loaded on every side of the knight's region. Even with the knight at the edge of its region, they have to
+# reach AI_FAR_DISTANCE pixels past it (which is checked when a streamed map is played), or wizards that should still
+# be updated would be unloaded. That also takes them past the screen and the flow field (FLOW_FIELD_RADIUS).
+# 2 regions of 64 tiles reach 2048 pixels.
+STREAM_RADIUS = 2
+
+# Map chunk settings
+# Size (in pixels) of the square chunks the map is rendered in.
+CHUNK_SIZE = 256
+# Most memory (in bytes) that rendered chunks may use before the least recently seen ones are forgotten.
+CHUNK_CACHE_BUDGET = 32 * 1024 * 1024
+
 # Wall settings
 WALL_IMAGE = 'tile_0058.png'
+# Size of the grid cells used to look up nearby walls (a few tiles, so a sprite only touches a handful of cells).
+WALL_CELL_SIZE = TILESIZE * 4
 
 # Knight Settings
 KNIGHT_HEALTH = 100
@@ -36,6 +95,13 @@ KNIGHT_SPEED = 250
 KNIGHT_ROTATION_SPEED = 200
 KNIGHT_IMAGE = 'tile_0096.png'
 KNIGHT_HIT_RECT = pygame.Rect(0, 0, 24, 24)
+# Where the knight's health bar is drawn on the screen.
+KNIGHT_HEALTH_RECT = pygame.Rect(10, 10, 100, 20)
+# The bot knight (see controls.py) throws stones once it is facing within BOT_AIM degrees of the closest wizard,
+# and walks to keep that wizard between BOT_NEAR and BOT_FAR pixels away.
+BOT_AIM = 5
+BOT_NEAR = 100
+BOT_FAR = 250
 
 # Stone Settings
 STONE_IMAGE = 'tile_0101.png'
@@ -43,6 +109,8 @@ STONE_SPEED = 400
 STONE_TIME = 2000
 STONE_RATE = 100
 STONE_DAMAGE = 10
+# Number of stone slots the stone pool starts with (it doubles in size whenever every slot is in use).
+STONE_POOL_SIZE = 64
 
 # Wizard settings
 WIZARD_IMAGE = 'tile_0111.png'
@@ -52,12 +120,82 @@ WIZARD_HEALTH = 100
 WIZARD_DAMAGE = 10
 WIZARD_MOVEBACK = 20
 AVOID_RADIUS = 50
+# 'sprites' runs one Wizard sprite per wizard, 'arrays' moves every wizard at once in NumPy arrays (see horde.py).
+WIZARD_BACKEND = 'sprites'
+# Number of wizard rows the array backend starts with (it doubles in size whenever every row is in use).
+HORDE_CAPACITY = 1024
+# Wizards follow a shared flow field around the walls instead of walking straight at the knight.
+WIZARD_PATHFINDING = True
+# How far (in tiles) around the knight the flow field reaches. Wizards further away walk straight at the knight.
+FLOW_FIELD_RADIUS = 48
 CROSS = 'tile_0064.png'
 
+# AI level of detail settings
+# Wizards far from the knight are updated less often, or not at all, since nobody can see what they are doing.
+AI_LOD = True
+# Wizards on the screen, or within AI_NEAR_DISTANCE pixels of the knight, are updated every tick.
+AI_NEAR_DISTANCE = 700
+# Wizards within AI_FAR_DISTANCE pixels are updated every AI_FAR_INTERVAL ticks, moving by all of those ticks at once.
+# Wizards further away than that sleep where they are until the knight comes back within AI_FAR_DISTANCE.
+AI_FAR_DISTANCE = 1500
+AI_FAR_INTERVAL = 4
+
+# Frame governor settings
+# Turns down the most expensive work a step at a time while frames take longer than the frame cap allows,
+# and turns it back up once there is time to spare (see governor.py). Headless games, recorded games and replays
+# always run at full quality, since every tick of them has to play out the same way each time.
+FRAME_GOVERNOR = True
+# Frames the frame times are averaged over, so one slow frame does not change the quality.
+GOVERNOR_WINDOW = 30
+# Frames to wait after the quality changed before lowering it again, and before raising it again.
+GOVERNOR_LOWER_AFTER = 30
+GOVERNOR_RAISE_AFTER = 180
+# The quality goes back up once the average frame takes less than this fraction of the frame budget.
+GOVERNOR_HEADROOM = .7
+# When turned down, far wizards are updated every GOVERNOR_FAR_INTERVAL ticks instead of every AI_FAR_INTERVAL ticks,
+# and wizards only change their image once they have turned GOVERNOR_ROTATION_STEP degrees.
+GOVERNOR_FAR_INTERVAL = 8
+GOVERNOR_ROTATION_STEP = 10
+
 # Collectibles settings
 HEALTH = 'tile_0114.png'
 HEALTH_PACK = 20
 
+# Save settings
+# Keys that save the game in progress to SAVE_FILE and load it again (see savestate.py).
+SAVE_KEY = pygame.K_F5
+LOAD_KEY = pygame.K_F9
+SAVE_FILE = 'savegame.dgsave'
+
+# Sweep settings
+# File the balancing sweep writes its results to (see sweep.py).
+SWEEP_FILE = 'sweep.csv'
+# Game seconds each sweep run lasts for, unless the knight dies first.
+SWEEP_SECONDS = 120
+
+# Soak settings
+# File the soak test writes its samples to (see soak.py).
+SOAK_FILE = 'soak.csv'
+# Game seconds between two samples, and extra wizards spawned in every game of the soak test.
+SOAK_INTERVAL = 60
+SOAK_WIZARDS = 100
+# Game seconds before the start of the run is measured, so the caches have filled up and the map has been seen.
+SOAK_WARMUP = 300
+# Number of the most grown allocations (by line of code) kept with each sample.
+SOAK_TOP_ALLOCATIONS = 5
+# How much the soak test lets memory grow (in MB) from the end of the warm up to the end of the run.
+SOAK_MAX_RSS_GROWTH = 32
+SOAK_MAX_TRACED_GROWTH = 8
+# A sprite group or cache fails the soak test if it grows past this many times its size at the start, plus the slack.
+SOAK_MAX_SIZE_GROWTH = 2
+SOAK_SIZE_SLACK = 64
+# How much slower (as a fraction) the p95 frame time may get by the end of the run.
+SOAK_MAX_SLOWDOWN = .5
+
+# Rotation settings
+# Number of pre-rotated frames kept for the knight and wizard images (360 is one frame per degree).
+ROTATION_STEPS = 360
+
 # Layer settings
 KNIGHT_LAYER = 2
 COLLECTIBLES_LAYER = 1
@@ -67,4 +205,25 @@ MUSIC = 'music.mp3'
 KNIGHT_HIT_SOUND = {'knight': 'knight.mp3'}
 WIZARD_HIT_SOUND = {'wizard': 'wizard.mp3'}
 STONE_SOUND = {'stone': 'stone.mp3'}
-HEALTH_SOUND = {'health': 'health.mp3'}
\ No newline at end of file
+HEALTH_SOUND = {'health': 'health.mp3'}
+# Plays the sound effects through the mixer. When turned off (and in every headless game) no sound is ever loaded or played.
+SOUND_EFFECTS = True
+# Mixer channels set aside for each sound, so a flood of one sound can never take the channels of the others.
+SOUND_CHANNELS = {'knight': 2, 'wizard': 3, 'stone': 2, 'health': 1}
+# Shortest time (in ms) between two plays of the same sound. Any plays in between are dropped.
+SOUND_COOLDOWN = {'knight': 150, 'wizard': 60, 'stone': 100, 'health': 0}
+# When all of a sound's channels are busy, it cuts off the oldest sound on them,
+# or a sound with a lower priority on another sound's channels.
+SOUND_PRIORITY = {'knight': 2, 'health': 2, 'wizard': 1, 'stone': 0}
+# Server settings
+# Address the arena server listens on and the load test connects to (see server.py and loadtest.py).
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 5555
+# Ticks between two snapshots sent to each player (3 is 20 snapshots a second at 60 ticks a second).
+SNAPSHOT_INTERVAL = 3
+# Extra pixels around a player's screen whose sprites are still sent, so they do not pop in at the edge of the screen.
+SNAPSHOT_MARGIN = 64
+# Positions are sent as whole numbers of 1 / SNAPSHOT_POSITION_SCALE pixels.
+SNAPSHOT_POSITION_SCALE = 4
+# Most bytes that may be waiting to go to a player. A player that falls further behind skips snapshots until it catches up.
+SERVER_SEND_BACKLOG = 64 * 1024
\ No newline at end of file
@@ -0,0 +1,248 @@
+# Runs the game headless for hours of game time to check that long sessions do not leak memory or slow down.
+# A bot plays the knight, the game restarts whenever the knight dies or every wizard is dead, and every few game seconds
+# the harness writes down the process's memory, the allocations that grew the most, the size of every sprite group
+# and cache, and the frame times since the last sample.
+# Soak for 4 hours of game time: python soak.py --hours 4
+# Write the samples somewhere else (CSV, or JSON lines if the name ends in .jsonl): python soak.py --report soak.jsonl
+# The run fails (exit status 1) if memory, any group or cache, or the frame times grew past the limits in settings.py.
+import os
+import sys
+import csv
+import json
+import random
+import argparse
+import tracemalloc
+from time import perf_counter
+from settings import *
+from controls import BotInput
+from dungeon_game import DungeonGame
+from benchmark import make_lattice_map, spawn_sprites, percentile
+
+# Allocations made by these files are the harness's own, not the game's.
+IGNORED_ALLOCATIONS = [tracemalloc.__file__, __file__, csv.__file__, json.__file__, '<frozen importlib._bootstrap>']
+
+# Returns the resident memory of this process in megabytes (its peak, where the current size cannot be read).
+def resident_memory():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes everywhere else.
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+# Returns how many things the game is holding on to: its sprite groups, stones, crosses and caches.
+# None of these should keep growing over a long session.
+def game_sizes(game):
+    return {
+        'sprites': len(game.all_sprites),
+        'wizards': len(game.wizards) + (len(game.horde) if game.horde is not None else 0),
+        'collectibles': len(game.collectibles),
+        'stones': len(game.stones),
+        'stone_slots': len(game.stones.active),
+        'wizard_grid': len(game.wizard_grid.sprite_cells),
+        'pooled_sprites': len(game.sprite_pool.kept),
+        'decals': len(game.map_view.decal_positions),
+        'map_chunks': len(game.map_view.chunks),
+        'map_chunk_kb': game.map_view.memory // 1024,
+        'hud_surfaces': len(game.hud.text.surfaces) + len(game.hud.wizard_bars),
+    }
+
+class SoakReport:
+    '''A class to write the soak samples to a file as they are taken (CSV, or JSON lines if the name ends in .jsonl).'''
+    # Samples are written straight away, so a run that is stopped early still leaves every sample taken so far.
+    def __init__(self, filename):
+        self.file = open(filename, 'w', newline='') if filename else None
+        self.jsonl = bool(filename) and filename.endswith('.jsonl')
+        self.writer = None
+
+    def write(self, sample):
+        if self.file is None:
+            return
+        if self.jsonl:
+            self.file.write(json.dumps(sample) + '\n')
+        else:
+            # CSV rows are flat, so the sizes get their own columns and the top allocations are joined into one.
+            row = {name: value for name, value in sample.items() if name not in ['sizes', 'allocations']}
+            row.update(sample['sizes'])
+            row['allocations'] = '; '.join('{where} {growth_kb:+.1f} KB'.format(**allocation)
+                                           for allocation in sample['allocations'])
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.file, list(row))
+                self.writer.writeheader()
+            self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class Soak:
+    '''A class to run one long headless session and sample it every interval seconds of game time.'''
+    def __init__(self, seed=0, wizards=SOAK_WIZARDS, game_map=None, wizard_backend=WIZARD_BACKEND, draw=True,
+                 trace=True, top=SOAK_TOP_ALLOCATIONS):
+        self.seed = seed
+        self.wizards = wizards
+        self.draw = draw
+        self.trace = trace
+        self.top = top
+        self.rng = random.Random(seed)
+        self.game = DungeonGame(headless=True, input_provider=BotInput(), seed=seed, game_map=game_map,
+                                wizard_backend=wizard_backend)
+        self.restarts = 0
+        self.frames = 0
+        self.samples = []
+        # The tracemalloc snapshot the top allocations are compared against (the first one taken after the warm up).
+        self.baseline_snapshot = None
+
+    # Starts a new game with the extra wizards spawned in new places, as the game does after every game over.
+    def new_game(self):
+        self.game.new()
+        spawn_sprites(self.game, {'wizards': self.wizards, 'collectibles': 0, 'stones': 0}, self.rng)
+
+    # Runs for a number of seconds of game time, taking a sample every interval and calling report() with each one.
+    def run(self, seconds, interval=SOAK_INTERVAL, report=None):
+        if self.trace:
+            tracemalloc.start()
+        start = perf_counter()
+        self.new_game()
+        frame_times = []
+        next_sample = interval
+        try:
+            while self.frames * SIM_DT < seconds:
+                frame_start = perf_counter()
+                self.game.step(SIM_DT, draw=self.draw)
+                frame_times.append(perf_counter() - frame_start)
+                self.frames += 1
+                game = self.game
+                if not game.playing or not (len(game.wizards) or (game.horde is not None and len(game.horde))):
+                    self.restarts += 1
+                    self.new_game()
+                if self.frames * SIM_DT >= next_sample:
+                    sample = self.sample(perf_counter() - start, frame_times)
+                    frame_times = []
+                    next_sample += interval
+                    if report is not None:
+                        report(sample)
+        finally:
+            if self.trace:
+                tracemalloc.stop()
+            self.game.assets.shutdown()
+        return self.samples
+
+    # Writes down everything the soak test checks at this moment, and the frame times since the last sample.
+    def sample(self, elapsed, frame_times):
+        ordered = sorted(frame_times)
+        sample = {
+            'game_seconds': round(self.frames * SIM_DT, 3),
+            'wall_seconds': round(elapsed, 3),
+            'frames': self.frames,
+            'restarts': self.restarts,
+            'rss_mb': round(resident_memory(), 2),
+            'traced_mb': 0,
+            'traced_peak_mb': 0,
+            'p50': round(percentile(ordered, .50) * 1000, 3),
+            'p95': round(percentile(ordered, .95) * 1000, 3),
+            'p99': round(percentile(ordered, .99) * 1000, 3),
+            'max_ms': round(ordered[-1] * 1000, 3),
+            'sizes': game_sizes(self.game),
+            'allocations': [],
+        }
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            sample['traced_mb'] = round(current / 2 ** 20, 3)
+            sample['traced_peak_mb'] = round(peak / 2 ** 20, 3)
+            tracemalloc.reset_peak()
+            sample['allocations'] = self.top_allocations(sample['game_seconds'])
+        self.samples.append(sample)
+        return sample
+
+    # Lists the lines of code whose allocations grew the most since the warm up ended.
+    def top_allocations(self, game_seconds):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in IGNORED_ALLOCATIONS])
+        if self.baseline_snapshot is None or game_seconds <= SOAK_WARMUP:
+            self.baseline_snapshot = snapshot
+        allocations = []
+        for stat in snapshot.compare_to(self.baseline_snapshot, 'lineno')[:self.top]:
+            frame = stat.traceback[0]
+            allocations.append({'where': '{}:{}'.format(os.path.basename(frame.filename), frame.lineno),
+                                'size_kb': round(stat.size / 1024, 1), 'growth_kb': round(stat.size_diff / 1024, 1),
+                                'count': stat.count})
+        return allocations
+
+# Compares the start of the run (after the warm up) with its end, and lists what grew past the limits.
+# Group and cache sizes go up and down with every game, so the largest size in the last quarter of the samples
+# is compared with the largest in the first quarter. Frame times use the median p95 of each quarter.
+def find_growth(samples):
+    measured = [sample for sample in samples if sample['game_seconds'] > SOAK_WARMUP]
+    if len(measured) < 2:
+        return []
+    quarter = max(1, len(measured) // 4)
+    first = measured[:quarter]
+    last = measured[-quarter:]
+    problems = []
+    rss_growth = last[-1]['rss_mb'] - first[0]['rss_mb']
+    if rss_growth > SOAK_MAX_RSS_GROWTH:
+        problems.append('resident memory grew {:.1f} MB (limit {} MB)'.format(rss_growth, SOAK_MAX_RSS_GROWTH))
+    traced_growth = last[-1]['traced_mb'] - first[0]['traced_mb']
+    if traced_growth > SOAK_MAX_TRACED_GROWTH:
+        problems.append('traced allocations grew {:.1f} MB (limit {} MB)'.format(traced_growth, SOAK_MAX_TRACED_GROWTH))
+    for name in first[0]['sizes']:
+        before = max(sample['sizes'][name] for sample in first)
+        after = max(sample['sizes'][name] for sample in last)
+        if after > before * SOAK_MAX_SIZE_GROWTH + SOAK_SIZE_SLACK:
+            problems.append('{} grew from {} to {}'.format(name, before, after))
+    before = percentile(sorted(sample['p95'] for sample in first), .5)
+    after = percentile(sorted(sample['p95'] for sample in last), .5)
+    if after > before * (1 + SOAK_MAX_SLOWDOWN):
+        problems.append('p95 frame time went from {:.2f} ms to {:.2f} ms'.format(before, after))
+    return problems
+
+def print_sample(sample):
+    print('{game_seconds:>8.0f} s  {restarts:>4} restarts  RSS {rss_mb:7.1f} MB  traced {traced_mb:6.2f} MB  '
+          'p50 {p50:6.2f} ms  p95 {p95:6.2f} ms  p99 {p99:6.2f} ms  {sprites} sprites, {stones} stones, '
+          '{decals} crosses'.format(**sample, **sample['sizes']), flush=True)
+    if sample['allocations']:
+        top = sample['allocations'][0]
+        print('{:>10} most grown: {where} {growth_kb:+.1f} KB ({size_kb:.1f} KB in {count} blocks)'.format('', **top))
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test the game headless for hours of game time.')
+    parser.add_argument('--hours', type=float, default=1, help='hours of game time to run for')
+    parser.add_argument('--seconds', type=float, help='seconds of game time to run for, instead of --hours')
+    parser.add_argument('--interval', type=float, default=SOAK_INTERVAL, help='game seconds between two samples')
+    parser.add_argument('--report', default=SOAK_FILE, help='file to write the samples to (CSV or .jsonl)')
+    parser.add_argument('--map', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        help='map size in tiles (default: the Tiled dungeon map)')
+    parser.add_argument('--backend', default=WIZARD_BACKEND, choices=['sprites', 'arrays'])
+    parser.add_argument('--wizards', type=int, default=SOAK_WIZARDS, help='extra wizards spawned in every game')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-draw', action='store_true', help='only simulate, without drawing the frames')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='do not track allocations (tracemalloc makes every frame several times slower)')
+    args = parser.parse_args()
+
+    seconds = args.seconds if args.seconds is not None else args.hours * 3600
+    game_map = make_lattice_map(*args.map) if args.map is not None else None
+    soak = Soak(args.seed, args.wizards, game_map, args.backend, draw=not args.no_draw, trace=not args.no_tracemalloc)
+    report = SoakReport(args.report)
+
+    def take(sample):
+        report.write(sample)
+        print_sample(sample)
+    try:
+        samples = soak.run(seconds, args.interval, take)
+    finally:
+        report.close()
+    problems = find_growth(samples)
+    for problem in problems:
+        print('GROWTH ' + problem)
+    if problems:
+        sys.exit(1)
+    print('No growth past the limits in {:.0f} s of game time ({} games).'.format(seconds, soak.restarts + 1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+import numpy
+import pygame
+from settings import *
+
+# Splits the solid tiles of a mask into a small set of rectangles (in tiles) that cover them exactly.
+# Each rectangle starts from the next run of solid tiles along a row and grows down for as long as the whole run is solid.
+def merge_tiles(solid):
+    remaining = solid.copy()
+    rects = []
+    columns, rows = solid.shape
+    for y in range(rows):
+        while True:
+            row = remaining[:, y]
+            starts = numpy.flatnonzero(row)
+            if not len(starts):
+                break
+            left = starts[0]
+            right = left + 1
+            while right < columns and row[right]:
+                right += 1
+            bottom = y + 1
+            while bottom < rows and remaining[left:right, bottom].all():
+                bottom += 1
+            remaining[left:right, y:bottom] = False
+            rects.append((left, y, right - left, bottom - y))
+    return rects
+
+# Merges rectangles that line up into single rectangles covering exactly the same area.
+# Rectangles with the same top and bottom that touch or overlap are joined side to side,
+# then ones with the same left and right are joined top to bottom, until nothing more can be joined.
+def merge_rects(rects):
+    rects = [tuple(rect) for rect in rects]
+    while True:
+        count = len(rects)
+        for axis in (0, 1):
+            # Rectangles are grouped by their extent across the axis, and joined along it.
+            bands = {}
+            for rect in rects:
+                position, size = rect[axis], rect[axis + 2]
+                across, across_size = rect[1 - axis], rect[3 - axis]
+                bands.setdefault((across, across_size), []).append((position, position + size))
+            rects = []
+            for (across, across_size), spans in bands.items():
+                spans.sort()
+                start, end = spans[0]
+                for span_start, span_end in spans[1:] + [(None, None)]:
+                    if span_start is not None and span_start <= end:
+                        end = max(end, span_end)
+                        continue
+                    if axis == 0:
+                        rects.append((start, across, end - start, across_size))
+                    else:
+                        rects.append((across, start, across_size, end - start))
+                    start, end = span_start, span_end
+        if len(rects) == count:
+            return [pygame.Rect(rect) for rect in rects]
+
+class WallMask:
+    '''A class to store which tiles of the map have a wall on them, for quick solidity tests.'''
+    # A tile counts as solid if a wall covers any part of it. A summed-area table of the mask
+    # (the number of solid tiles above and to the left of every corner) lets any box be tested with four lookups.
+    # Anything off the map counts as solid, so a box that is found clear here can never be touching a wall.
+    # The mask can cover just part of the map, starting at the origin tile (e.g. the regions loaded around the knight
+    # on a streamed map, see streaming.py), and everything outside that part counts as solid too.
+    def __init__(self, walls, width, height, origin=(0, 0)):
+        self.origin = origin
+        self.columns = -(-int(width) // TILESIZE)
+        self.rows = -(-int(height) // TILESIZE)
+        self.solid = numpy.zeros((self.columns, self.rows), dtype=bool)
+        # Whether every wall lines up with the tiles, in which case the mask covers exactly the same area as the walls.
+        self.exact = True
+        for wall in walls:
+            rect = wall.rect
+            if rect.x % TILESIZE or rect.y % TILESIZE or rect.width % TILESIZE or rect.height % TILESIZE:
+                self.exact = False
+            left = max(0, rect.left // TILESIZE - origin[0])
+            right = min(self.columns, (rect.right - 1) // TILESIZE + 1 - origin[0])
+            top = max(0, rect.top // TILESIZE - origin[1])
+            bottom = min(self.rows, (rect.bottom - 1) // TILESIZE + 1 - origin[1])
+            if left < right and top < bottom:
+                self.solid[left:right, top:bottom] = True
+        self.build_table()
+
+    # Makes a mask straight from an array of solid tiles (columns by rows) which starts at the origin tile.
+    @classmethod
+    def from_tiles(cls, solid, origin=(0, 0)):
+        mask = cls.__new__(cls)
+        mask.origin = origin
+        mask.columns, mask.rows = solid.shape
+        mask.solid = solid
+        mask.exact = True
+        mask.build_table()
+        return mask
+
+    def build_table(self):
+        self.table = numpy.zeros((self.columns + 1, self.rows + 1), dtype=numpy.int32)
+        self.table[1:, 1:] = self.solid.cumsum(axis=0).cumsum(axis=1)
+
+    # Checks whether a point is on a solid tile.
+    def point_solid(self, x, y):
+        column = int(x // TILESIZE) - self.origin[0]
+        row = int(y // TILESIZE) - self.origin[1]
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            return True
+        return bool(self.solid[column, row])
+
+    # Checks whether a rectangle covers any solid tile.
+    def box_solid(self, rect):
+        origin_x, origin_y = self.origin
+        left = rect.left // TILESIZE - origin_x
+        top = rect.top // TILESIZE - origin_y
+        right = (max(rect.right, rect.left + 1) - 1) // TILESIZE + 1 - origin_x
+        bottom = (max(rect.bottom, rect.top + 1) - 1) // TILESIZE + 1 - origin_y
+        if left < 0 or top < 0 or right > self.columns or bottom > self.rows:
+            return True
+        table = self.table
+        return table[right, bottom] - table[left, bottom] - table[right, top] + table[left, top] > 0
+
+    # Does the same as box_solid for arrays of left, top, right and bottom edges in pixels.
+    def boxes_solid(self, lefts, tops, rights, bottoms):
+        # The last pixel column and row each box covers (a box with no width or height still covers one).
+        last_x = numpy.maximum(rights, lefts + 1) - 1
+        last_y = numpy.maximum(bottoms, tops + 1) - 1
+        origin_x, origin_y = self.origin
+        lefts = numpy.floor_divide(lefts, TILESIZE).astype(int) - origin_x
+        tops = numpy.floor_divide(tops, TILESIZE).astype(int) - origin_y
+        rights = numpy.floor_divide(last_x, TILESIZE).astype(int) + 1 - origin_x
+        bottoms = numpy.floor_divide(last_y, TILESIZE).astype(int) + 1 - origin_y
+        outside = (lefts < 0) | (tops < 0) | (rights > self.columns) | (bottoms > self.rows)
+        lefts = numpy.clip(lefts, 0, self.columns)
+        tops = numpy.clip(tops, 0, self.rows)
+        rights = numpy.clip(rights, 0, self.columns)
+        bottoms = numpy.clip(bottoms, 0, self.rows)
+        table = self.table
+        counts = table[rights, bottoms] - table[lefts, bottoms] - table[rights, tops] + table[lefts, tops]
+        return outside | (counts > 0)
+
+    # Returns as few rectangles as it can find which cover the same area as the walls.
+    # The walls are merged with each other, and when they line up with the tiles the solid tiles are split into
+    # rectangles too, and whichever gives fewer rectangles is used.
+    def merged_rects(self, walls):
+        merged = merge_rects(wall.rect for wall in walls)
+        if self.exact:
+            origin_x, origin_y = self.origin
+            tiles = [pygame.Rect((origin_x + x) * TILESIZE, (origin_y + y) * TILESIZE,
+                                 width * TILESIZE, height * TILESIZE)
+                     for x, y, width, height in merge_tiles(self.solid)]
+            if len(tiles) < len(merged):
+                merged = tiles
+        return merged
+
+class WallGrid:
+    '''A class to look up walls by the grid cells that they cover.'''
+    # The walls never move, so the grid is built once when the game starts and only read afterwards
+    # (except on a streamed map, where the walls of each region are added and removed as it is loaded and unloaded).
+    # With a wall mask, rectangles that are not on any solid tile are answered from the mask without looking at any walls.
+    def __init__(self, walls, cell_size=WALL_CELL_SIZE, mask=None):
+        self.cell_size = cell_size
+        self.mask = mask
+        # Every wall is kept under a number, and hits come back in the order of those numbers.
+        # The walls given here are numbered in the order they come in, so hits come back in the same order as the walls group.
+        self.walls = {}
+        self.cells = {}
+        # The cells each wall is in, so a wall can be taken out of them again.
+        self.wall_cells = {}
+        walls = list(walls)
+        self.add(walls, range(len(walls)))
+
+    # Adds walls to the grid under the numbers given for them, which decide where they come in the order of the hits.
+    def add(self, walls, keys):
+        cells = self.cells
+        for key, wall in zip(keys, walls):
+            self.walls[key] = wall
+            self.wall_cells[key] = wall_cells = self.cells_for(wall.rect)
+            for cell in wall_cells:
+                cells.setdefault(cell, []).append(key)
+
+    # Removes the walls under the numbers from the grid.
+    def remove(self, keys):
+        cells = self.cells
+        for key in keys:
+            del self.walls[key]
+            for cell in self.wall_cells.pop(key):
+                cell_keys = cells[cell]
+                cell_keys.remove(key)
+                if not cell_keys:
+                    del cells[cell]
+
+    # A function which lists every grid cell that a rectangle touches.
+    def cells_for(self, rect):
+        size = self.cell_size
+        left = rect.left // size
+        right = max(rect.right - 1, rect.left) // size
+        top = rect.top // size
+        bottom = max(rect.bottom - 1, rect.top) // size
+        return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+    # Returns every wall that overlaps the rectangle, in the order of their numbers.
+    def collide(self, rect):
+        if self.mask is not None and not self.mask.box_solid(rect):
+            return []
+        cells = self.cells
+        nearby = set()
+        for cell in self.cells_for(rect):
+            if cell in cells:
+                nearby.update(cells[cell])
+        walls = self.walls
+        return [walls[index] for index in sorted(nearby) if rect.colliderect(walls[index].rect)]
+
+    # Returns the first wall found that overlaps the rectangle, or None if there isn't one.
+    def collideany(self, rect):
+        if self.mask is not None and not self.mask.box_solid(rect):
+            return None
+        cells = self.cells
+        walls = self.walls
+        for cell in self.cells_for(rect):
+            for index in cells.get(cell, ()):
+                if rect.colliderect(walls[index].rect):
+                    return walls[index]
+        return None
+
+    # Returns the wall with the lowest number out of those that overlap the rectangle (the same wall as collide()[0]),
+    # or None if there isn't one.
+    def first(self, rect):
+        if self.mask is not None and not self.mask.box_solid(rect):
+            return None
+        cells = self.cells
+        walls = self.walls
+        first = None
+        for cell in self.cells_for(rect):
+            for index in cells.get(cell, ()):
+                if (first is None or index < first) and rect.colliderect(walls[index].rect):
+                    first = index
+        return walls[first] if first is not None else None
+
+class SpatialHash:
+    '''A class to find the sprites near a position, using a grid that is refreshed as the sprites move.'''
+    def __init__(self, cell_size=AVOID_RADIUS):
+        self.cell_size = cell_size
+        self.cells = {}
+        # Remembers which cell each sprite was last placed in.
+        self.sprite_cells = {}
+
+    def cell_for(self, position):
+        return (int(position.x // self.cell_size), int(position.y // self.cell_size))
+
+    # Clears the grid and places every sprite in it again (done once at the start of every frame).
+    def rebuild(self, sprites):
+        self.cells = {}
+        self.sprite_cells = {}
+        for sprite in sprites:
+            self.insert(sprite)
+
+    def insert(self, sprite):
+        cell = self.cell_for(sprite.position)
+        self.sprite_cells[sprite] = cell
+        self.cells.setdefault(cell, {})[sprite] = None
+
+    def remove(self, sprite):
+        cell = self.sprite_cells.pop(sprite, None)
+        if cell is not None:
+            del self.cells[cell][sprite]
+
+    # Moves a sprite to a new cell if it has crossed a cell border since it was placed.
+    def move(self, sprite):
+        cell = self.cell_for(sprite.position)
+        old_cell = self.sprite_cells.get(sprite)
+        if cell != old_cell:
+            if old_cell is not None:
+                del self.cells[old_cell][sprite]
+            self.sprite_cells[sprite] = cell
+            self.cells.setdefault(cell, {})[sprite] = None
+
+    # Returns every sprite in the cells that a circle around the position touches.
+    # Sprites outside of the radius can still be returned, so callers check the exact distance themselves.
+    def query(self, position, radius):
+        size = self.cell_size
+        left = int((position.x - radius) // size)
+        right = int((position.x + radius) // size)
+        top = int((position.y - radius) // size)
+        bottom = int((position.y + radius) // size)
+        cells = self.cells
+        nearby = []
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = cells.get((x, y))
+                if cell:
+                    nearby.extend(cell)
+        return nearby
@@ -1,48 +1,52 @@
 import pygame
-from random import choice
 from settings import *
-from tilemap import collide_hit_rect
 vec = pygame.math.Vector2
 
 # A function to determine if a knight or wizard hits a wall.
-def collide_with_walls(sprite, group, direction):
+# Sprites which are not on a tile with a wall are ruled out by the wall mask, and for the rest
+# only the walls in the grid cells around the sprite are checked.
+# The sprite is pushed out of the first wall it overlaps (in the order of their numbers in the wall grid).
+def collide_with_walls(sprite, wall_grid, direction):
+    sprite.game.profiler.count('wall_checks')
     if direction == 'x':
-        hits = pygame.sprite.spritecollide(sprite, group, False, collide_hit_rect)
-        if hits:
+        hit = wall_grid.first(sprite.hit_rect)
+        if hit:
             # Places the sprite at the left edge of whatever it hit.
-            if hits[0].rect.centerx > sprite.hit_rect.centerx:
-                sprite.position.x = hits[0].rect.left - sprite.hit_rect.width / 2
+            if hit.rect.centerx > sprite.hit_rect.centerx:
+                sprite.position.x = hit.rect.left - sprite.hit_rect.width / 2
             # Places the sprite at the right edge of whatever it hit.
-            if hits[0].rect.centerx < sprite.hit_rect.centerx:
-                sprite.position.x = hits[0].rect.right + sprite.hit_rect.width / 2
+            if hit.rect.centerx < sprite.hit_rect.centerx:
+                sprite.position.x = hit.rect.right + sprite.hit_rect.width / 2
             # Stops the x-velocity from increasing while the sprite is hitting a wall.
             sprite.velocity.x = 0
             sprite.hit_rect.centerx = sprite.position.x
     if direction == 'y':
-        hits = pygame.sprite.spritecollide(sprite, group, False, collide_hit_rect)
-        if hits:
+        hit = wall_grid.first(sprite.hit_rect)
+        if hit:
             # Places the sprite at the top edge of whatever it hit.
-            if hits[0].rect.centery > sprite.hit_rect.centery:
-                sprite.position.y = hits[0].rect.top - sprite.hit_rect.height / 2
+            if hit.rect.centery > sprite.hit_rect.centery:
+                sprite.position.y = hit.rect.top - sprite.hit_rect.height / 2
             # Places the sprite at the bottom edge of whatever it hit.
-            if hits[0].rect.centery < sprite.hit_rect.centery:
-                sprite.position.y = hits[0].rect.bottom + sprite.hit_rect.height / 2
+            if hit.rect.centery < sprite.hit_rect.centery:
+                sprite.position.y = hit.rect.bottom + sprite.hit_rect.height / 2
             # Stops the y-velocity from increasing while the sprite is hitting a wall.
             sprite.velocity.y = 0
             sprite.hit_rect.centery = sprite.position.y
 
 class Knight(pygame.sprite.Sprite):
     '''A class to manage the knight'''
-    def __init__(self, game, x, y):
+    # A knight with its own input provider (e.g. a player connected to the server) reads its keys from it,
+    # otherwise it reads them from the game's input.
+    def __init__(self, game, x, y, input_provider=None):
         # Sets the layer of the knight so that it goes above other layers (specifically for the health potion collectible).
         self._layer = KNIGHT_LAYER
-        self.groups = game.all_sprites
+        self.groups = game.all_sprites, game.knights
         pygame.sprite.Sprite.__init__(self, self.groups)
         self.game = game
         self.image = game.knight_image
         self.rect = self.image.get_rect()
         self.rect.center = (x, y)
-        self.hit_rect = KNIGHT_HIT_RECT
+        self.hit_rect = KNIGHT_HIT_RECT.copy()
         self.hit_rect.center = self.rect.center
         # 2-dimensional velocity of the knight.
         self.velocity = vec(0, 0)
@@ -52,6 +56,7 @@ class Knight(pygame.sprite.Sprite):
         self.rotation = 0
         self.last_shot = 0
         self.health = KNIGHT_HEALTH
+        self.input = input_provider
 
 # A function to determine how the knight should respond if certain keys are pressed.
     def get_keys(self):
@@ -59,7 +64,9 @@ class Knight(pygame.sprite.Sprite):
         self.rotation_speed = 0
         # Knight is not moving if keys are not pressed down.
         self.velocity = vec(0, 0)
-        keys = pygame.key.get_pressed()
+        # Reads the keys from the knight's own input, or else the game's input (the keyboard, or a script when headless).
+        input_provider = self.input if self.input is not None else self.game.input
+        keys = input_provider.get_pressed(self.game)
         # Rotates the knight left at a set speed if left arrow key is pressed.
         if keys[pygame.K_LEFT]:
             self.rotation_speed = KNIGHT_ROTATION_SPEED
@@ -74,29 +81,29 @@ class Knight(pygame.sprite.Sprite):
             self.velocity = vec(-KNIGHT_SPEED / 2, 0).rotate(-self.rotation)
         # The knight throws a stone if the space bar is pressed.
         if keys[pygame.K_SPACE]:
-            now = pygame.time.get_ticks()
+            now = self.game.now
             # Allows for a stone to be thrown every .1 s (STONE_RATE)
             if now - self.last_shot > STONE_RATE:
                 self.last_shot = now
                 direction = vec(1, 0).rotate(-self.rotation)
-                Stone(self.game, self.position, direction)
+                self.game.stones.spawn(self.position, direction)
                 # Plays a specific sound effect each time the space bar is pressed.
-                self.game.stone_sound['stone'].play()
+                self.game.audio.play('stone')
 
     def update(self):
         self.get_keys()
         # Updates the rotation with the knight's current rotation (% 360 to keep the angle between 1 and 360).
         self.rotation = (self.rotation + self.rotation_speed * self.game.time % 360)
-        # Rotates the knight image to match the rotation input by the arrow keys.
-        self.image = pygame.transform.rotate(self.game.knight_image, self.rotation)
-        self.rect = self.image.get_rect()
+        # Picks the pre-rotated knight image that matches the rotation input by the arrow keys.
+        self.image, self.rect = self.game.knight_rotations.get(self.rotation)
+        self.game.profiler.count('rotations')
         self.rect.center = self.position
         # Determines the knight's position by measuring how long it has travelled in a distance at a set speed.
         self.position += self.velocity * self.game.time
         self.hit_rect.centerx = self.position.x
-        collide_with_walls(self, self.game.walls, 'x')
+        collide_with_walls(self, self.game.wall_grid, 'x')
         self.hit_rect.centery = self.position.y
-        collide_with_walls(self, self.game.walls, 'y')
+        collide_with_walls(self, self.game.wall_grid, 'y')
         self.rect.center = self.hit_rect.center
 
     def add_health(self, amount):
@@ -128,99 +135,87 @@ class Wizard(pygame.sprite.Sprite):
         # Sets the health of the wizard to 100
         self.health = WIZARD_HEALTH
         # Sets different speeds for different wizards.
-        self.speed = choice(WIZARD_SPEED)
+        # Uses the game's random number generator so that seeded games always pick the same speeds.
+        self.speed = game.random.choice(WIZARD_SPEED)
+        # The wizard's AI tier, and whether it is due to update this tick, are set by the game's AI scheduler (see lod.py).
+        self.ai_tier = 'near'
+        self.ai_due = True
+        # Far wizards take turns to update, so each one gets a different turn.
+        self.ai_phase = len(game.wizards)
+        # Time from the ticks the wizard has skipped, which it moves by on its next update.
+        self.skipped_time = 0
 
     # A function that stops the wizards from clumping together into one image.
     # They always began to overlap with each other once they had been chasing the knight for 15 or 20 seconds.
+    # Only the wizards in the grid cells around this wizard are checked.
     def avoid_wizards(self):
-        for wizard in self.game.wizards:
+        for wizard in self.game.wizard_grid.query(self.position, AVOID_RADIUS):
             if wizard != self:
                 dist = self.position - wizard.position
                 if 0 < dist.length() < AVOID_RADIUS:
                     self.acceleration += dist.normalize()
 
     def update(self):
-        # Points the wizard in the direction of the knight.
-        self.rotation = (self.game.knight.position - self.position).angle_to(vec(1, 0))
-        # Rotates a wizard the image by rotation
-        self.image = pygame.transform.rotate(self.game.wizard_image, self.rotation)
-        self.rect = self.image.get_rect()
+        # Far wizards only update every few ticks, and sleeping wizards not at all.
+        if self.ai_tier == 'asleep':
+            self.skipped_time = 0
+        else:
+            self.skipped_time += self.game.time
+        if self.ai_due:
+            self.move(self.skipped_time)
+            self.skipped_time = 0
+        # Checks to see if a wizard's health is 0.
+        if self.health <= 0:
+            # Deletes a wizard.
+            self.kill()
+            self.game.wizard_grid.remove(self)
+            # Draws a cross where the wizard died (on the map's decal layer, which is cleared when the game restarts).
+            self.game.map_view.add_decal(self.game.cross, self.position - vec(12, 12))
+
+    # Moves the wizard towards the knight by dt seconds.
+    def move(self, dt):
+        # Points the wizard along the shared flow field towards the knight, which leads it around walls.
+        if WIZARD_PATHFINDING:
+            target = self.game.flow_field.target_for(self.position, self.game.knight.position)
+        else:
+            target = self.game.knight.position
+        heading = (target - self.position).angle_to(vec(1, 0))
+        # Picks the pre-rotated wizard image that matches the rotation.
+        # While the frame governor has turned rotation down (see governor.py), the wizard keeps its image
+        # until it has turned by a whole rotation step.
+        governor = self.game.governor
+        if not governor.rotation_step or abs((heading - self.rotation + 180) % 360 - 180) >= governor.rotation_step:
+            self.rotation = heading
+            self.image, self.rect = self.game.wizard_rotations.get(self.rotation)
+            self.game.profiler.count('rotations')
         self.rect.center = self.position
-        self.acceleration = vec(1, 0).rotate(-self.rotation)
-        self.avoid_wizards()
+        self.acceleration = vec(1, 0).rotate(-heading)
+        # While the frame governor has turned separation down, each wizard only avoids the others every few ticks,
+        # taking turns so that about the same number of wizards do it every tick.
+        if (self.game.ai.ticks + self.ai_phase) % governor.separation_interval == 0:
+            self.avoid_wizards()
         # Does not change direction of the vector, only alters magnitude.
-        self.acceleration.scale_to_length(self.speed)
+        # A wizard pushed straight back by the wizard in front of it has no acceleration left to scale.
+        if self.acceleration.length_squared() > 0:
+            self.acceleration.scale_to_length(self.speed)
         self.acceleration += self.velocity * -1
-        self.velocity += self.acceleration * self.game.time
-        self.position += self.velocity * self.game.time + .5 * self.acceleration * self.game.time ** 2
+        self.velocity += self.acceleration * dt
+        self.position += self.velocity * dt + .5 * self.acceleration * dt ** 2
         self.hit_rect.centerx = self.position.x
-        collide_with_walls(self, self.game.walls, 'x')
+        collide_with_walls(self, self.game.wall_grid, 'x')
         self.hit_rect.centery = self.position.y
-        collide_with_walls(self, self.game.walls, 'y')
+        collide_with_walls(self, self.game.wall_grid, 'y')
         self.rect.center = self.hit_rect.center
-        # Checks to see if a wizard's health is 0.
-        if self.health <= 0:
-            # Deletes a wizard.
-            self.kill()
-            # Draws a cross where the wizard died.
-            self.game.map_image.blit(self.game.cross, self.position - vec(12, 12))
-
-    def draw_health(self):
-    # Checks to see the amount of health the wizard has remaining,
-    # and sets the health bar of the wizard to a corresponding color.
-        if self.health > 90:
-            color = HEALTH_100
-        elif self.health > 80:
-            color = HEALTH_90
-        elif self.health > 70:
-            color = HEALTH_80
-        elif self.health > 60:
-            color = HEALTH_70
-        elif self.health > 50:
-            color = HEALTH_60
-        elif self.health > 40:
-            color = HEALTH_50
-        elif self.health > 30:
-            color = HEALTH_40
-        elif self.health > 20:
-            color = HEALTH_30
-        elif self.health > 10:
-            color = HEALTH_20
-        elif self.health >= 0:
-            color = HEALTH_10
-        # Creates a rectangle to display the wizard health.
-        width = int(self.rect.width * self.health / WIZARD_HEALTH)
-        self.health_bar = pygame.Rect(0, 0, width, 4)
-        if self.health < WIZARD_HEALTH:
-            pygame.draw.rect(self.image, color, self.health_bar)
-
-class Stone(pygame.sprite.Sprite):
-    '''A class to manage stones which the knight throws.'''
-    def __init__(self, game, position, direction):
-        self.groups = game.all_sprites, game.stones
-        pygame.sprite.Sprite.__init__(self, self.groups)
-        self.game = game
-        self.image = game.stone_image
-        self.rect = self.image.get_rect()
-        self.hit_rect = self.rect
-        # Sets the position of the stone as the position of the knight.
-        self.position = vec(position)
-        self.rect.center = position
-        # Projects the stone in the direction which the knight is facing with a set speed.
-        self.velocity = direction * STONE_SPEED
-        # Measures how long it has been since the stone has been thrown.
-        self.spawn_time = pygame.time.get_ticks()
+        # Keeps the wizard grid up to date so the next wizard sees this wizard's new position.
+        self.game.wizard_grid.move(self)
 
-    def update(self):
-        # Sets the position of the stone by seeing how long it has travelled in a distance at a set speed.
-        self.position += self.velocity * self.game.time
-        self.rect.center = self.position
-        # Deletes stones if the stone hits a wall.
-        if pygame.sprite.spritecollideany(self, self.game.walls):
-            self.kill()
-        # Deletes stones if the stone has existed for longer than 2 seconds.
-        if pygame.time.get_ticks() - self.spawn_time > STONE_TIME:
-            self.kill()
+    # Draws the health bar onto the surface at the wizard's on-screen rectangle.
+    # The bar is never drawn onto self.image, because the image is shared with every other wizard.
+    # Bars come from the HUD's cache, so a bar is only drawn the first time a wizard of that size has that much health.
+    def draw_health(self, surface, screen_rect):
+        bar = self.game.hud.wizard_health_bar(screen_rect.width, self.health)
+        if bar is not None:
+            surface.blit(bar, screen_rect.topleft)
 
 class Obstacle(pygame.sprite.Sprite):
     '''A class to manage walls.'''
@@ -0,0 +1,239 @@
+# Plays generated dungeons (see mapgen.py) of any size by only keeping the regions around the knight loaded.
+# The map is split into square regions of STREAM_REGION_SIZE tiles. The regions within STREAM_RADIUS of the knight's
+# region are loaded: their walls are made into Obstacle sprites, the wall mask, wall grid and flow field cover just them,
+# and their wizards and health potions are spawned. When the knight walks into another region, the regions left behind
+# are unloaded, and whatever was still in them is kept as inactive spawns until they are loaded again.
+# Tiles are read straight from the memory-mapped map file when a chunk of the map is drawn,
+# so memory does not grow with the size of the map.
+import mmap
+import numpy
+import pygame
+from settings import *
+from mapgen import HEADER, DUNGEON_MAGIC, DUNGEON_VERSION, SPAWN, SPAWN_KINDS, WALL
+from tilemap import MapObject
+from spatial import WallMask, WallGrid
+from pathfinding import FlowField
+from sprites import Obstacle, Collectible
+
+class StreamedMap:
+    '''A class to read a generated dungeon (.dgdn) a region at a time, straight from the memory-mapped file.'''
+    streamed = True
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.seed, self.columns, self.rows, tile_size, self.region_size, knight_x, knight_y,
+         wall_count, spawn_count) = HEADER.unpack_from(self.buffer, 0)
+        if magic != DUNGEON_MAGIC or version != DUNGEON_VERSION:
+            raise ValueError('{} is not a dungeon map (or was made by another version of mapgen.py)'.format(filename))
+        if tile_size != TILESIZE:
+            raise ValueError('{} was made for {} pixel tiles'.format(filename, tile_size))
+        self.width = self.columns * TILESIZE
+        self.height = self.rows * TILESIZE
+        self.regions_wide = -(-self.columns // self.region_size)
+        self.regions_high = -(-self.rows // self.region_size)
+        offset = HEADER.size + (-HEADER.size % 4)
+        # One bit per tile, row after row, set where there is a wall.
+        row_bytes = -(-self.columns // 8)
+        self.bits = numpy.frombuffer(self.buffer, dtype='u1', count=self.rows * row_bytes, offset=offset)
+        self.bits = self.bits.reshape(self.rows, row_bytes)
+        offset += self.rows * row_bytes
+        offset += -offset % 4
+        regions = self.regions_wide * self.regions_high
+        self.wall_starts = numpy.frombuffer(self.buffer, dtype='<u4', count=regions + 1, offset=offset)
+        offset += (regions + 1) * 4
+        self.spawn_starts = numpy.frombuffer(self.buffer, dtype='<u4', count=regions + 1, offset=offset)
+        offset += (regions + 1) * 4
+        self.walls = numpy.frombuffer(self.buffer, dtype=WALL, count=wall_count, offset=offset)
+        offset += WALL.itemsize * wall_count
+        self.spawns = numpy.frombuffer(self.buffer, dtype=SPAWN, count=spawn_count, offset=offset)
+        # The game only places the knight from the map's objects. Everything else is spawned region by region.
+        self.objects = [MapObject('knight', knight_x, knight_y, 0, 0)]
+
+    # Returns the region a position (in pixels) is in. Positions off the map count as being in the closest region.
+    def region_for(self, x, y):
+        size = self.region_size * TILESIZE
+        return (min(max(int(x // size), 0), self.regions_wide - 1), min(max(int(y // size), 0), self.regions_high - 1))
+
+    # Returns which tiles have a wall, as an array of columns by rows, for a rectangle of tiles.
+    def tiles(self, left, top, right, bottom):
+        first_byte = left // 8
+        block = numpy.unpackbits(self.bits[top:bottom, first_byte:-(-right // 8)], axis=1)
+        return block[:, left - first_byte * 8:right - first_byte * 8].T.astype(bool)
+
+    # Returns the number of a region's first wall in the map file. The rest of its walls follow it in order.
+    def first_wall(self, region):
+        return int(self.wall_starts[region[1] * self.regions_wide + region[0]])
+
+    # Returns the walls of a region as rectangles in pixels.
+    def region_walls(self, region):
+        index = region[1] * self.regions_wide + region[0]
+        walls = self.walls[self.wall_starts[index]:self.wall_starts[index + 1]]
+        return [pygame.Rect(x * TILESIZE, y * TILESIZE, width * TILESIZE, height * TILESIZE)
+                for x, y, width, height in walls.tolist()]
+
+    # Returns the spawns of a region as it was generated: the kind of each one and where it is (in pixels).
+    def region_spawns(self, region):
+        index = region[1] * self.regions_wide + region[0]
+        spawns = self.spawns[self.spawn_starts[index]:self.spawn_starts[index + 1]]
+        return [(SPAWN_KINDS[kind], x, y) for kind, x, y in spawns.tolist()]
+
+    # Draws only the walls inside a rectangle of the map (in pixels) onto a surface the size of that rectangle,
+    # the same way a GeneratedMap draws its walls.
+    def render_area(self, surface, area):
+        surface.fill(BGCOLOR)
+        first = self.region_for(area.left, area.top)
+        last = self.region_for(area.right - 1, area.bottom - 1)
+        for region_x in range(first[0], last[0] + 1):
+            for region_y in range(first[1], last[1] + 1):
+                for rect in self.region_walls((region_x, region_y)):
+                    if rect.colliderect(area):
+                        pygame.draw.rect(surface, BLACK, rect.move(-area.x, -area.y))
+
+    def render(self, surface):
+        self.render_area(surface, surface.get_rect())
+
+class RegionStreamer:
+    '''A class to load the regions of a streamed map around the knight, and unload the ones it has left behind.'''
+    # Whenever the loaded regions change, only the regions coming into the window have their walls made and their tiles
+    # read from the map, and only the walls of the regions leaving it are removed. The wall grid is changed in place,
+    # and the wall mask is moved along with the rest of its tiles copied over from the old mask.
+    # Every wall keeps its number in the map file in the wall grid, so which wall a sprite is pushed out of first
+    # never depends on the order the regions were loaded in.
+    # Inactive spawns are only kept for regions that have been loaded before, so the memory they use grows with how
+    # much of the map has been explored (and only by what was left in it), not with the size of the map.
+    def __init__(self, game, streamed_map, radius=STREAM_RADIUS):
+        self.game = game
+        self.map = streamed_map
+        self.radius = radius
+        reach = radius * streamed_map.region_size * TILESIZE
+        if reach < AI_FAR_DISTANCE:
+            raise ValueError('{} regions of {} tiles only keep {} pixels loaded around the knight, less than '
+                             'AI_FAR_DISTANCE ({})'.format(radius, streamed_map.region_size, reach, AI_FAR_DISTANCE))
+        self.center = None
+        self.loaded = set()
+        # The Obstacle sprites of each loaded region.
+        self.obstacles = {}
+        # The wizards and health potions left in each unloaded region: (kind, x, y, health) for each of them.
+        self.parked = {}
+
+    # Lists the regions within the radius of a region.
+    def window(self, center):
+        return {(x, y)
+                for x in range(max(0, center[0] - self.radius), min(self.map.regions_wide, center[0] + self.radius + 1))
+                for y in range(max(0, center[1] - self.radius), min(self.map.regions_high, center[1] + self.radius + 1))}
+
+    # Loads the regions around the knight when a game starts.
+    def start(self, position):
+        self.parked = {}
+        self.loaded = set()
+        self.obstacles = {}
+        self.game.wall_grid = WallGrid([])
+        self.move_to(self.map.region_for(*position))
+
+    # Called every tick: moves the loaded regions along when the knight walks into another region.
+    def update(self, position):
+        center = self.map.region_for(*position)
+        if center != self.center:
+            self.move_to(center)
+
+    # Called after a snapshot was restored (see savestate.py). The regions around the knight count as loaded, with the
+    # snapshot's sprites in them, and the unloaded regions get what the snapshot left in them. Every other region
+    # goes back to how it was generated (on a restart, that is every region outside of the knight's).
+    def restored(self, position, parked):
+        self.parked = parked
+        center = self.map.region_for(*position)
+        if center != self.center:
+            self.move_walls(center)
+
+    def move_to(self, center):
+        window = self.window(center)
+        self.park_outside(window)
+        entering = sorted(window - self.loaded)
+        self.move_walls(center)
+        for region in entering:
+            self.spawn(region)
+        self.game.profiler.count('regions_loaded', len(entering))
+
+    # Removes every wizard and health potion outside of the window, and keeps them as their region's inactive spawns.
+    def park_outside(self, window):
+        game = self.game
+        # Regions that are unloaded with nothing left in them stay empty, instead of being spawned again from the map.
+        for region in self.loaded - window:
+            self.parked.setdefault(region, [])
+        for sprite in game.wizards.sprites() + game.collectibles.sprites():
+            region = self.map.region_for(*sprite.position)
+            if region not in window:
+                if isinstance(sprite, Collectible):
+                    self.parked.setdefault(region, []).append((sprite.type, sprite.position.x, sprite.position.y, None))
+                else:
+                    self.parked.setdefault(region, []).append(('wizard', sprite.position.x, sprite.position.y,
+                                                               sprite.health))
+                sprite.kill()
+        horde = game.horde
+        if horde is not None:
+            # Goes through the rows from the last, since removing a row moves the last row into its place.
+            for index in range(horde.count - 1, -1, -1):
+                x, y = horde.position[index]
+                region = self.map.region_for(x, y)
+                if region not in window:
+                    self.parked.setdefault(region, []).append(('wizard', x, y, horde.health[index]))
+                    horde.remove(index)
+
+    # Spawns a region's wizards and health potions: those left in it when it was unloaded, or else those it was made with.
+    def spawn(self, region):
+        if region in self.parked:
+            spawns = self.parked.pop(region)
+        else:
+            spawns = [(kind, x, y, None) for kind, x, y in self.map.region_spawns(region)]
+        for kind, x, y, health in spawns:
+            if kind == 'wizard':
+                wizard = self.game.spawn_wizard(x, y)
+                if health is not None:
+                    wizard.health = health
+            else:
+                Collectible(self.game, x, y, kind)
+
+    # Returns the left, top, right and bottom tiles of the smallest rectangle that covers the regions.
+    def tile_rect(self, regions):
+        size = self.map.region_size
+        return (min(x for x, y in regions) * size, min(y for x, y in regions) * size,
+                min(self.map.columns, (max(x for x, y in regions) + 1) * size),
+                min(self.map.rows, (max(y for x, y in regions) + 1) * size))
+
+    # Moves the walls, wall mask, wall grid and flow field along to the window around a region.
+    def move_walls(self, center):
+        game = self.game
+        window = self.window(center)
+        staying = window & self.loaded
+        entering = sorted(window - self.loaded)
+        for region in sorted(self.loaded - window):
+            obstacles = self.obstacles.pop(region)
+            first = self.map.first_wall(region)
+            game.wall_grid.remove(range(first, first + len(obstacles)))
+            for obstacle in obstacles:
+                obstacle.kill()
+        # The walls of every region are already merged, and no wall crosses from one region into another.
+        for region in entering:
+            obstacles = [Obstacle(game, rect.x, rect.y, rect.width, rect.height) for rect in self.map.region_walls(region)]
+            first = self.map.first_wall(region)
+            game.wall_grid.add(obstacles, range(first, first + len(obstacles)))
+            self.obstacles[region] = obstacles
+        # The mask covers the rectangle of tiles of the window.
+        left, top, right, bottom = self.tile_rect(window)
+        solid = numpy.zeros((right - left, bottom - top), dtype=bool)
+        if staying:
+            # The regions that stay loaded are a rectangle too, and their tiles are copied from the old mask.
+            old = game.wall_mask
+            keep_left, keep_top, keep_right, keep_bottom = self.tile_rect(staying)
+            solid[keep_left - left:keep_right - left, keep_top - top:keep_bottom - top] = old.solid[
+                keep_left - old.origin[0]:keep_right - old.origin[0], keep_top - old.origin[1]:keep_bottom - old.origin[1]]
+        for region in entering:
+            region_left, region_top, region_right, region_bottom = self.tile_rect([region])
+            solid[region_left - left:region_right - left, region_top - top:region_bottom - top] = self.map.tiles(
+                region_left, region_top, region_right, region_bottom)
+        game.wall_mask = WallMask.from_tiles(solid, (left, top))
+        game.wall_grid.mask = game.wall_mask
+        game.flow_field = FlowField(game.wall_mask)
+        self.center = center
+        self.loaded = window
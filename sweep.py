@@ -0,0 +1,196 @@
+# Runs many headless games over a grid of settings and seeds, to help balance the game.
+# Every combination of the values given with --set is run once per seed, on every core:
+#   python sweep.py --set WIZARD_DAMAGE=[5,10,20] --set STONE_DAMAGE=[10,20] --set wizards=[0,50] --seeds 10
+# Any setting from settings.py can be swept, except those only used as default arguments (e.g. STONE_POOL_SIZE),
+# which are read once when the game's modules are loaded. The lowercase names change the spawn layout:
+#   wizards      extra wizards spawned at random open spots
+#   collectibles extra health potions spawned at random open spots
+#   map          null for the Tiled dungeon map, or [width, height] in tiles for a generated map
+#   backend      the wizard backend, 'sprites' or 'arrays'
+# Each run is written to the results file as soon as it finishes. Running the same sweep again skips the runs
+# that are already in the file, so an interrupted sweep carries on where it stopped (use --restart to start over).
+import os
+import csv
+import sys
+import json
+import random
+import argparse
+import importlib
+import itertools
+from os import path
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pygame
+import settings
+from settings import *
+
+# The names that change the spawn layout instead of a setting, and their defaults.
+LAYOUT_DEFAULTS = {'wizards': 0, 'collectibles': 0, 'map': None, 'backend': WIZARD_BACKEND}
+# The modules which copy the settings with 'from settings import *', so a swept setting has to be changed in each.
+SETTING_MODULES = ['settings', 'sprites', 'projectiles', 'horde', 'pathfinding', 'spatial', 'controls', 'hud', 'audio',
+                   'lod', 'governor', 'streaming', 'savestate', 'dungeon_game']
+# The columns written for every run, after the swept names and the seed.
+RESULT_COLUMNS = ['survived', 'died', 'wizards_killed', 'damage_taken', 'health_packs', 'wizards_left',
+                  'ticks', 'tick_ms']
+
+# Changes settings in every module that uses them. Only used inside the sweep's worker processes.
+def apply_settings(values):
+    for module_name in SETTING_MODULES:
+        module = importlib.import_module(module_name)
+        for name, value in values.items():
+            if hasattr(module, name):
+                setattr(module, name, value)
+
+# Plays one game with the given settings and seed, and returns its row of results.
+def run_game(params, seed, seconds, bot=True):
+    # Imported here so that the settings are already in place in this worker process before the game is made.
+    from controls import BotInput, ScriptedInput
+    from dungeon_game import DungeonGame
+    from benchmark import make_lattice_map, spawn_sprites
+    layout = dict(LAYOUT_DEFAULTS)
+    changed = {}
+    for name, value in params.items():
+        if name in layout:
+            layout[name] = value
+        else:
+            changed[name] = value
+    defaults = {name: getattr(settings, name) for name in changed}
+    apply_settings(changed)
+    try:
+        if bot:
+            controls = BotInput()
+        else:
+            controls = ScriptedInput()
+            controls.press(pygame.K_UP, pygame.K_LEFT, pygame.K_SPACE)
+        game_map = make_lattice_map(*layout['map']) if layout['map'] is not None else None
+        game = DungeonGame(headless=True, input_provider=controls, seed=seed, game_map=game_map,
+                           wizard_backend=layout['backend'])
+        game.new()
+        spawn_sprites(game, {'wizards': layout['wizards'], 'collectibles': layout['collectibles'], 'stones': 0},
+                      random.Random(seed))
+        start = perf_counter()
+        ticks = game.simulate(seconds)
+        elapsed = perf_counter() - start
+        game.assets.shutdown()
+        wizards_left = len(game.wizards) + (len(game.horde) if game.horde is not None else 0)
+    finally:
+        # Puts the settings back, since the worker process is used again for other runs.
+        apply_settings(defaults)
+    row = params_row(params)
+    row.update({
+        'seed': seed,
+        'survived': round(ticks * SIM_DT, 3),
+        'died': int(not game.playing),
+        'wizards_killed': game.stats['wizards_killed'],
+        'damage_taken': game.stats['damage_taken'],
+        'health_packs': game.stats['health_packs'],
+        'wizards_left': wizards_left,
+        'ticks': ticks,
+        'tick_ms': round(elapsed / max(1, ticks) * 1000, 4),
+    })
+    return row
+
+# Turns '--set NAME=[values]' arguments into a dictionary of the values to try for each name.
+def parse_grid(assignments, parser):
+    grid = {}
+    for assignment in assignments:
+        name, _, values = assignment.partition('=')
+        if name not in LAYOUT_DEFAULTS and not hasattr(settings, name):
+            parser.error('{} is not a setting or a layout name'.format(name))
+        try:
+            values = json.loads(values)
+        except ValueError:
+            parser.error('the values for {} must be a JSON list, e.g. {}=[1,2,3]'.format(name, name))
+        if not isinstance(values, list):
+            values = [values]
+        grid[name] = values
+    return grid
+
+# Lists every (params, seed) run in the sweep.
+def sweep_runs(grid, seeds):
+    names = sorted(grid)
+    runs = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        for seed in seeds:
+            runs.append((dict(zip(names, values)), seed))
+    return runs
+
+# Writes a run's settings as JSON, the way they are stored in the results file.
+def params_row(params):
+    return {name: json.dumps(value) for name, value in params.items()}
+
+# The key of a run, the same whether it comes from the grid or from a row read back from the results file.
+def run_key(names, row):
+    return tuple(str(row[name]) for name in names) + (str(row['seed']),)
+
+# Reads the keys of the runs already in a results file, so they are not run again.
+def finished_runs(filename, columns):
+    if not path.exists(filename):
+        return set()
+    with open(filename, newline='') as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames != columns:
+            sys.exit('{} was made by a different sweep; use --restart or another --out file'.format(filename))
+        return {run_key(columns[:-len(RESULT_COLUMNS) - 1], row) for row in reader}
+
+# Prints the average results of each combination of settings.
+def print_summary(filename, names):
+    totals = {}
+    with open(filename, newline='') as file:
+        for row in csv.DictReader(file):
+            key = tuple(row[name] for name in names)
+            total = totals.setdefault(key, {'runs': 0, 'survived': 0, 'wizards_killed': 0, 'damage_taken': 0})
+            total['runs'] += 1
+            for column in ('survived', 'wizards_killed', 'damage_taken'):
+                total[column] += float(row[column])
+    print('{:<50} {:>5} {:>9} {:>7} {:>7}'.format(', '.join(names) or 'settings', 'runs', 'survived', 'killed', 'damage'))
+    for key, total in sorted(totals.items()):
+        runs = total['runs']
+        print('{:<50} {:>5} {:>9.1f} {:>7.1f} {:>7.1f}'.format(
+            ', '.join(key) or 'default', runs, total['survived'] / runs, total['wizards_killed'] / runs,
+            total['damage_taken'] / runs))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run headless games over a grid of settings to balance the game.')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=[VALUES]',
+                        help='a setting or layout name and a JSON list of values to try for it')
+    parser.add_argument('--seeds', type=int, default=5, help='number of seeds to run each combination with')
+    parser.add_argument('--seconds', type=float, default=SWEEP_SECONDS, help='game seconds each run lasts at most')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes (default: every core)')
+    parser.add_argument('--out', default=SWEEP_FILE, help='CSV file the results are written to')
+    parser.add_argument('--scripted', action='store_true',
+                        help='hold up, left and space instead of letting the bot play the knight')
+    parser.add_argument('--restart', action='store_true', help='throw away the results already in the file')
+    args = parser.parse_args()
+
+    grid = parse_grid(args.set, parser)
+    names = sorted(grid)
+    columns = names + ['seed'] + RESULT_COLUMNS
+    if args.restart and path.exists(args.out):
+        os.remove(args.out)
+    done = finished_runs(args.out, columns)
+    runs = [(params, seed) for params, seed in sweep_runs(grid, range(args.seeds))
+            if run_key(names, dict(params_row(params), seed=seed)) not in done]
+    print('{} runs in the sweep, {} already finished, {} to run on {} processes.'.format(
+        len(runs) + len(done), len(done), len(runs), args.workers))
+
+    new_file = not path.exists(args.out)
+    with open(args.out, 'a', newline='') as file:
+        writer = csv.DictWriter(file, columns)
+        if new_file:
+            writer.writeheader()
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        try:
+            futures = [executor.submit(run_game, params, seed, args.seconds, not args.scripted) for params, seed in runs]
+            for finished, future in enumerate(as_completed(futures), 1):
+                # Writes each run as soon as it finishes, so nothing is lost if the sweep is stopped.
+                writer.writerow(future.result())
+                file.flush()
+                print('\r{}/{} runs finished'.format(finished, len(runs)), end='', flush=True)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    print()
+    print_summary(args.out, names)
+
+if __name__ == '__main__':
+    main()
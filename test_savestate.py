@@ -0,0 +1,39 @@
+# Tests for saving and loading games in progress (see savestate.py). Run them with: python -m pytest
+import random
+from settings import *
+from tilemap import GeneratedMap, MapObject
+from controls import BotInput
+from dungeon_game import DungeonGame
+from benchmark import make_lattice_map, random_open_position
+from replay import state_digest
+from savestate import save_game, load_game
+
+# Makes a headless game on a small generated map with a few wizards on it, so its sprite pool starts out small.
+def make_game(seed=3, wizards=12):
+    lattice = make_lattice_map(60, 60)
+    rng = random.Random(seed)
+    objects = list(lattice.objects)
+    for _ in range(wizards):
+        objects.append(MapObject('wizard', rng.uniform(2, 58) * TILESIZE, rng.uniform(2, 58) * TILESIZE, 0, 0))
+    game = DungeonGame(headless=True, input_provider=BotInput(), seed=seed, game_map=GeneratedMap(60, 60, objects))
+    game.new()
+    return game
+
+# A save with more wizards than a fresh game's sprite pool holds has to play on exactly as the saved game did,
+# so making the extra wizards must not use up any of the restored random numbers.
+def test_load_with_more_wizards_than_the_pool(tmp_path):
+    game = make_game()
+    rng = random.Random(1)
+    for _ in range(20):
+        game.spawn_wizard(*random_open_position(game, rng))
+    game.simulate(.5)
+    filename = str(tmp_path / SAVE_FILE)
+    save_game(game, filename)
+    game.simulate(1)
+
+    loaded = make_game()
+    assert len(loaded.sprite_pool.wizards) < 32
+    load_game(loaded, filename)
+    loaded.simulate(1)
+    assert state_digest(loaded) == state_digest(game)
+    assert loaded.random.random() == game.random.random()
@@ -1,7 +1,11 @@
 import pygame
 import pytmx
+from collections import namedtuple, OrderedDict
 from settings import *
 
+# An object placed on a map (a wall, or a spawn point for the knight, a wizard or a health potion).
+MapObject = namedtuple('MapObject', ['name', 'x', 'y', 'width', 'height'])
+
 # A function which will check for collisions between the edge of the Tiled map and the viewing screen.
 def collide_hit_rect(one, two):
     return one.hit_rect.colliderect(two.rect)
@@ -13,6 +17,7 @@ class TiledMap:
         self.width = tiled_map.width * tiled_map.tilewidth
         self.height = tiled_map.height * tiled_map.tileheight
         self.tmxdata = tiled_map
+        self.objects = tiled_map.objects
 
     # Draws the four layers of my Tiled map onto the surface of my game.
     def render(self, surface):
@@ -24,16 +29,152 @@ class TiledMap:
                     if tile:
                         surface.blit(tile, (x * self.tmxdata.tilewidth, y * self.tmxdata.tileheight))
 
+    # Draws only the tiles inside a rectangle of the map (in pixels) onto a surface the size of that rectangle.
+    def render_area(self, surface, area):
+        tile_image = self.tmxdata.get_tile_image_by_gid
+        tilewidth = self.tmxdata.tilewidth
+        tileheight = self.tmxdata.tileheight
+        first_x = area.left // tilewidth
+        last_x = min(self.tmxdata.width, -(-area.right // tilewidth))
+        first_y = area.top // tileheight
+        last_y = min(self.tmxdata.height, -(-area.bottom // tileheight))
+        for layer in self.tmxdata.visible_layers:
+            if isinstance(layer, pytmx.TiledTileLayer):
+                for y in range(first_y, last_y):
+                    row = layer.data[y]
+                    for x in range(first_x, last_x):
+                        tile = tile_image(row[x])
+                        if tile:
+                            surface.blit(tile, (x * tilewidth - area.left, y * tileheight - area.top))
+
+    def make_map(self):
+        temporary_surface = pygame.Surface((self.width, self.height))
+        self.render(temporary_surface)
+        return temporary_surface
+
+class GeneratedMap:
+    '''A class to manage a map that is made in code instead of in Tiled (e.g. for benchmarks).'''
+    # The width and height are in tiles, and the objects are MapObjects in pixels.
+    def __init__(self, width, height, objects):
+        self.width = width * TILESIZE
+        self.height = height * TILESIZE
+        self.objects = list(objects)
+
+    # Draws the walls as filled rectangles on a plain background.
+    def render(self, surface):
+        surface.fill(BGCOLOR)
+        for tile_object in self.objects:
+            if tile_object.name == 'wall':
+                pygame.draw.rect(surface, BLACK, (tile_object.x, tile_object.y, tile_object.width, tile_object.height))
+
+    # Draws only the walls inside a rectangle of the map (in pixels) onto a surface the size of that rectangle.
+    def render_area(self, surface, area):
+        surface.fill(BGCOLOR)
+        for tile_object in self.objects:
+            if tile_object.name == 'wall':
+                rect = pygame.Rect(tile_object.x, tile_object.y, tile_object.width, tile_object.height)
+                if rect.colliderect(area):
+                    pygame.draw.rect(surface, BLACK, rect.move(-area.x, -area.y))
+
     def make_map(self):
         temporary_surface = pygame.Surface((self.width, self.height))
         self.render(temporary_surface)
         return temporary_surface
 
+class ChunkedMap:
+    '''A class to draw a map in square chunks which are only rendered once the camera can see them.'''
+    # Rendered chunks are kept in a cache which forgets the least recently seen chunks once it uses more than the budget (in bytes).
+    def __init__(self, game_map, chunk_size=CHUNK_SIZE, budget=CHUNK_CACHE_BUDGET):
+        self.map = game_map
+        self.width = game_map.width
+        self.height = game_map.height
+        self.chunk_size = chunk_size
+        self.budget = budget
+        self.chunks = OrderedDict()
+        self.memory = 0
+        # Images stamped onto the map (the crosses where wizards died), kept per chunk so they survive a chunk being forgotten.
+        self.decals = {}
+        # The position of every decal, in the order they were added (used to save a game, see savestate.py).
+        self.decal_positions = []
+
+    # Returns the part of the map (in pixels) that a chunk covers.
+    def chunk_rect(self, chunk):
+        size = self.chunk_size
+        rect = pygame.Rect(chunk[0] * size, chunk[1] * size, size, size)
+        return rect.clip(pygame.Rect(0, 0, self.width, self.height))
+
+    # Lists the chunks that a rectangle of the map (in pixels) overlaps.
+    def chunks_for(self, rect):
+        rect = rect.clip(pygame.Rect(0, 0, self.width, self.height))
+        if not rect.width or not rect.height:
+            return []
+        size = self.chunk_size
+        return [(x, y) for y in range(rect.top // size, (rect.bottom - 1) // size + 1)
+                for x in range(rect.left // size, (rect.right - 1) // size + 1)]
+
+    # Returns the surface of a chunk, rendering it first if it is not in the cache.
+    def get_chunk(self, chunk):
+        surface = self.chunks.get(chunk)
+        if surface is not None:
+            self.chunks.move_to_end(chunk)
+            return surface
+        rect = self.chunk_rect(chunk)
+        surface = pygame.Surface(rect.size)
+        # Converting the chunk to the screen's pixel format makes blitting it faster.
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        self.map.render_area(surface, rect)
+        for image, position in self.decals.get(chunk, ()):
+            surface.blit(image, (position[0] - rect.x, position[1] - rect.y))
+        self.chunks[chunk] = surface
+        self.memory += surface.get_bytesize() * rect.width * rect.height
+        # Forgets the least recently seen chunks until the cache fits in its budget again (always keeping this chunk).
+        while self.memory > self.budget and len(self.chunks) > 1:
+            old_chunk, old_surface = self.chunks.popitem(last=False)
+            self.memory -= old_surface.get_bytesize() * old_surface.get_width() * old_surface.get_height()
+        return surface
+
+    # Stamps an image onto the map at a position (in pixels), e.g. a cross where a wizard died.
+    def add_decal(self, image, position):
+        position = (int(position[0]), int(position[1]))
+        rect = image.get_rect(topleft=position)
+        self.decal_positions.append(position)
+        for chunk in self.chunks_for(rect):
+            self.decals.setdefault(chunk, []).append((image, position))
+            # Chunks that are already rendered get the image straight away.
+            if chunk in self.chunks:
+                chunk_rect = self.chunk_rect(chunk)
+                self.chunks[chunk].blit(image, (position[0] - chunk_rect.x, position[1] - chunk_rect.y))
+
+    # Removes every decal, e.g. when the game restarts.
+    def clear_decals(self):
+        for chunk in self.decals:
+            surface = self.chunks.pop(chunk, None)
+            if surface is not None:
+                self.memory -= surface.get_bytesize() * surface.get_width() * surface.get_height()
+        self.decals = {}
+        self.decal_positions = []
+
+    # Draws the chunks the camera can see onto the screen.
+    def draw(self, surface, camera):
+        for chunk in self.chunks_for(camera.view_rect()):
+            surface.blit(self.get_chunk(chunk), camera.apply_rect(self.chunk_rect(chunk)))
+
+    # Draws the map back over one rectangle of the screen, e.g. to erase where a sprite was.
+    def draw_area(self, surface, screen_rect, camera):
+        area = screen_rect.move(-camera.camera.x, -camera.camera.y)
+        for chunk in self.chunks_for(area):
+            chunk_rect = self.chunk_rect(chunk)
+            overlap = area.clip(chunk_rect)
+            surface.blit(self.get_chunk(chunk), camera.apply_rect(overlap), overlap.move(-chunk_rect.x, -chunk_rect.y))
+
 class Camera:
     '''A class to shift the screen of view as the knight moves.'''
     # Passes in the width and height of the camera (or viewing screen e.g. the visible part of the map).
     def __init__(self, width, height):
         self.camera = pygame.Rect(0, 0, width, height)
+        # Where the camera was before its last update, so it can be drawn part of the way between the two.
+        self.previous = self.camera
         self.width = width
         self.height = height
 
@@ -45,7 +186,21 @@ class Camera:
     def apply_rect(self, rect):
         return rect.move(self.camera.topleft)
 
+    # Returns the part of the map that is on the screen, in map coordinates.
+    def view_rect(self):
+        return pygame.Rect(-self.camera.x, -self.camera.y, WIDTH, HEIGHT)
+
+    # Returns a copy of the camera placed a fraction (alpha) of the way from its previous position to its current one.
+    def interpolated(self, alpha):
+        camera = Camera(self.width, self.height)
+        x = self.previous.x + (self.camera.x - self.previous.x) * alpha
+        y = self.previous.y + (self.camera.y - self.previous.y) * alpha
+        camera.camera = pygame.Rect(round(x), round(y), self.width, self.height)
+        camera.previous = camera.camera
+        return camera
+
     def update(self, target):
+        self.previous = self.camera
         # Needs to be negative, because if the knight moves right, the camera offset needs to shift left.
         # Adding half of the screen size (int(WIDTH or HEIGHT / 2)) will keep the knight centered in the screen.
         x = -target.rect.centerx + int(WIDTH / 2)